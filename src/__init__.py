@@ -13,6 +13,13 @@ from src.api.notifications import notifications
 from src.api.rst import rst
 from src.api.adminConsole import adminConsole
 from src.api.rosters import rosters
+from src.common import outbox
+from src.common.scheduler import scheduler
+from src.common.queries import (
+    NEXT_CURSOR_HEADER,
+    check_indexes,
+    init_cursors,
+)
 from flask import Flask, jsonify
 from flask_cors import CORS
 from flasgger import Swagger
@@ -23,6 +30,10 @@ from dotenv import load_dotenv
 load_dotenv()
 
 schemapath = path.join(path.abspath(path.dirname(__file__)), "schemas.yml")
+rootpath = path.dirname(path.abspath(path.dirname(__file__)))
+indexespath = environ.get(
+    "FIRESTORE_INDEXES", path.join(rootpath, "firestore.indexes.json")
+)
 schemastream = open(schemapath, "r")
 schema = yaml.load(schemastream, Loader=yaml.FullLoader)
 schemastream.close()
@@ -54,7 +65,7 @@ swagger_specs = {
 
 def create_app():
     app = Flask(__name__)
-    CORS(app)
+    CORS(app, expose_headers=["ETag", NEXT_CURSOR_HEADER])
 
     swagger = Swagger(app, template=swagger_specs)
 
@@ -67,9 +78,31 @@ def create_app():
     app.register_blueprint(notifications, url_prefix="/notifications")
     app.register_blueprint(adminConsole, url_prefix="/adminConsole")
     app.register_blueprint(rosters, url_prefix="/rosters")
+
+    # the tests sign their cursors with a fixed key, the app needs its own
+    cursor_secret = environ.get("CURSOR_SECRET_KEY")
+    if not cursor_secret and int(environ.get("TESTING", 0)) == 1:
+        cursor_secret = "testing"
+    init_cursors(cursor_secret)
+
+    # fail fast when a list endpoint could issue a query without an index
+    if path.exists(indexespath):
+        check_indexes(indexespath)
+
+    # retry the side effects that failed or were lost with their process and
+    # run the scheduled notifications, only in the processes serving requests
+    # and not in the cli commands, which create the app as well
+    if int(environ.get("TESTING", 0)) != 1:
+        app.before_first_request(start_workers)
+
     return app
 
 
+def start_workers() -> None:
+    outbox.start_sweeper()
+    scheduler.start()
+
+
 app = create_app()
 
 
@@ -6,10 +6,21 @@
     Functions:
         main()
         test()
+        backfill_file_timestamps()
+        move_file_timestamps_to_history()
+        move_fcm_tokens_to_devices()
+        reconcile_file_counters()
+        benchmark_scheduler()
 """
 from src import app
+from src.common import file_counters, migrations
+from src.common.timing_wheel import TimingWheel
 from os import environ
 from flask.cli import FlaskGroup
+import click
+import random
+import time
+import tracemalloc
 
 try:
     import pytest
@@ -35,5 +46,76 @@ def test():
         print("pytest not present")
 
 
+@cli.command()
+def backfill_file_timestamps():
+    updated: int = migrations.backfill_file_timestamps()
+    print("Backfilled %d files" % updated)
+
+
+@cli.command()
+def move_file_timestamps_to_history():
+    migrated: int = migrations.move_file_timestamps_to_history()
+    print("Moved the history of %d files" % migrated)
+
+
+@cli.command()
+def move_fcm_tokens_to_devices():
+    migrated: int = migrations.move_fcm_tokens_to_devices()
+    print("Moved the FCM tokens of %d users" % migrated)
+
+
+@cli.command()
+def reconcile_file_counters():
+    repaired: int = file_counters.reconcile()
+    print("Repaired %d file counters" % repaired)
+
+
+@cli.command()
+@click.option("--reminders", default=1_000_000, help="Pending reminders.")
+@click.option("--days", default=30, help="Days the reminders spread over.")
+def benchmark_scheduler(reminders: int, days: int):
+    start: float = time.time()
+    tracemalloc.start()
+    wheel: TimingWheel = TimingWheel(start)
+
+    began: float = time.perf_counter()
+    for reminder in range(reminders):
+        wheel.add(str(reminder), start + random.uniform(0, days * 86400))
+    added: float = time.perf_counter() - began
+    memory: int = tracemalloc.get_traced_memory()[0]
+
+    began = time.perf_counter()
+    for reminder in range(0, reminders, 10):
+        wheel.cancel(str(reminder))
+    cancelled: float = time.perf_counter() - began
+
+    # a day of one second ticks, timing each of them
+    ticks: list = []
+    due: int = 0
+    for second in range(1, 86401):
+        began = time.perf_counter()
+        due += len(wheel.advance(start + second))
+        ticks.append(time.perf_counter() - began)
+    tracemalloc.stop()
+
+    ticks.sort()
+    print("%d reminders over %d days" % (reminders, days))
+    print("add: %.2f us each" % (added / reminders * 1e6))
+    print("cancel: %.2f us each" % (cancelled / (reminders / 10) * 1e6))
+    print(
+        "memory: %.1f MB, %d bytes each"
+        % (memory / 2**20, memory / reminders)
+    )
+    print(
+        "tick: median %.2f us, p99 %.2f us, max %.2f ms, %d due in a day"
+        % (
+            ticks[len(ticks) // 2] * 1e6,
+            ticks[len(ticks) * 99 // 100] * 1e6,
+            ticks[-1] * 1e3,
+            due,
+        )
+    )
+
+
 if __name__ == "__main__":
     cli()
@@ -4,6 +4,7 @@ from src.api import Blueprint
 from src.common.database import db
 from src.common.decorators import admin_only, check_token
 from src.api.notifications import create_notification
+from src.common import topics
 import pandas as pd
 """
 firebase_admin : General firebase admin functions
@@ -58,6 +59,7 @@ def register_user ():
                 }
         
         db.collection('User').document(userRecord.uid).set(entry)
+        topics.change_unit(userRecord.uid, None, entry["unit_name"])
 
         response = jsonify({"message" : "User successfully registed"})
         response.status_code = 200
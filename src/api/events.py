@@ -8,6 +8,7 @@
         update_event()
         get_event()
         get_events()
+        notify_invitees()
 """
 from datetime import datetime
 from itertools import chain
@@ -19,9 +20,16 @@ from werkzeug.exceptions import BadRequest, NotFound, Unauthorized
 
 from src.api import Blueprint
 from src.api import notifications
-from src.api.notifications import create_notification
+from src.api.notifications import (
+    create_notification,
+    create_notifications,
+)
+from src.common import outbox
+from src.common.batches import ChunkedBatch
 from src.common.database import db
 from src.common.decorators import check_token
+from src.common.queries import ListQuery, paginated
+from src.common.unread_counters import stage_unread
 from src.common.notifications import (
     add_scheduled_notification,
     cancel_scheduled_notification,
@@ -29,6 +37,51 @@ from src.common.notifications import (
 
 events: Blueprint = Blueprint("events", __name__)
 
+# the get_events queries by target, optional filters come from the request
+EVENT_SUMMARY: list = [
+    "event_id",
+    "author",
+    "title",
+    "type",
+    "starttime",
+    "endtime",
+    "period",
+    "organizer",
+    "location",
+    "unit",
+    "timestamp",
+]
+INVITED_EVENTS: ListQuery = (
+    ListQuery(
+        "Scheduled-Events",
+        order_by="timestamp",
+        page_limit=100,
+        summary=EVENT_SUMMARY,
+    )
+    .where("invitees_dod", "array_contains", value="dod")
+    .optional("type")
+)
+CONFIRMED_EVENTS: ListQuery = (
+    ListQuery(
+        "Scheduled-Events",
+        order_by="timestamp",
+        page_limit=100,
+        summary=EVENT_SUMMARY,
+    )
+    .where("confirmed_dod", "array_contains", value="dod")
+    .optional("type")
+)
+CREATED_EVENTS: ListQuery = (
+    ListQuery(
+        "Scheduled-Events",
+        order_by="timestamp",
+        page_limit=100,
+        summary=EVENT_SUMMARY,
+    )
+    .where("author")
+    .optional("type")
+)
+
 
 @events.post("/create_event")
 @check_token
@@ -99,6 +152,10 @@ def create_event() -> Response:
     if "organizer" not in data or not data.get("organizer").strip():
         return BadRequest("Missing the organizer")
 
+    # the invitees are notified after the commit, check they exist before
+    if notifications.missing_dods(data.get("invitees_dod")):
+        return NotFound("The invitee was not found")
+
     entry: dict = dict()
     entry["author"] = uid
     entry["event_id"] = str(uuid4())
@@ -115,53 +172,25 @@ def create_event() -> Response:
     entry["weekly"] = data.get("weekly")
     entry["yearly"] = data.get("yearly")
 
-    # write to Firestore DB
-    db.collection("Scheduled-Events").document(entry.get("event_id")).set(entry)
-
-    # notify users
-    try:
-        fcm_tokens: list = list()
-        for dod in data.get("invitees_dod"):
-            # get to_user uid.
-            receiver_docs = (
-                db.collection("User").where("dod", "==", dod).limit(1).stream()
-            )
-
-            receiver_list: list = []
-            for doc in receiver_docs:
-                receiver_list.append(doc.to_dict())
-
-            receiver: dict = receiver_list[0]
-
-            if receiver.get("FCMToken"):
-                fcm_tokens.append(receiver.get("FCMToken"))
-
-            create_notification(
-                notification_type="invite to an event",
-                type=entry.get("type"),
-                sender=uid,
-                id=entry.get("event_id"),
-                receiver_dod=dod,
-                sender_name=user.get("name"),
-            )
-
-    except:
-        return NotFound("The invitee was not found")
-
-    if fcm_tokens:
-        timer_id: str = add_scheduled_notification(
-            data.get("starttime"),
-            fcm_tokens,
-            {
-                "title": "event invitation",
-                "body": (
-                    user.get("name") + " invite you to " + entry.get("type")
-                ),
-            },
-        )
-        db.collection("Scheduled-Events").document(
-            entry.get("event_id")
-        ).update({"timer_id": timer_id})
+    # write to Firestore DB, the invitees are notified once it is committed
+    batch = db.batch()
+    batch.set(
+        db.collection("Scheduled-Events").document(entry.get("event_id")),
+        entry,
+    )
+    notification = outbox.stage(
+        batch,
+        notify_invitees,
+        event_id=entry.get("event_id"),
+        event_type=entry.get("type"),
+        dods=data.get("invitees_dod"),
+        notification_type="invite to an event",
+        sender=uid,
+        sender_name=user.get("name"),
+        reminder=True,
+    )
+    batch.commit()
+    outbox.dispatch(notification)
 
     # return Response 201 for successfully creating a new resource
     return Response(response="Event added", status=201)
@@ -226,41 +255,41 @@ def delete_event(event_id: str) -> Response:
             "The user is not authorized to retrieve this content", 401
         )
 
-    # notify users
-    try:
-        for dod in event.get("invitees_dod"):
-            create_notification(
-                notification_type="event canceled",
-                type=event.get("type"),
-                sender=uid,
-                id=event.get("event_id"),
-                receiver_dod=dod,
-                sender_name=user.get("name"),
-            )
-
-        for dod in event.get("confirmed_dod"):
-            create_notification(
-                notification_type="event canceled",
-                type=event.get("type"),
-                sender=uid,
-                id=event.get("event_id"),
-                receiver_dod=dod,
-                sender_name=user.get("name"),
-            )
-    except:
-        return NotFound("The invitee was not found")
+    # notify users once the event is deleted
+    batch = db.batch()
+    notification = outbox.stage(
+        batch,
+        notify_invitees,
+        event_id=event.get("event_id"),
+        event_type=event.get("type"),
+        dods=event.get("invitees_dod") + event.get("confirmed_dod"),
+        notification_type="event canceled",
+        sender=uid,
+        sender_name=user.get("name"),
+    )
 
     if "timer_id" in event:
         cancel_scheduled_notification(event.get("timer_id"))
 
     # delete the notifications about this event.
     notifications_docs = (
-        db.collection("Notification").where("id", "==", event).stream()
+        db.collection("Notification")
+        .where("id", "==", event.get("event_id"))
+        .stream()
     )
+    deletes: ChunkedBatch = ChunkedBatch()
     for notification_doc in notifications_docs:
-        notification_doc.reference.delete()
-
-    event_ref.delete()
+        invite: dict = notification_doc.to_dict()
+        # an invite and the unread count it takes away go together
+        deletes.reserve(2)
+        deletes.delete(notification_doc.reference)
+        if not invite.get("read"):
+            stage_unread(deletes, invite.get("receiver"), -1)
+    deletes.commit()
+
+    batch.delete(event_ref)
+    batch.commit()
+    outbox.dispatch(notification)
     return Response(response="Event deleted", status=200)
 
 
@@ -326,92 +355,34 @@ def update_event() -> Response:
         )
 
     # update event by given parameter
-    if "starttime" in data:
-        event_ref.update({"starttime": data.get("starttime")})
-    if "endtime" in data:
-        event_ref.update({"endtime": data.get("endtime")})
-    if "period" in data:
-        event_ref.update({"period": data.get("period")})
-    if "type" in data and data.get("type").strip():
-        event_ref.update({"type": data.get("type")})
-    if "title" in data and data.get("title").strip():
-        event_ref.update({"title": data.get("title")})
-    if "description" in data and data.get("description").strip():
-        event_ref.update({"description": data.get("description")})
-    if "organizer" in data and data.get("organizer").strip():
-        event_ref.update({"organizer": data.get("organizer")})
-
+    changes: dict = dict()
+    for field in ("starttime", "endtime", "period"):
+        if field in data:
+            changes[field] = data.get(field)
+    for field in ("type", "title", "description", "organizer"):
+        if field in data and data.get(field).strip():
+            changes[field] = data.get(field)
     if "new_invitees" in data and data.get("new_invitees"):
-        event_ref.update({"invitees_dod": data.get("new_invitees")})
-
-    # fetch event data from firestore
-    event_ref = db.collection("Scheduled-Events").document(event_id)
-    event: dict = event_ref.get().to_dict()
-    # notify users
-    try:
-        fcm_tokens: list = list()
-        for dod in event.get("invitees_dod"):
-            # get to_user uid.
-            receiver_docs = (
-                db.collection("User").where("dod", "==", dod).limit(1).stream()
-            )
-
-            receiver_list: list = []
-            for doc in receiver_docs:
-                receiver_list.append(doc.to_dict())
-
-            receiver: dict = receiver_list[0]
-
-            if receiver.get("FCMToken"):
-                fcm_tokens.append(receiver.get("FCMToken"))
-            create_notification(
-                notification_type="event updated",
-                type=event.get("type"),
-                sender=uid,
-                id=event.get("event_id"),
-                receiver_dod=dod,
-                sender_name=user.get("name"),
-            )
-        for dod in event.get("confirmed_dod"):
-            # get to_user uid.
-            receiver_docs = (
-                db.collection("User").where("dod", "==", dod).limit(1).stream()
-            )
-
-            receiver_list: list = []
-            for doc in receiver_docs:
-                receiver_list.append(doc.to_dict())
-
-            receiver: dict = receiver_list[0]
-
-            if receiver.get("FCMToken"):
-                fcm_tokens.append(receiver.get("FCMToken"))
-            create_notification(
-                notification_type="event updated",
-                type=event.get("type"),
-                sender=uid,
-                id=event.get("event_id"),
-                receiver_dod=dod,
-                sender_name=user.get("name"),
-            )
-    except:
-        return NotFound("The invitee was not found")
-
-    if "timer_id" in event:
-        cancel_scheduled_notification(event.get("timer_id"))
-        timer_id: str = add_scheduled_notification(
-            event.get("starttime"),
-            fcm_tokens,
-            {
-                "title": "event invitation",
-                "body": (
-                    user.get("name") + " invite you to " + event.get("type")
-                ),
-            },
-        )
-        db.collection("Scheduled-Events").document(
-            event.get("event_id")
-        ).update({"timer_id": timer_id})
+        changes["invitees_dod"] = data.get("new_invitees")
+    event.update(changes)
+
+    # notify users once the event is updated
+    batch = db.batch()
+    if changes:
+        batch.update(event_ref, changes)
+    notification = outbox.stage(
+        batch,
+        notify_invitees,
+        event_id=event.get("event_id"),
+        event_type=event.get("type"),
+        dods=event.get("invitees_dod") + event.get("confirmed_dod"),
+        notification_type="event updated",
+        sender=uid,
+        sender_name=user.get("name"),
+        reminder="timer_id" in event,
+    )
+    batch.commit()
+    outbox.dispatch(notification)
 
     return Response(response="Event updated", status=200)
 
@@ -526,6 +497,18 @@ def get_events() -> Response:
             type: integer
           example: default is 10.
           required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+        - in: query
+          name: fields
+          schema:
+            type: string
+          description: Comma separated fields to return, * for all fields
+          required: false
         - in: query
           name: target
           schema:
@@ -563,104 +546,31 @@ def get_events() -> Response:
         return NotFound("The user was not found")
     user: dict = user_ref.get().to_dict()
 
-    page_limit: int = request.args.get("page_limit", type=int, default=100)
     target: int = request.args.get("target", type=int, default=1)
 
-    if "type" in request.args:
-        type: str = request.args.get("type", type=str)
-        if target == 0:
-            docs: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("invitees_dod", "array_contains", user.get("dod"))
-                .where("type", "==", type)
-                .limit(page_limit)
-                .stream()
-            )
-        elif target == 1:
-            docs: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("confirmed_dod", "array_contains", user.get("dod"))
-                .where("type", "==", type)
-                .limit(page_limit)
-                .stream()
-            )
-        elif target == 2:
-            docs1: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("invitees_dod", "array_contains", user.get("dod"))
-                .where("type", "==", type)
-                .limit(page_limit)
-                .stream()
-            )
-            docs2: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("confirmed_dod", "array_contains", user.get("dod"))
-                .where("type", "==", type)
-                .limit(page_limit)
-                .stream()
-            )
-            docs = chain(docs1, docs2)
-        else:
-            docs: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("author", "==", uid)
-                .where("type", "==", type)
-                .limit(page_limit)
-                .stream()
-            )
+    if target == 0:
+        pages: list = [INVITED_EVENTS.page(request.args, dod=user.get("dod"))]
+    elif target == 1:
+        pages = [CONFIRMED_EVENTS.page(request.args, dod=user.get("dod"))]
+    elif target == 2:
+        # both queries are paged through side by side
+        pages = [
+            INVITED_EVENTS.page(
+                request.args, cursor_key="invited", dod=user.get("dod")
+            ),
+            CONFIRMED_EVENTS.page(
+                request.args, cursor_key="confirmed", dod=user.get("dod")
+            ),
+        ]
     else:
-        if target == 0:
-            docs: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("invitees_dod", "array_contains", user.get("dod"))
-                .limit(page_limit)
-                .stream()
-            )
-        elif target == 1:
-            docs: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("confirmed_dod", "array_contains", user.get("dod"))
-                .limit(page_limit)
-                .stream()
-            )
-        elif target == 2:
-            docs1: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("invitees_dod", "array_contains", user.get("dod"))
-                .limit(page_limit)
-                .stream()
-            )
-            docs2: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("confirmed_dod", "array_contains", user.get("dod"))
-                .limit(page_limit)
-                .stream()
-            )
-            docs = chain(docs1, docs2)
-        else:
-            docs: list = (
-                db.collection("Scheduled-Events")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("author", "==", uid)
-                .limit(page_limit)
-                .stream()
-            )
+        pages = [CREATED_EVENTS.page(request.args, author=uid)]
 
     events: list = []
-    for doc in docs:
+    for doc in chain(*(page.docs for page in pages)):
         temp: dict = doc.to_dict()
         events.append(temp)
 
-    return jsonify(events), 200
+    return paginated(events, *pages)
 
 
 @events.get("/get_event/<event_id>")
@@ -780,16 +690,57 @@ def confirm_event(event_id: str) -> Response:
     )
 
     # notify users
-    try:
-        create_notification(
-            notification_type="confirm event",
-            type=event.get("type"),
-            sender=uid,
-            id=event.get("event_id"),
-            receiver_uid=event.get("author"),
-            sender_name=user.get("name"),
-        )
-    except:
-        return NotFound("The invitee was not found")
+    outbox.enqueue(
+        create_notification,
+        notification_type="confirm event",
+        type=event.get("type"),
+        sender=uid,
+        id=event.get("event_id"),
+        receiver_uid=event.get("author"),
+        sender_name=user.get("name"),
+    )
 
     return Response("Confirmed event", 200)
+
+
+@outbox.task
+def notify_invitees(
+    event_id: str,
+    event_type: str,
+    dods: list,
+    notification_type: str,
+    sender: str,
+    sender_name: str = None,
+    reminder: bool = False,
+) -> None:
+    """
+    Notify the users with the given dods about the event. With reminder,
+    also (re)schedule the push sent to them when the event starts.
+    """
+    uids: list = create_notifications(
+        notification_type=notification_type,
+        type=event_type,
+        sender=sender,
+        id=event_id,
+        receivers=[{"dod": dod} for dod in dods],
+        sender_name=sender_name,
+    )
+
+    if not reminder or not uids:
+        return
+
+    event_ref = db.collection("Scheduled-Events").document(event_id)
+    event: dict = event_ref.get().to_dict()
+    if event is None:
+        return
+    if "timer_id" in event:
+        cancel_scheduled_notification(event.get("timer_id"))
+    timer_id: str = add_scheduled_notification(
+        event.get("starttime"),
+        uids,
+        {
+            "title": "event invitation",
+            "body": (sender_name or "") + " invite you to " + event_type,
+        },
+    )
+    event_ref.update({"timer_id": timer_id})
@@ -6,32 +6,133 @@
         change_status()
         delete_file()
         get_file()
+        download_file()
         update_file()
         upload_file()
         get_user_files()
         review_user_files()
+        review_files_bulk()
         get_approved_files()
+        export_approved()
         get_all_files()
         get_recommend_files()
         give_recommendation()
+        get_files_by_type()
+        get_inbox()
+        get_file_counts()
+        reconcile_file_counters()
+        get_file_history()
+        get_blob_cache_stats()
 """
-from src.common.decorators import check_token
-from datetime import datetime
+from src.common.decorators import admin_only, check_token
 from src.common.database import db
 from src.api import Blueprint
+from datetime import datetime, timezone
 from firebase_admin import storage, auth, firestore
-from flask import Response, request, jsonify
+from flask import Response, request, jsonify, stream_with_context
+from google.api_core import exceptions as api_exceptions
 from uuid import uuid4
-from src.api.notifications import create_notification
+from src.api.notifications import (
+    create_notification,
+    create_notifications,
+    missing_dods,
+)
+from src.common import file_counters, file_history, file_states, outbox
+from src.common.batches import BATCH_SIZE, ChunkedBatch
+from src.common.blob_cache import blob_cache
+from src.common.helpers import make_etag, not_modified
+from src.common.io_pool import io_pool
+from src.common.queries import ListQuery, Page, paginated
 from werkzeug.exceptions import (
     InternalServerError,
     BadRequest,
     NotFound,
+    RequestedRangeNotSatisfiable,
     Unauthorized,
     UnsupportedMediaType,
 )
+from werkzeug.datastructures import ContentRange
+from zipfile import ZIP_STORED, ZipFile
+import base64
+import binascii
+import logging
+import os
 
 files: Blueprint = Blueprint("files", __name__)
+logger: logging.Logger = logging.getLogger(__name__)
+
+# the author notification of each review decision
+DECISION_NOTIFICATIONS: dict = {
+    file_states.RESUBMIT: "resubmit file",
+    file_states.APPROVED: "file approved",
+    file_states.REJECTED: "file rejected",
+}
+MAX_BULK_REVIEWS: int = 100
+# a reviewed file takes its update, its history entry, a decrement and an
+# increment per counter role and the outbox entry notifying its author,
+# the files of a bulk review are committed in batches that fit
+REVIEW_WRITES: int = 2 + 2 * len(file_counters.ROLES) + 1
+REVIEWS_PER_BATCH: int = BATCH_SIZE // REVIEW_WRITES
+# the pdfs export_approved downloads ahead of the one it is writing
+EXPORT_READ_AHEAD: int = int(os.getenv("EXPORT_READ_AHEAD", 8))
+# the archive entry listing the pdfs export_approved could not download
+EXPORT_ERRORS: str = "errors.tsv"
+
+# the list endpoint queries, optional filters come from the request arguments
+FILE_SUMMARY: list = [
+    "id",
+    "author",
+    "filename",
+    "filetype",
+    "requestType",
+    "status",
+    "reviewer",
+    "reviewerName",
+    "recommender",
+    "recommenderName",
+    "is_recommended",
+    "comment",
+    "created_at",
+    "updated_at",
+]
+ALL_FILES: ListQuery = ListQuery(
+    "Files", order_by="created_at", page_limit=None, summary=FILE_SUMMARY
+)
+APPROVED_FILES: ListQuery = (
+    ListQuery("Files", order_by="created_at", summary=FILE_SUMMARY)
+    .where("status")
+    .optional("filetype")
+)
+USER_FILES: ListQuery = (
+    ListQuery("Files", order_by="created_at", summary=FILE_SUMMARY)
+    .where("author")
+    .optional("status", type=int)
+    .optional("filetype")
+)
+ALL_REVIEW_FILES: ListQuery = (
+    ListQuery("Files", order_by="created_at", summary=FILE_SUMMARY)
+    .optional("status", type=int)
+    .optional("filetype")
+)
+REVIEWER_FILES: ListQuery = (
+    ListQuery("Files", order_by="created_at", summary=FILE_SUMMARY)
+    .where("reviewer")
+    .optional("status", type=int)
+    .optional("filetype")
+)
+RECOMMENDER_FILES: ListQuery = (
+    ListQuery("Files", order_by="created_at", summary=FILE_SUMMARY)
+    .where("recommender")
+    .where("status", "in")
+)
+SUBORDINATE_FILES: ListQuery = (
+    ListQuery("Files", order_by="created_at", summary=FILE_SUMMARY)
+    .where("author")
+    .optional("filetype")
+)
+FILE_HISTORY: ListQuery = ListQuery(
+    "Files/{file_id}/history", order_by="timestamp", page_limit=20
+)
 
 
 @files.post("/upload_file")
@@ -113,12 +214,12 @@ def upload_file() -> Response:
     entry: dict = dict()
     entry["id"] = file_id
     entry["author"] = uid
-    entry["timestamp"] = [datetime.now()]
-    entry["timestamp_string"] = ["File Upload"]
+    entry["created_at"] = firestore.SERVER_TIMESTAMP
+    entry["updated_at"] = firestore.SERVER_TIMESTAMP
     entry["filetype"] = data.get("filetype")
     entry["requestType"] = data.get("requestType")
     entry["filename"] = data.get("filename")
-    entry["status"] = 1
+    entry["status"] = file_states.SUBMITTED
     entry["reviewer"] = data.get("reviewer")
     entry["reviewerName"] = data.get("reviewerName")
     entry["comment"] = ""
@@ -127,35 +228,41 @@ def upload_file() -> Response:
             return BadRequest("Missing the recommender")
         entry["recommender"] = data.get("recommender")
         entry["recommenderName"] = data.get("recommenderName")
-        # notification send to recommender
-        try:
-            create_notification(
-                notification_type="recommend file",
-                type=data.get("filetype"),
-                id=file_id,
-                sender=uid,
-                receiver_dod=data.get("recommender"),
-                receiver_uid=None,
-                sender_name=user.get("name"),
-            )
-        except:
+
+    # the receiver is notified after the commit, check it exists before
+    if missing_dods([entry.get("recommender") or entry.get("reviewer")]):
+        if "recommender" in entry:
             return NotFound("The recommender was not found")
-    else:
-        # notification send to reviewer
-        try:
-            create_notification(
-                notification_type="review file",
-                type=data.get("filetype"),
-                sender=uid,
-                id=file_id,
-                receiver_dod=data.get("reviewer"),
-                receiver_uid=None,
-                sender_name=user.get("name"),
-            )
-        except:
-            return NotFound("The reviewer was not found")
+        return NotFound("The reviewer was not found")
 
-    db.collection("Files").document(file_id).set(entry)
+    file_ref = db.collection("Files").document(file_id)
+    batch = db.batch()
+    batch.set(file_ref, entry)
+    # notification send to the recommender, or else to the reviewer
+    notification = outbox.stage(
+        batch,
+        create_notification,
+        notification_type=(
+            "recommend file" if "recommender" in entry else "review file"
+        ),
+        type=data.get("filetype"),
+        id=file_id,
+        sender=uid,
+        receiver_dod=entry.get("recommender") or data.get("reviewer"),
+        receiver_uid=None,
+        sender_name=user.get("name"),
+    )
+    file_counters.stage_counts(batch, None, entry)
+    file_history.add_history(
+        batch,
+        file_ref,
+        file_history.UPLOAD,
+        actor=uid,
+        actor_name=user.get("name"),
+        status=entry["status"],
+    )
+    batch.commit()
+    outbox.dispatch(notification)
 
     try:
         # save pdf to firestore storage
@@ -172,7 +279,9 @@ def upload_file() -> Response:
         try:
             # save signature image to firebase storage
             blob = bucket.blob(signature_path)
-            blob.upload_from_string(data.get("signature"), content_type="image")
+            blob.upload_from_string(
+                data.get("signature"), content_type="image"
+            )
         except:
             return InternalServerError("Could not save signature")
         user_ref.update({"signature": signature_path})
@@ -201,12 +310,19 @@ def get_file(file_id: str) -> Response:
               type: string
           description: The ID of the file
           required: true
+        - in: header
+          name: If-None-Match
+          schema:
+            type: string
+          required: false
     responses:
         200:
             content:
                 application/json:
                     schema:
                         $ref: '#/components/schemas/File'
+        304:
+            description: Not modified - the client copy is up to date
         400:
             description: Bad request
         401:
@@ -221,26 +337,24 @@ def get_file(file_id: str) -> Response:
     decoded_token: dict = auth.verify_id_token(token)
     uid: str = decoded_token.get("uid")
     file_path: str = "file/" + file_id
-    # get pdf from the firebase storage
     bucket = storage.bucket()
-    blob = bucket.blob(file_path)
 
-    if not blob.exists():
-        return NotFound("The file with the given filename was not found.")
+    # fetch the file metadata, the user (with its signature metadata) and the
+    # pdf metadata concurrently, the contents are only downloaded once we
+    # know the client does not already have them
+    file_future = io_pool.submit(db.collection("Files").document(file_id).get)
+    user_future = io_pool.submit(_get_user_and_signature, bucket, uid)
+    blob_future = io_pool.submit(bucket.get_blob, file_path)
 
-    # download the pdf file and add it to the file data
-    file = blob.download_as_bytes()
-    docs = db.collection("Files").where("id", "==", file_id).limit(1).stream()
-    res: dict = dict()
-    for doc in docs:
-        res = doc.to_dict()
-    res["file"] = file.decode("utf-8")
+    file_snapshot = file_future.result()
+    if not file_snapshot.exists:
+        return NotFound("The file was not found")
+    res: dict = file_snapshot.to_dict()
 
-    # get the user table
-    user_ref = db.collection("User").document(uid).get()
-    if user_ref.exists == False:
+    user_snapshot, signature_blob = user_future.result()
+    if user_snapshot.exists == False:
         return NotFound("The user was not found")
-    user: dict = user_ref.to_dict()
+    user: dict = user_snapshot.to_dict()
 
     # Only the author, reviewer, and admin have access to the data
     if (
@@ -253,18 +367,182 @@ def get_file(file_id: str) -> Response:
             "The user is not authorized to retrieve this content"
         )
 
-    # download the pdf file and add it to the file data
     if user.get("role") != "ara":
         if "signature" not in user:
             return BadRequest("User need upload a signature")
-        signature_path: str = user.get("signature")
-        blob = bucket.blob(signature_path)
-        if not blob.exists():
+        if signature_blob is None:
             return NotFound("The user's signature was not found.")
-        signature = blob.download_as_bytes()
+
+    blob = blob_future.result()
+    if blob is None:
+        return NotFound("The file with the given filename was not found.")
+
+    # the response only changes when one of its sources changes
+    etag: str = make_etag(
+        file_snapshot.update_time,
+        blob.generation,
+        user_snapshot.update_time,
+        signature_blob.generation if signature_blob else None,
+    )
+    cached: Response = not_modified(etag)
+    if cached:
+        return cached
+
+    # download the pdf file and the signature and add them to the file data
+    pdf_future = io_pool.submit(blob_cache.read, blob)
+    if signature_blob:
+        signature = blob_cache.read(signature_blob)
         res["signature"] = signature.decode("utf-8")
+    res["file"] = pdf_future.result().decode("utf-8")
+
+    response: Response = jsonify(res)
+    response.set_etag(etag)
+    return response, 200
+
+
+def _get_user_and_signature(bucket, uid: str) -> tuple:
+    """
+    Fetch the user table and, when get_file needs it, the metadata of the
+    user's signature. Returns the user snapshot and the blob or None.
+    """
+    user_snapshot = db.collection("User").document(uid).get()
+    if not user_snapshot.exists:
+        return user_snapshot, None
+
+    user: dict = user_snapshot.to_dict()
+    if user.get("role") == "ara" or "signature" not in user:
+        return user_snapshot, None
+
+    return user_snapshot, bucket.get_blob(user.get("signature"))
+
+
+@files.get("/download_file/<file_id>")
+@check_token
+def download_file(file_id: str) -> Response:
+    """
+    Download the raw content of a file, honoring HTTP Range requests.
+    ---
+    tags:
+        - files
+    summary: Downloads a file
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+        - in: header
+          name: Range
+          schema:
+            type: string
+          example: bytes=0-65535
+          required: false
+        - in: header
+          name: If-Range
+          schema:
+            type: string
+          required: false
+        - name: file_id
+          in: path
+          schema:
+              type: string
+          description: The ID of the file
+          required: true
+    responses:
+        200:
+            description: The whole file
+        206:
+            description: Partial content - the requested byte range
+        304:
+            description: Not modified - the client copy is up to date
+        401:
+            description: Unauthorized - the provided token is not valid
+        404:
+            description: NotFound
+        416:
+            description: The requested range is not satisfiable
+        500:
+            description: Internal API Error
+    """
+    # check tokens and get uid from token
+    token: str = request.headers["Authorization"]
+    decoded_token: dict = auth.verify_id_token(token)
+    uid: str = decoded_token.get("uid")
+    bucket = storage.bucket()
+
+    # fetch the file metadata, the user and the blob metadata concurrently
+    file_future = io_pool.submit(db.collection("Files").document(file_id).get)
+    user_future = io_pool.submit(db.collection("User").document(uid).get)
+    blob_future = io_pool.submit(bucket.get_blob, "file/" + file_id)
 
-    return jsonify(res), 200
+    file_snapshot = file_future.result()
+    if not file_snapshot.exists:
+        return NotFound("The file was not found")
+    file: dict = file_snapshot.to_dict()
+
+    user_snapshot = user_future.result()
+    if user_snapshot.exists == False:
+        return NotFound("The user was not found")
+    user: dict = user_snapshot.to_dict()
+
+    # Only the author, reviewer, and admin have access to the data
+    if (
+        user.get("dod") != file.get("reviewer")
+        and uid != file.get("author")
+        and user.get("dod") != file.get("recommender")
+        and user.get("role") != "ara"
+    ):
+        return Unauthorized(
+            "The user is not authorized to retrieve this content"
+        )
+
+    blob = blob_future.result()
+    if blob is None:
+        return NotFound("The file with the given filename was not found.")
+
+    etag: str = make_etag(blob.name, blob.generation)
+    cached: Response = not_modified(etag)
+    if cached:
+        return cached
+
+    # HTTP dates have no fraction of a second
+    last_modified: datetime = blob.updated.replace(microsecond=0)
+
+    # a Range is ignored when If-Range names another version of the file,
+    # a date only names the version last modified exactly then
+    byte_range = request.range
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        byte_range = None
+    elif if_range.date is not None:
+        if_range_date: datetime = if_range.date
+        if if_range_date.tzinfo is None:
+            if_range_date = if_range_date.replace(tzinfo=timezone.utc)
+        if if_range_date != last_modified:
+            byte_range = None
+
+    content_type: str = blob.content_type or "application/pdf"
+    if byte_range is None:
+        response: Response = Response(
+            blob_cache.read(blob), status=200, content_type=content_type
+        )
+    else:
+        bounds: tuple = byte_range.range_for_length(blob.size)
+        if bounds is None:
+            return RequestedRangeNotSatisfiable(length=blob.size)
+        start, stop = bounds
+
+        # serve the range from the local cache, otherwise map it onto a
+        # ranged read so the rest of the object never reaches the worker
+        content: bytes = blob_cache.read(blob, start, stop - 1)
+
+        response = Response(content, status=206, content_type=content_type)
+        response.content_range = ContentRange("bytes", start, stop, blob.size)
+
+    response.accept_ranges = "bytes"
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
 
 
 @files.delete("/delete_file/<file_id>")
@@ -331,8 +609,14 @@ def delete_file(file_id: str) -> Response:
         return NotFound("The file with the given filename was not found.")
     blob.delete()
 
-    # delete the data from firesotre
-    file_ref.delete()
+    # delete the data from firesotre, the history first so a failed delete
+    # can be retried while the file is still there
+    batch: ChunkedBatch = ChunkedBatch()
+    file_history.delete_history(batch, file_ref)
+    batch.reserve(1 + 2 * len(file_counters.ROLES))
+    batch.delete(file_ref)
+    file_counters.stage_counts(batch, data, None)
+    batch.commit()
 
     return Response(response="File deleted", status=200)
 
@@ -377,52 +661,72 @@ def update_file():
     uid: str = decoded_token.get("uid")
     data: dict = request.get_json()
 
-    # fetch the file data from firestore
-    file_ref = db.collection("Files").document(data.get("file_id"))
-    if file_ref.get().exists == False:
+    # fetch the file and the user table concurrently
+    file_future = io_pool.submit(
+        db.collection("Files").document(data.get("file_id")).get
+    )
+    user_snapshot = db.collection("User").document(uid).get()
+    file_snapshot = file_future.result()
+    if not file_snapshot.exists:
         return NotFound("The file not found")
-    file: dict = file_ref.get().to_dict()
-
-    # exceptions
-    if not file_ref.get().exists:
-        return NotFound("The file with the given filename was not found")
-
-    if file.get("status") < 0 or file.get("status") > 3:
-        return BadRequest("Files is not allow to change after decision made")
+    file: dict = file_snapshot.to_dict()
 
     # Only the author have access to update the file
     if uid != file.get("author"):
         return Unauthorized(
             "The user is not authorized to retrieve this content"
         )
-    # get user table
-    user_ref = db.collection("User").document(uid)
-    if user_ref.get().exists == False:
+    if user_snapshot.exists == False:
         return NotFound("The user was not found")
-    user: dict = user_ref.get().to_dict()
+    user: dict = user_snapshot.to_dict()
 
     # Only rst_request could have recommender
-    if "recommender" in data and files.get("filetype") != "rst_request":
+    if "recommender" in data and file.get("filetype") != "rst_request":
         return BadRequest("Only rst_request files could have recommender")
 
+    # the recommender is notified after the commit, check it exists before
+    if "recommender" in data and missing_dods([data.get("recommender")]):
+        return NotFound("The recommender was not found")
+
+    changes: dict = dict()
     if "recommender" in data:
-        file_ref.update({"recommender": data.get("recommender")})
-        try:
-            # notification send to recommender
-            create_notification(
+        changes["recommender"] = data.get("recommender")
+    if "filename" in data:
+        changes["filename"] = data.get("filename")
+
+    batch = db.batch()
+    error = file_states.stage_transition(
+        batch,
+        file_snapshot,
+        file_history.UPDATE,
+        actor=uid,
+        actor_name=user.get("name"),
+        changes=changes,
+    )
+    if error:
+        return error
+
+    notifications: list = []
+    if "recommender" in data:
+        # notification send to recommender
+        notifications.append(
+            outbox.stage(
+                batch,
+                create_notification,
                 notification_type="recommend file",
-                type=data.get("filetype"),
+                type=file.get("filetype"),
                 sender=uid,
                 sender_name=user.get("name"),
                 id=file.get("id"),
                 receiver_uid=None,
                 receiver_dod=data.get("recommender"),
             )
-        except:
-            return NotFound("The recommender was not found")
+        )
 
-    if "filename" in data:
-        file_ref.update({"filename": data.get("filename")})
+    error = file_states.commit(batch)
+    if error:
+        return error
+    outbox.dispatch(*notifications)
 
     # save pdf to firestore storage
     bucket = storage.bucket()
@@ -438,17 +742,12 @@ def update_file():
         signature_path: str = "signature/" + user.get("signature")
         try:
             blob = bucket.blob(signature_path)
-            blob.upload_from_string(data.get("signature"), content_type="image")
+            blob.upload_from_string(
+                data.get("signature"), content_type="image"
+            )
         except:
             return InternalServerError("cannot update signature to storage")
 
-    file_ref.update(
-        {
-            "timestamp": firestore.ArrayUnion([datetime.now()]),
-            "timestamp_string": firestore.ArrayUnion(["File Update"]),
-        }
-    )
-
     return Response("File Updated", 200)
 
 
@@ -504,17 +803,19 @@ def review_file():
     if "file" not in data or not data.get("file").strip():
         return BadRequest("Missing the file")
 
-    # get the user table
+    # fetch the user table and the file concurrently
+    file_future = io_pool.submit(
+        db.collection("Files").document(data.get("file_id")).get
+    )
     reviewer_ref = db.collection("User").document(reviewer_uid).get()
     if reviewer_ref.exists == False:
         return NotFound("The user was not found")
     reviewer: dict = reviewer_ref.to_dict()
 
-    # fetch the file data from firestore
-    file_ref = db.collection("Files").document(data.get("file_id"))
-    if file_ref.get().exists == False:
+    file_snapshot = file_future.result()
+    if not file_snapshot.exists:
         return NotFound("The file not found")
-    file: dict = file_ref.get().to_dict()
+    file: dict = file_snapshot.to_dict()
 
     # Only the reviewer, and admin have access to change the status of the file
     if (
@@ -525,91 +826,66 @@ def review_file():
             "The user is not authorized to retrieve this content"
         )
 
-    if "comment" in data:
-        file_ref.update({"comment": data.get("comment")})
+    batch = db.batch()
+    error = file_states.stage_transition(
+        batch,
+        file_snapshot,
+        file_history.REVIEW,
+        actor=reviewer_uid,
+        actor_name=reviewer.get("name"),
+        status=data.get("decision"),
+        comment=data.get("comment"),
+    )
+    if error:
+        return error
 
-    file_ref.update(
-        {
-            "status": data.get("decision"),
-            "timestamp": firestore.ArrayUnion([datetime.now()]),
-            "timestamp_string": firestore.ArrayUnion(["File Reviewed"]),
-        }
+    # notified user the decision
+    notification = outbox.stage(
+        batch,
+        create_notification,
+        notification_type=DECISION_NOTIFICATIONS[data.get("decision")],
+        type=file.get("filetype"),
+        sender=reviewer_uid,
+        id=data.get("file_id"),
+        receiver_uid=file.get("author"),
+        receiver_dod=None,
+        sender_name=reviewer.get("name"),
     )
 
+    error = file_states.commit(batch)
+    if error:
+        return error
+
     # update the file in the storage
     bucket = storage.bucket()
     file_path: str = "file/" + data.get("file_id")
     blob = bucket.blob(file_path)
     blob.upload_from_string(data.get("file"), content_type="application/pdf")
-
-    # notified user the decision
-    try:
-        if data.get("decision") == 3:
-            create_notification(
-                notification_type="resubmit file",
-                type=file.get("filetype"),
-                sender=reviewer_uid,
-                id=data.get("file_id"),
-                receiver_uid=file.get("author"),
-                receiver_dod=None,
-                sender_name=reviewer.get("name"),
-            )
-        elif data.get("decision") == 4:
-            create_notification(
-                notification_type="file approved",
-                type=file.get("filetype"),
-                sender=reviewer_uid,
-                id=data.get("file_id"),
-                receiver_uid=file.get("author"),
-                receiver_dod=None,
-                sender_name=reviewer.get("name"),
-            )
-        elif data.get("decision") == 5:
-            create_notification(
-                notification_type="file rejected",
-                type=file.get("filetype"),
-                sender=reviewer_uid,
-                id=data.get("file_id"),
-                receiver_uid=file.get("author"),
-                receiver_dod=None,
-                sender_name=reviewer.get("name"),
-            )
-    except:
-        return NotFound("The author was not found")
+    outbox.dispatch(notification)
 
     return Response("Status changed", 200)
 
 
-@files.get("/get_all_files")
+@files.put("/review_files_bulk")
 @check_token
-def get_all_files() -> Response:
+def review_files_bulk():
     """
-    Get all files from Firebase Storage.
+    Review many files at once.
     ---
     tags:
         - files
-    summary: Gets user files
+    summary: Review many files
     parameters:
         - in: header
           name: Authorization
           schema:
             type: string
           required: true
-        - in: query
-          name: status
-          schema:
-            type: integer
-          required: false
-        - in: query
-          name: page_limit
-          schema:
-            type: integer
-          required: false
-        - in: query
-          name: filetype
-          schema:
-            type: string
-          required: false
+    requestBody:
+        content:
+            application/json:
+                schema:
+                    $ref: '#/components/schemas/ReviewFilesBulk'
     responses:
         200:
             content:
@@ -617,38 +893,167 @@ def get_all_files() -> Response:
                     schema:
                         type: array
                         items:
-                            $ref: '#/components/schemas/UserFiles'
+                            $ref: '#/components/schemas/BulkReviewResult'
         400:
             description: Bad request
         401:
             description: Unauthorized - the provided token is not valid
+        404:
+            description: NotFound
         500:
             description: Internal API Error
     """
     # check tokens and get uid from token
     token: str = request.headers["Authorization"]
     decoded_token: dict = auth.verify_id_token(token)
+    reviewer_uid: str = decoded_token.get("uid")
+    data: dict = request.get_json()
+
+    reviews: list = data.get("reviews") if data else None
+    if not reviews or not isinstance(reviews, list):
+        return BadRequest("Missing the reviews")
+    if len(reviews) > MAX_BULK_REVIEWS:
+        return BadRequest(
+            "At most %d files can be reviewed at once" % MAX_BULK_REVIEWS
+        )
+    for review in reviews:
+        if (
+            not isinstance(review, dict)
+            or not str(review.get("file_id") or "").strip()
+        ):
+            return BadRequest("Missing the file id")
+    file_ids: list = [review.get("file_id") for review in reviews]
+    if len(set(file_ids)) != len(file_ids):
+        return BadRequest("A file can only be reviewed once per request")
+
+    # fetch the user table and all the files in one round trip
+    file_refs: list = [
+        db.collection("Files").document(file_id) for file_id in file_ids
+    ]
+    snapshots_future = io_pool.submit(lambda: list(db.get_all(file_refs)))
+    reviewer_ref = db.collection("User").document(reviewer_uid).get()
+    if reviewer_ref.exists == False:
+        return NotFound("The user was not found")
+    reviewer: dict = reviewer_ref.to_dict()
+    snapshots: dict = {
+        snapshot.id: snapshot for snapshot in snapshots_future.result()
+    }
+
+    # check every review, the accepted ones are committed together
+    results: dict = dict()
+    accepted: list = []
+    for review in reviews:
+        file_id: str = review.get("file_id")
+        snapshot = snapshots.get(file_id)
+        error = None
+        if review.get("decision") not in DECISION_NOTIFICATIONS:
+            error = BadRequest("Unsupported decision type")
+        elif snapshot is None or not snapshot.exists:
+            error = NotFound("The file not found")
+        elif (
+            reviewer.get("dod") != snapshot.to_dict().get("reviewer")
+            and decoded_token.get("admin") != True
+        ):
+            error = Unauthorized(
+                "The user is not authorized to retrieve this content"
+            )
+        else:
+            error = file_states.check_transition(
+                file_history.REVIEW,
+                snapshot.to_dict().get("status"),
+                review.get("decision"),
+            )
 
-    file_docs: list = []
+        results[file_id] = error
+        if not error:
+            accepted.append((review, snapshot))
 
-    file_docs = (
-        db.collection("Files")
-        .order_by("timestamp", direction=firestore.Query.DESCENDING)
-        .stream()
-    )
+    # upload the reviewed pdfs first, a file whose pdf could not be saved is
+    # left unreviewed
+    bucket = storage.bucket()
+    uploads: dict = {
+        snapshot.id: io_pool.submit(
+            bucket.blob("file/" + snapshot.id).upload_from_string,
+            review.get("file"),
+            content_type="application/pdf",
+        )
+        for review, snapshot in accepted
+        if review.get("file")
+    }
+    for file_id, upload in uploads.items():
+        try:
+            upload.result()
+        except Exception:
+            logger.exception("Could not save the pdf of %s", file_id)
+            results[file_id] = InternalServerError("Could not save pdf")
+    accepted = [
+        (review, snapshot)
+        for review, snapshot in accepted
+        if not results[snapshot.id]
+    ]
+
+    def stage(batch, review: dict, snapshot) -> dict:
+        file_states.stage_transition(
+            batch,
+            snapshot,
+            file_history.REVIEW,
+            actor=reviewer_uid,
+            actor_name=reviewer.get("name"),
+            status=review.get("decision"),
+            comment=review.get("comment"),
+        )
+        # notified the author once the decision is committed
+        return outbox.stage(
+            batch,
+            create_notifications,
+            notification_type=DECISION_NOTIFICATIONS[review.get("decision")],
+            type=snapshot.to_dict().get("filetype"),
+            sender=reviewer_uid,
+            id=snapshot.id,
+            receivers=[{"uid": snapshot.to_dict().get("author")}],
+            sender_name=reviewer.get("name"),
+        )
 
-    files: list = []
-    for file in file_docs:
-        files.append(file.to_dict())
+    # the transitions and the author notifications go in as few batches as
+    # fit, when a file changed in the meantime the files of its batch are
+    # committed one by one to find out which
+    notifications: list = []
+    for i in range(0, len(accepted), REVIEWS_PER_BATCH):
+        chunk: list = accepted[i : i + REVIEWS_PER_BATCH]
+        batch = db.batch()
+        entries: list = [
+            stage(batch, review, snapshot) for review, snapshot in chunk
+        ]
+        if not file_states.commit(batch):
+            notifications.extend(entries)
+            continue
+        for review, snapshot in chunk:
+            batch = db.batch()
+            entry: dict = stage(batch, review, snapshot)
+            results[snapshot.id] = file_states.commit(batch)
+            if not results[snapshot.id]:
+                notifications.append(entry)
+    outbox.dispatch(*notifications)
+
+    response: list = []
+    for file_id in file_ids:
+        error = results[file_id]
+        response.append(
+            {
+                "file_id": file_id,
+                "status": error.code if error else 200,
+                "message": error.description if error else "Status changed",
+            }
+        )
 
-    return jsonify(files), 200
+    return jsonify(response), 200
 
 
-@files.get("/get_approved_files")
+@files.get("/get_all_files")
 @check_token
-def get_approved_files() -> Response:
+def get_all_files() -> Response:
     """
-    Get all accepted files from Firebase Storage.
+    Get all files from Firebase Storage.
     ---
     tags:
         - files
@@ -669,6 +1074,18 @@ def get_approved_files() -> Response:
           schema:
             type: integer
           required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+        - in: query
+          name: fields
+          schema:
+            type: string
+          description: Comma separated fields to return, * for all fields
+          required: false
         - in: query
           name: filetype
           schema:
@@ -692,46 +1109,20 @@ def get_approved_files() -> Response:
     # check tokens and get uid from token
     token: str = request.headers["Authorization"]
     decoded_token: dict = auth.verify_id_token(token)
-    uid: str = decoded_token.get("uid")
-    # the default page limits is 10
-    page_limit: int = 10
-
-    if "page_limit" in request.args:
-        page_limit = request.args.get("page_limit", default=10, type=int)
-
-    file_docs: list = []
-    filetype: str = request.args.get("filetype", type=str)
-    # both status and filetype search
-    if "filetype" in request.args:
-        file_docs = (
-            db.collection("Files")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("status", "==", 4)
-            .where("filetype", "==", filetype)
-            .limit(page_limit)
-            .stream()
-        )
-    else:
-        file_docs = (
-            db.collection("Files")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("status", "==", 4)
-            .limit(page_limit)
-            .stream()
-        )
 
+    page: Page = ALL_FILES.page(request.args)
     files: list = []
-    for file in file_docs:
+    for file in page.docs:
         files.append(file.to_dict())
 
-    return jsonify(files), 200
+    return paginated(files, page)
 
 
-@files.get("/get_user_files")
+@files.get("/get_approved_files")
 @check_token
-def get_user_files() -> Response:
+def get_approved_files() -> Response:
     """
-    Get the user  files from Firebase Storage.
+    Get all accepted files from Firebase Storage.
     ---
     tags:
         - files
@@ -752,6 +1143,18 @@ def get_user_files() -> Response:
           schema:
             type: integer
           required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+        - in: query
+          name: fields
+          schema:
+            type: string
+          description: Comma separated fields to return, * for all fields
+          required: false
         - in: query
           name: filetype
           schema:
@@ -775,86 +1178,269 @@ def get_user_files() -> Response:
     # check tokens and get uid from token
     token: str = request.headers["Authorization"]
     decoded_token: dict = auth.verify_id_token(token)
-    uid: str = decoded_token.get("uid")
-    # the default page limits is 10
-    page_limit: int = 10
-
-    if "page_limit" in request.args:
-        page_limit = request.args.get("page_limit", default=10, type=int)
-
-    file_docs: list = []
-    filetype: str = request.args.get("filetype", type=str)
-    status: int = request.args.get("status", type=int)
-    # both status and filetype search
-    if "status" in request.args and "filetype" in request.args:
-        file_docs = (
-            db.collection("Files")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("author", "==", uid)
-            .where("status", "==", status)
-            .where("filetype", "==", filetype)
-            .limit(page_limit)
-            .stream()
-        )
-    elif "status" in request.args:
-        file_docs = (
-            db.collection("Files")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("author", "==", uid)
-            .where("status", "==", status)
-            .limit(page_limit)
-            .stream()
-        )
-    elif "filetype" in request.args:
-        file_docs = (
-            db.collection("Files")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("author", "==", uid)
-            .where("filetype", "==", filetype)
-            .limit(page_limit)
-            .stream()
-        )
-    else:
-        file_docs = (
-            db.collection("Files")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("author", "==", uid)
-            .limit(page_limit)
-            .stream()
-        )
 
+    page: Page = APPROVED_FILES.page(request.args, status=4)
     files: list = []
-    for file in file_docs:
+    for file in page.docs:
         files.append(file.to_dict())
 
-    return jsonify(files), 200
+    return paginated(files, page)
 
 
-@files.get("/get_review_files")
+@files.get("/export_approved")
 @check_token
-def get_review_files() -> Response:
+def export_approved() -> Response:
     """
-    Get 10 unreviewed user files from Firebase.
+    Download all the accepted files as a ZIP archive. The files whose pdf
+    could not be downloaded are listed in its errors.tsv entry.
     ---
     tags:
         - files
-    summary: Get 10 unreviewed user files from Firebase.
+    summary: Exports the approved files
     parameters:
         - in: header
           name: Authorization
           schema:
             type: string
           required: true
-        - in: query
-          name: page_limit
-          schema:
-            type: integer
-          required: false
-        - in: query
-          name: status
-          schema:
-            type: integer
-          required: false
+        - in: query
+          name: filetype
+          schema:
+            type: string
+          required: false
+    responses:
+        200:
+            content:
+                application/zip:
+                    schema:
+                        type: string
+                        format: binary
+        401:
+            description: Unauthorized - the provided token is not valid
+        404:
+            description: NotFound
+        500:
+            description: Internal API Error
+    """
+    # check tokens and get uid from token
+    token: str = request.headers["Authorization"]
+    decoded_token: dict = auth.verify_id_token(token)
+    uid: str = decoded_token.get("uid")
+
+    user_ref = db.collection("User").document(uid).get()
+    if user_ref.exists == False:
+        return NotFound("The user was not found")
+    if user_ref.to_dict().get("role") != "ara":
+        return Unauthorized(
+            "The user is not authorized to retrieve this content"
+        )
+
+    docs = APPROVED_FILES.stream(request.args, status=4)
+    response: Response = Response(
+        stream_with_context(_zip_files(docs, storage.bucket())),
+        mimetype="application/zip",
+    )
+    response.headers[
+        "Content-Disposition"
+    ] = "attachment; filename=approved_files.zip"
+    return response
+
+
+class _ZipStream:
+    """
+    The write-only file ZipFile writes the archive to, emptied by the
+    generator after every entry.
+    """
+
+    def __init__(self):
+        self.chunks: list = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data: bytes = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _zip_files(docs, bucket):
+    """
+    Yield a ZIP archive of the pdfs of the files, entry by entry. The next
+    EXPORT_READ_AHEAD pdfs are downloaded in parallel while one is written,
+    so at most that many are held in memory. The pdfs that could not be
+    downloaded are listed in an EXPORT_ERRORS entry at the end.
+    """
+    stream: _ZipStream = _ZipStream()
+    archive: ZipFile = ZipFile(stream, mode="w", compression=ZIP_STORED)
+    downloads: list = []
+    names: set = set()
+    missing: list = []
+    docs = iter(docs)
+
+    def download_next() -> None:
+        doc = next(docs, None)
+        if doc is not None:
+            blob = bucket.blob("file/" + doc.id)
+            downloads.append((doc, io_pool.submit(blob.download_as_bytes)))
+
+    for _ in range(EXPORT_READ_AHEAD):
+        download_next()
+
+    while downloads:
+        doc, download = downloads.pop(0)
+        download_next()
+        file: dict = doc.to_dict()
+        name: str = "%s/%s" % (
+            file.get("filetype") or "file",
+            (file.get("filename") or doc.id).replace("/", "_"),
+        )
+        if not name.lower().endswith(".pdf"):
+            name += ".pdf"
+        if name in names:
+            name = name[: -len(".pdf")] + "-" + doc.id + ".pdf"
+        names.add(name)
+
+        try:
+            content: bytes = download.result()
+        except api_exceptions.GoogleAPICallError as error:
+            # e.g. the file document outlived its pdf
+            logger.warning("Could not export the pdf of %s: %s", doc.id, error)
+            missing.append("%s\t%s\t%s" % (doc.id, name, error))
+            continue
+        archive.writestr(name, _pdf_bytes(content))
+        yield stream.drain()
+
+    if missing:
+        archive.writestr(
+            EXPORT_ERRORS,
+            "file_id\tname\terror\n" + "\n".join(missing) + "\n",
+        )
+    archive.close()
+    yield stream.drain()
+
+
+def _pdf_bytes(content: bytes) -> bytes:
+    # the pdfs are stored as base64, possibly as a data url
+    if content.startswith(b"data:"):
+        content = content.split(b",", 1)[-1]
+    try:
+        return base64.b64decode(content, validate=True)
+    except binascii.Error:
+        return content
+
+
+@files.get("/get_user_files")
+@check_token
+def get_user_files() -> Response:
+    """
+    Get the user  files from Firebase Storage.
+    ---
+    tags:
+        - files
+    summary: Gets user files
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+        - in: query
+          name: status
+          schema:
+            type: integer
+          required: false
+        - in: query
+          name: page_limit
+          schema:
+            type: integer
+          required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+        - in: query
+          name: fields
+          schema:
+            type: string
+          description: Comma separated fields to return, * for all fields
+          required: false
+        - in: query
+          name: filetype
+          schema:
+            type: string
+          required: false
+    responses:
+        200:
+            content:
+                application/json:
+                    schema:
+                        type: array
+                        items:
+                            $ref: '#/components/schemas/UserFiles'
+        400:
+            description: Bad request
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    # check tokens and get uid from token
+    token: str = request.headers["Authorization"]
+    decoded_token: dict = auth.verify_id_token(token)
+    uid: str = decoded_token.get("uid")
+
+    page: Page = USER_FILES.page(request.args, author=uid)
+    files: list = []
+    for file in page.docs:
+        files.append(file.to_dict())
+
+    return paginated(files, page)
+
+
+@files.get("/get_review_files")
+@check_token
+def get_review_files() -> Response:
+    """
+    Get 10 unreviewed user files from Firebase.
+    ---
+    tags:
+        - files
+    summary: Get 10 unreviewed user files from Firebase.
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+        - in: query
+          name: page_limit
+          schema:
+            type: integer
+          required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+        - in: query
+          name: fields
+          schema:
+            type: string
+          description: Comma separated fields to return, * for all fields
+          required: false
+        - in: query
+          name: status
+          schema:
+            type: integer
+          required: false
         - in: query
           name: filetype
           schema:
@@ -886,90 +1472,19 @@ def get_review_files() -> Response:
     user: dict = user_ref.to_dict()
     files: list = []
 
-    # Get the page limits, filetype, status from the front-end if exists
-    page_limit: int = request.args.get("page_limit", default=10, type=int)
-    filetype: str = request.args.get("filetype", type=str)
-    status: int = request.args.get("status", type=int)
-
-    # Admins could review all files
+    # Admins could review all files, reviewers could only review the files
+    # assigned to them
     if decoded_token.get("admin") == True:
-        # Get the next batch of documents that come after the last document we received a reference to before
-        if "status" in request.args and "filetype" in request.args:
-            file_docs = (
-                db.collection("Files")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("status", "==", status)
-                .where("filetype", "==", filetype)
-                .limit(page_limit)
-                .stream()
-            )
-        elif "status" in request.args:
-            file_docs = (
-                db.collection("Files")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("status", "==", status)
-                .limit(page_limit)
-                .stream()
-            )
-        elif "filetype" in request.args:
-            file_docs = (
-                db.collection("Files")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("filetype", "==", filetype)
-                .limit(page_limit)
-                .stream()
-            )
-        else:
-            file_docs = (
-                db.collection("Files")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .limit(page_limit)
-                .stream()
-            )
-    # Reviewers could only review the files assigned to them
+        page: Page = ALL_REVIEW_FILES.page(request.args)
     else:
-        # Get the next batch of documents that come after the last document we received a reference to before
-        if "status" in request.args and "filetype" in request.args:
-            file_docs = (
-                db.collection("Files")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("reviewer", "==", user.get("dod"))
-                .where("status", "==", status)
-                .where("filetype", "==", filetype)
-                .limit(page_limit)
-                .stream()
-            )
-        elif "status" in request.args:
-            file_docs = (
-                db.collection("Files")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("reviewer", "==", user.get("dod"))
-                .where("status", "==", status)
-                .limit(page_limit)
-                .stream()
-            )
-        elif "filetype" in request.args:
-            file_docs = (
-                db.collection("Files")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("reviewer", "==", user.get("dod"))
-                .where("filetype", "==", filetype)
-                .limit(page_limit)
-                .stream()
-            )
-        else:
-            file_docs = (
-                db.collection("Files")
-                .order_by("timestamp", direction=firestore.Query.DESCENDING)
-                .where("reviewer", "==", user.get("dod"))
-                .limit(page_limit)
-                .stream()
-            )
+        page: Page = REVIEWER_FILES.page(
+            request.args, reviewer=user.get("dod")
+        )
 
-    for doc in file_docs:
+    for doc in page.docs:
         files.append(doc.to_dict())
 
-    return jsonify(files), 200
+    return paginated(files, page)
 
 
 @files.get("/get_recommend_files")
@@ -992,6 +1507,18 @@ def get_recommend_files() -> Response:
           schema:
             type: integer
           required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+        - in: query
+          name: fields
+          schema:
+            type: string
+          description: Comma separated fields to return, * for all fields
+          required: false
     responses:
         200:
             content:
@@ -1018,22 +1545,14 @@ def get_recommend_files() -> Response:
     user: dict = user_ref.to_dict()
     files: list = []
 
-    # Get the page limits, filetype, status from the front-end if exists
-    page_limit: int = request.args.get("page_limit", default=10, type=int)
-
-    file_docs = (
-        db.collection("Files")
-        .order_by("timestamp", direction=firestore.Query.DESCENDING)
-        .where("recommender", "==", user.get("dod"))
-        .where("status", "in", [1, 2, 3])
-        .limit(page_limit)
-        .stream()
+    page: Page = RECOMMENDER_FILES.page(
+        request.args, recommender=user.get("dod"), status=[1, 2, 3]
     )
 
-    for doc in file_docs:
+    for doc in page.docs:
         files.append(doc.to_dict())
 
-    return jsonify(files), 200
+    return paginated(files, page)
 
 
 @files.put("/give_recommendation")
@@ -1084,17 +1603,19 @@ def give_recommendation():
     if "is_recommended" not in data:
         return BadRequest("Missing the recommendation result")
 
-    # get the user table
+    # fetch the user table and the file concurrently
+    file_future = io_pool.submit(
+        db.collection("Files").document(data.get("file_id")).get
+    )
     recommender_ref = db.collection("User").document(uid).get()
     if recommender_ref.exists == False:
         return NotFound("The user was not found")
     recommender: dict = recommender_ref.to_dict()
 
-    # fetch the file data from firestore
-    file_ref = db.collection("Files").document(data.get("file_id"))
-    if not file_ref.get().exists:
+    file_snapshot = file_future.result()
+    if not file_snapshot.exists:
         return NotFound("The file not found")
-    file: dict = file_ref.get().to_dict()
+    file: dict = file_snapshot.to_dict()
 
     # Only the recommender have access to give recommendation of the file
     if recommender.get("dod") != file.get("recommender"):
@@ -1102,48 +1623,40 @@ def give_recommendation():
             "The user is not authorized to retrieve this content"
         )
 
-    if "comment" in data:
-        file_ref.update({"comment": data.get("comment")})
-
-    file_ref.update(
-        {
-            "is_recommended": data.get("is_recommended"),
-            "status": 2,
-            "timestamp": firestore.ArrayUnion([datetime.now()]),
-            "timestamp_string": firestore.ArrayUnion(["File Recommended"]),
-        }
+    batch = db.batch()
+    error = file_states.stage_transition(
+        batch,
+        file_snapshot,
+        file_history.RECOMMEND,
+        actor=uid,
+        actor_name=recommender.get("name"),
+        status=file_states.PENDING,
+        comment=data.get("comment"),
+        changes={"is_recommended": data.get("is_recommended")},
     )
-
-    # update the file from storage
-    bucket = storage.bucket()
-    file_path: str = "file/" + data.get("file_id")
-    blob = bucket.blob(file_path)
-    blob.upload_from_string(data.get("file"), content_type="application/pdf")
-
-    # notified the user the decision
-    try:
-        if data.get("is_recommended"):
-            create_notification(
-                notification_type="positive file recommendation",
-                type=file.get("filetype"),
-                sender=uid,
-                id=data.get("file_id"),
-                receiver_uid=file.get("author"),
-                receiver_dod=None,
-                sender_name=recommender.get("name"),
-            )
-        else:
-            create_notification(
-                notification_type="negative file recommendation",
-                type=file.get("filetype"),
-                sender=uid,
-                id=data.get("file_id"),
-                receiver_uid=file.get("author"),
-                receiver_dod=None,
-                sender_name=recommender.get("name"),
-            )
-        # notified the reviewer to review this file
-        create_notification(
+    if error:
+        return error
+
+    # notified the user the decision and the reviewer to review this file
+    notifications: list = [
+        outbox.stage(
+            batch,
+            create_notification,
+            notification_type=(
+                "positive file recommendation"
+                if data.get("is_recommended")
+                else "negative file recommendation"
+            ),
+            type=file.get("filetype"),
+            sender=uid,
+            id=data.get("file_id"),
+            receiver_uid=file.get("author"),
+            receiver_dod=None,
+            sender_name=recommender.get("name"),
+        ),
+        outbox.stage(
+            batch,
+            create_notification,
             notification_type="review file",
             type=file.get("filetype"),
             sender=uid,
@@ -1151,9 +1664,19 @@ def give_recommendation():
             receiver_dod=file.get("reviewer"),
             receiver_uid=None,
             sender_name=recommender.get("name"),
-        )
-    except:
-        return NotFound("The reviewer was not found")
+        ),
+    ]
+
+    error = file_states.commit(batch)
+    if error:
+        return error
+
+    # update the file from storage
+    bucket = storage.bucket()
+    file_path: str = "file/" + data.get("file_id")
+    blob = bucket.blob(file_path)
+    blob.upload_from_string(data.get("file"), content_type="application/pdf")
+    outbox.dispatch(*notifications)
 
     return Response("Recommend post", 200)
 
@@ -1183,6 +1706,18 @@ def get_files_by_type() -> Response:
           schema:
             type: integer
           required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+        - in: query
+          name: fields
+          schema:
+            type: string
+          description: Comma separated fields to return, * for all fields
+          required: false
         - in: query
           name: filetype
           schema:
@@ -1207,37 +1742,264 @@ def get_files_by_type() -> Response:
     token: str = request.headers["Authorization"]
     decoded_token: dict = auth.verify_id_token(token)
     uid: str = decoded_token.get("uid")
-    # the default page limits is 10
-    page_limit: int = 10
 
-     # iterate over userDocs and find each person who has uid as superior
+    # iterate over userDocs and find each person who has uid as superior
     subordinateList: list = []
-    userDocs = db.collection('User').where('superior', '==', uid).stream()
+    userDocs = db.collection("User").where("superior", "==", uid).stream()
 
     for doc in userDocs:
         userDict = doc.to_dict()
-        subordinateList.append(userDict['dod'])
+        subordinateList.append(userDict["dod"])
 
-    if "page_limit" in request.args:
-        page_limit = request.args.get("page_limit", default=10, type=int)
-
-    file_docs: list = []
-    filetype: str = request.args.get("filetype", type=str)
     files: list = []
+    pages: list = []
 
+    # every subordinate is paged through separately
     for subordinateId in subordinateList:
-        file_docs = (
-            db.collection("Files")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("author", "==", subordinateId)
-            .where("filetype", "==", filetype)
-            .limit(page_limit)
-            .stream()
+        page: Page = SUBORDINATE_FILES.page(
+            request.args, cursor_key=subordinateId, author=subordinateId
         )
+        pages.append(page)
 
-        for file in file_docs:
+        for file in page.docs:
             files.append(file.to_dict())
 
-    
-    return jsonify(files), 200
+    return paginated(files, *pages)
+
+
+@files.get("/get_inbox")
+@check_token
+def get_inbox() -> Response:
+    """
+    Count the files the user reviews or recommends, by status and filetype.
+    ---
+    tags:
+        - files
+    summary: Gets the review and recommend counts of the user
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    responses:
+        200:
+            content:
+                application/json:
+                    schema:
+                        $ref: '#/components/schemas/Inbox'
+        401:
+            description: Unauthorized - the provided token is not valid
+        404:
+            description: NotFound
+        500:
+            description: Internal API Error
+    """
+    # check tokens and get uid from token
+    token: str = request.headers["Authorization"]
+    decoded_token: dict = auth.verify_id_token(token)
+    uid: str = decoded_token.get("uid")
+
+    user_ref = db.collection("User").document(uid).get()
+    if user_ref.exists == False:
+        return NotFound("The user was not found")
+    user: dict = user_ref.to_dict()
+
+    inbox: dict = dict()
+    if user.get("dod"):
+        inbox_ref = (
+            db.collection(file_counters.INBOXES)
+            .document(str(user.get("dod")))
+            .get()
+        )
+        if inbox_ref.exists:
+            inbox = inbox_ref.to_dict()
+
+    return jsonify(
+        {
+            "reviewer": file_counters.get_counts(inbox, "reviewer"),
+            "recommender": file_counters.get_counts(inbox, "recommender"),
+        }
+    )
+
+
+@files.get("/get_file_counts")
+@check_token
+def get_file_counts() -> Response:
+    """
+    Count the files of the user by status and filetype.
+    ---
+    tags:
+        - files
+    summary: Gets the file counts of the user
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    responses:
+        200:
+            content:
+                application/json:
+                    schema:
+                        $ref: '#/components/schemas/FileCounts'
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    # check tokens and get uid from token
+    token: str = request.headers["Authorization"]
+    decoded_token: dict = auth.verify_id_token(token)
+    uid: str = decoded_token.get("uid")
+
+    counts_ref = db.collection(file_counters.FILE_COUNTS).document(uid).get()
+    counts: dict = counts_ref.to_dict() if counts_ref.exists else dict()
+
+    return jsonify(file_counters.get_counts(counts, "author"))
+
+
+@files.post("/reconcile_file_counters")
+@check_token
+@admin_only
+def reconcile_file_counters() -> Response:
+    """
+    Recount the files and repair the file counters that drifted.
+    ---
+    tags:
+        - files
+    summary: Repairs the file counters
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    responses:
+        202:
+            description: Reconciliation queued
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    # the recount streams every file, so it runs on the outbox workers
+    outbox.enqueue(file_counters.reconcile)
+
+    return Response("Reconciliation queued", 202)
+
+
+@files.get("/get_file_history/<file_id>")
+@check_token
+def get_file_history(file_id: str) -> Response:
+    """
+    Get the history of a file, newest first.
+    ---
+    tags:
+        - files
+    summary: Gets the history of a file
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+        - name: file_id
+          in: path
+          schema:
+              type: string
+          description: The ID of the file
+          required: true
+        - in: query
+          name: page_limit
+          schema:
+            type: integer
+          required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+    responses:
+        200:
+            content:
+                application/json:
+                    schema:
+                        type: array
+                        items:
+                            $ref: '#/components/schemas/FileHistory'
+        400:
+            description: Bad request
+        401:
+            description: Unauthorized - the provided token is not valid
+        404:
+            description: NotFound
+        500:
+            description: Internal API Error
+    """
+    # check tokens and get uid from token
+    token: str = request.headers["Authorization"]
+    decoded_token: dict = auth.verify_id_token(token)
+    uid: str = decoded_token.get("uid")
+
+    file_future = io_pool.submit(db.collection("Files").document(file_id).get)
+    user_snapshot = db.collection("User").document(uid).get()
+    if user_snapshot.exists == False:
+        return NotFound("The user was not found")
+    user: dict = user_snapshot.to_dict()
+
+    file_snapshot = file_future.result()
+    if not file_snapshot.exists:
+        return NotFound("The file was not found")
+    file: dict = file_snapshot.to_dict()
+
+    # Only the author, reviewer, and admin have access to the data
+    if (
+        user.get("dod") != file.get("reviewer")
+        and uid != file.get("author")
+        and user.get("dod") != file.get("recommender")
+        and user.get("role") != "ara"
+    ):
+        return Unauthorized(
+            "The user is not authorized to retrieve this content"
+        )
+
+    page: Page = FILE_HISTORY.page(request.args, file_id=file_id)
+    history: list = []
+    for entry in page.docs:
+        history.append(entry.to_dict())
+
+    return paginated(history, page)
+
 
+@files.get("/get_blob_cache_stats")
+@check_token
+@admin_only
+def get_blob_cache_stats() -> Response:
+    """
+    Get the hit ratio of the workers of the answering host, in total and by
+    pid, and the size of their shared blob cache.
+    ---
+    tags:
+        - files
+    summary: Gets blob cache statistics
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    responses:
+        200:
+            content:
+                application/json:
+                    schema:
+                        type: object
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    return jsonify(blob_cache.stats()), 200
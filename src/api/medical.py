@@ -160,17 +160,17 @@ def upload_medical_data() -> Response:
 
         receiver: dict = receiver_list[0]
 
-        fcm_tokens: list = [receiver.get("FCMToken")]
+        uids: list = [receiver.get("uid")]
 
         add_medical_notifications(
-            entry.get("dent_date"),
-            fcm_tokens,
+            entry.get("dent_date").to_pydatetime(),
+            uids,
             {"title": "dent alert", "body": "dental appointment alert"},
         )
 
         add_medical_notifications(
-            entry.get("pha_date"),
-            fcm_tokens,
+            entry.get("pha_date").to_pydatetime(),
+            uids,
             {"title": "pha alert", "body": "pha appointment alert"},
         )
 
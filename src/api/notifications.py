@@ -3,38 +3,123 @@
     src.api.events
     ~~~~~~~~~~~~~~
     Functions:
+        notification_entry()
+        coalescing_key()
+        missing_dods()
+        create_notifications()
         create_notification()
         get_notifications()
         read_notifications()
         delete_notifications()
+        read_all()
+        delete_many()
+        get_unread_count()
+        reconcile_unread_counts()
+        send_notifications()
+        send_announcement()
 """
-from datetime import datetime
+from datetime import datetime, timezone
+from dateutil import parser
 from firebase_admin import auth, firestore, messaging
+from google.api_core import exceptions as api_exceptions
 from flask import Response, jsonify, request
+from itertools import islice
 from uuid import uuid4
+import hashlib
+import logging
+import os
+import time
+import typing as t
+from werkzeug.datastructures import MultiDict
 from werkzeug.exceptions import BadRequest, NotFound, Unauthorized
 
 from src.api import Blueprint
+from src.common.batches import BATCH_SIZE
 from src.common.database import db
-from src.common.decorators import check_token
+from src.common import device_tokens, outbox, topics
+from src.common.decorators import admin_only, check_token
+from src.common.io_pool import io_pool
+from src.common.queries import ListQuery, Page, paginated
+from src.common.scheduler import scheduler
+from src.common import unread_counters
+from src.common.unread_counters import stage_unread
 from src.common.notifications import (
     add_scheduled_notification,
-    send_notification,
+    push,
+    send_to_topic,
+    send_to_users,
 )
 
 notifications: Blueprint = Blueprint("notifications", __name__)
 
+# Firestore in queries take up to 30 values
+IN_LIMIT: int = 30
+# the notifications read_all and delete_many take by id
+MAX_BULK_NOTIFICATIONS: int = 500
+
+# the attempts at writing notifications that keep being changed meanwhile
+NOTIFICATION_WRITE_ATTEMPTS: int = 5
+# notifications to a receiver about the same subject within a window
+# update one document and get a single push, 0 disables it
+NOTIFICATION_WINDOW_SECONDS: int = int(
+    os.getenv("NOTIFICATION_WINDOW_SECONDS", 60)
+)
 
-def create_notification(
+logger: logging.Logger = logging.getLogger(__name__)
+
+# the get_notifications query, optional filters come from the request
+NOTIFICATION_SUMMARY: list = [
+    "notification_id",
+    "notification_type",
+    "type",
+    "id",
+    "sender",
+    "sender_name",
+    "read",
+    "count",
+    "timestamp",
+]
+USER_NOTIFICATIONS: ListQuery = (
+    ListQuery(
+        "Notification", order_by="timestamp", summary=NOTIFICATION_SUMMARY
+    )
+    .where("receiver")
+    .optional("read", type=int, transform=lambda read: read == 1)
+    .optional("type", arg="file_type")
+    .optional("notification_type")
+)
+
+
+def _utc(value) -> datetime:
+    # the stored timestamps are in UTC, as are the times naming no zone
+    if not isinstance(value, datetime):
+        value = parser.isoparse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+# the notifications read_all and delete_many select by filter, whole
+# documents since they are written on the condition of their update time
+SELECTED_NOTIFICATIONS: ListQuery = (
+    ListQuery("Notification", order_by="timestamp")
+    .where("receiver")
+    .optional("read", type=int, transform=lambda read: read == 1)
+    .optional("timestamp", op="<", arg="older_than", type=_utc)
+)
+
+
+def notification_entry(
     notification_type: str,
     type: str,
     sender: str,
     id: str,
-    receiver_dod: str = None,
-    receiver_uid: str = None,
+    receiver: str = None,
     sender_name: str = None,
-):
-    receiver: dict = dict()
+) -> dict:
+    """
+    Build the Notification document, for callers writing it themselves.
+    """
     entry: dict = dict()
     entry["notification_type"] = notification_type
     entry["sender"] = sender
@@ -44,44 +129,260 @@ def create_notification(
     entry["id"] = id
     entry["sender_name"] = sender_name
     entry["timestamp"] = firestore.SERVER_TIMESTAMP
+    if receiver != None:
+        entry["receiver"] = receiver
 
-    if receiver_uid != None:
-        entry["receiver"] = receiver_uid
-        # get the receiver table
-        receiver_ref = db.collection("User").document(receiver_uid).get()
-        if receiver_ref.exists == False:
-            return NotFound("The user was not found")
-        receiver = receiver_ref.to_dict()
-    else:
-        # get to_user uid.
-        receiver_docs = (
-            db.collection("User")
-            .where("dod", "==", receiver_dod)
-            .limit(1)
-            .stream()
-        )
+    return entry
+
+
+def _window() -> int:
+    # the number of the coalescing window now, None when disabled
+    if NOTIFICATION_WINDOW_SECONDS <= 0:
+        return None
+    return int(time.time() // NOTIFICATION_WINDOW_SECONDS)
+
+
+def coalescing_key(window: int, *subject) -> str:
+    """
+    The id shared by the notifications about the subject in the window.
+    """
+    parts: str = "\x1f".join(str(part) for part in (window, *subject))
+    return hashlib.sha256(parts.encode("utf-8")).hexdigest()
 
-        receiver_list: list = []
-        for doc in receiver_docs:
-            receiver_list.append(doc.to_dict())
 
-        if not receiver_list:
-            raise NotFound("The reviewer ", receiver_dod, " was not found")
+def _users_by_dod(dods: list) -> list:
+    return list(db.collection("User").where("dod", "in", dods).stream())
 
-        receiver = receiver_list[0]
-        entry["receiver"] = receiver.get("uid")
 
-    # update firesotre
-    db.collection("Notification").document(entry.get("notification_id")).set(
-        entry
+def missing_dods(dods: list) -> list:
+    """
+    The DoD IDs, of the given ones, that no user has. The endpoints check
+    their receivers with it before they commit, their notifications are
+    only created later by the outbox.
+    """
+    dods = list(dict.fromkeys(dod for dod in dods if dod))
+    chunks: list = [
+        dods[i : i + IN_LIMIT] for i in range(0, len(dods), IN_LIMIT)
+    ]
+    found: set = set()
+    for users in io_pool.map(_users_by_dod, chunks):
+        found.update(user.to_dict().get("dod") for user in users)
+
+    return [dod for dod in dods if dod not in found]
+
+
+def _resolve_receivers(receivers: list) -> list:
+    # the uids of the receivers, given by uid or by dod, that exist
+    uids: list = list(
+        dict.fromkeys(
+            receiver["uid"] for receiver in receivers if receiver.get("uid")
+        )
+    )
+    dods: list = list(
+        dict.fromkeys(
+            receiver["dod"]
+            for receiver in receivers
+            if not receiver.get("uid") and receiver.get("dod")
+        )
     )
 
+    found: list = list()
+    if uids:
+        user_refs: list = [db.collection("User").document(uid) for uid in uids]
+        found.extend(user.id for user in db.get_all(user_refs) if user.exists)
+    chunks: list = [
+        dods[i : i + IN_LIMIT] for i in range(0, len(dods), IN_LIMIT)
+    ]
+    for users in io_pool.map(_users_by_dod, chunks):
+        found.extend(user.to_dict().get("uid") for user in users)
+
+    found = list(dict.fromkeys(uid for uid in found if uid))
+    if len(found) < len(uids) + len(dods):
+        logger.warning(
+            "%d of %d receivers were not found",
+            len(uids) + len(dods) - len(found),
+            len(uids) + len(dods),
+        )
+
+    return found
+
+
+def _stage_notifications(batch, entries: list, coalesce: bool) -> None:
+    refs: list = [
+        db.collection("Notification").document(entry["notification_id"])
+        for entry in entries
+    ]
+    snapshots: dict = {snapshot.id: snapshot for snapshot in db.get_all(refs)}
+    for ref, entry in zip(refs, entries):
+        snapshot = snapshots.get(ref.id)
+        if snapshot is None or not snapshot.exists:
+            batch.create(ref, {**entry, "count": 1})
+            stage_unread(batch, entry["receiver"], 1)
+        elif coalesce:
+            # only a notification that was read counts again, and only if
+            # it was not changed since
+            batch.update(
+                ref,
+                {**entry, "count": firestore.Increment(1)},
+                option=db.write_option(last_update_time=snapshot.update_time),
+            )
+            if snapshot.to_dict().get("read"):
+                stage_unread(batch, entry["receiver"], 1)
+
+
+def _write_notifications(entries: list, coalesce: bool) -> None:
+    # the documents are read, then written and counted on the condition
+    # they did not change, so concurrent writes of the same documents
+    # and reads of them count them once
+    for attempt in range(NOTIFICATION_WRITE_ATTEMPTS):
+        batch = db.batch()
+        _stage_notifications(batch, entries, coalesce)
+        try:
+            batch.commit()
+            return
+        except (
+            api_exceptions.Conflict,
+            api_exceptions.FailedPrecondition,
+            api_exceptions.NotFound,
+        ):
+            if attempt == NOTIFICATION_WRITE_ATTEMPTS - 1:
+                raise
+            logger.info("Notifications changed while written, retrying")
+
+
+@outbox.task
+def create_notifications(
+    notification_type: str,
+    type: str,
+    sender: str,
+    id: str,
+    receivers: list,
+    sender_name: str = None,
+) -> list:
+    """
+    Notify the receivers, each given as {"uid": ...} or {"dod": ...}, with
+    a Notification document apiece and a single push to all their devices.
+    Within a NOTIFICATION_WINDOW_SECONDS window, the notifications about
+    the same subject are counted on one document per receiver and the push
+    is a digest sent when the window closes. Returns the uids of the
+    receivers found.
+    """
+    uids: list = _resolve_receivers(receivers)
+    window: int = _window()
+
+    entries: list = list()
+    for uid in uids:
+        entry: dict = notification_entry(
+            notification_type, type, sender, id, uid, sender_name=sender_name
+        )
+        if window is not None:
+            # one document per receiver and subject in the window, a
+            # retried task may count its notifications twice
+            entry["notification_id"] = coalescing_key(
+                window, notification_type, type, id, uid
+            )
+        else:
+            # the same documents on every attempt of the task
+            key: str = outbox.idempotency_key(
+                "notification", notification_type, id, uid
+            )
+            if key:
+                entry["notification_id"] = key
+        entries.append(entry)
+
+    # a notification and the unread counter of its receiver per receiver
+    for i in range(0, len(entries), BATCH_SIZE // 2):
+        _write_notifications(
+            entries[i : i + BATCH_SIZE // 2], coalesce=window is not None
+        )
+
     # create push notification for mobile
-    if receiver.get("token") and "file" in notification_type:
+    if uids and "file" in notification_type:
         data: dict = dict()
         data["title"] = notification_type
-        data["body"] = sender_name + notification_type
-        send_notification([receiver.get("FCMToken")], data)
+        data["body"] = (sender_name or "") + notification_type
+        if window is None:
+            send_to_users(uids, data)
+        else:
+            # a single digest push when the window closes
+            scheduler.schedule(
+                datetime.fromtimestamp(
+                    (window + 1) * NOTIFICATION_WINDOW_SECONDS, timezone.utc
+                ),
+                send_to_users,
+                job_id=coalescing_key(window, notification_type, type, id),
+                uids=firestore.ArrayUnion(uids),
+                data=data,
+            )
+
+    return uids
+
+
+@outbox.task
+def create_notification(
+    notification_type: str,
+    type: str,
+    sender: str,
+    id: str,
+    receiver_dod: str = None,
+    receiver_uid: str = None,
+    sender_name: str = None,
+):
+    receiver: dict = (
+        {"uid": receiver_uid}
+        if receiver_uid != None
+        else {"dod": receiver_dod}
+    )
+    uids: list = create_notifications(
+        notification_type,
+        type,
+        sender,
+        id,
+        receivers=[receiver],
+        sender_name=sender_name,
+    )
+    if not uids:
+        return NotFound("The user was not found")
+
+
+def _owned(transaction, notification_ref, uid: str) -> tuple:
+    # (notification, error) of the notification of the user
+    for snapshot in transaction.get(notification_ref):
+        if not snapshot.exists:
+            break
+        notification: dict = snapshot.to_dict()
+        if notification.get("receiver") != uid:
+            return None, Unauthorized(
+                "The user is not authorized to retrieve this content"
+            )
+        return notification, None
+
+    return None, NotFound("The notification was not found")
+
+
+@firestore.transactional
+def _mark_read(transaction, notification_ref, uid: str) -> Exception:
+    notification, error = _owned(transaction, notification_ref, uid)
+    if error:
+        return error
+    if notification.get("read") == True:
+        return BadRequest("The notification has been read")
+
+    transaction.update(notification_ref, {"read": True})
+    stage_unread(transaction, uid, -1)
+    return None
+
+
+@firestore.transactional
+def _delete(transaction, notification_ref, uid: str) -> Exception:
+    notification, error = _owned(transaction, notification_ref, uid)
+    if error:
+        return error
+
+    transaction.delete(notification_ref)
+    if not notification.get("read"):
+        stage_unread(transaction, uid, -1)
+    return None
 
 
 @notifications.get("/get_notifications")
@@ -104,6 +405,18 @@ def get_notifications():
           schema:
             type: integer
           required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+        - in: query
+          name: fields
+          schema:
+            type: string
+          description: Comma separated fields to return, * for all fields
+          required: false
         - in: query
           name: read
           schema:
@@ -114,6 +427,11 @@ def get_notifications():
           schema:
             type: string
           required: false
+        - in: query
+          name: notification_type
+          schema:
+            type: string
+          required: false
     responses:
         200:
             content:
@@ -137,54 +455,13 @@ def get_notifications():
     token: str = request.headers["Authorization"]
     decoded_token: dict = auth.verify_id_token(token)
     uid: str = decoded_token.get("uid")
-    # Get the page limits, notification_type, read from the front-end if exists
-    page_limit: int = request.args.get("page_limit", default=10, type=int)
-    file_type: str = request.args.get("file_type", type=str)
-    read: int = request.args.get("read", type=int)
-    print(read)
-    # Get the next batch of review docs
-    if "file_type" in request.args and "read" in request.args:
-        notification_docs = (
-            db.collection("Notification")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("reviewer", "==", uid)
-            .where("read", "==", read == 1)
-            .where("file_type", "==", file_type)
-            .limit(page_limit)
-            .stream()
-        )
-    elif "notification_type" in request.args:
-        notification_docs = (
-            db.collection("Notification")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("receiver", "==", uid)
-            .where("file_type", "==", file_type)
-            .limit(page_limit)
-            .stream()
-        )
-    elif "read" in request.args:
-        notification_docs = (
-            db.collection("Notification")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("receiver", "==", uid)
-            .where("read", "==", read == 1)
-            .limit(page_limit)
-            .stream()
-        )
-    else:
-        notification_docs = (
-            db.collection("Notification")
-            .order_by("timestamp", direction=firestore.Query.DESCENDING)
-            .where("receiver", "==", uid)
-            .limit(page_limit)
-            .stream()
-        )
+    page: Page = USER_NOTIFICATIONS.page(request.args, receiver=uid)
 
     notifications: list = list()
-    for doc in notification_docs:
+    for doc in page.docs:
         notifications.append(doc.to_dict())
 
-    return jsonify(notifications), 200
+    return paginated(notifications, page)
 
 
 @notifications.put("/read_notification/<notification_id>")
@@ -222,19 +499,9 @@ def read_notification(notification_id: str):
     uid: str = decoded_token.get("uid")
 
     notification_ref = db.collection("Notification").document(notification_id)
-    if notification_ref.get().exists == False:
-        return NotFound("The notification was not found")
-    notification: dict = notification_ref.get().to_dict()
-
-    if notification.get("receiver") != uid:
-        return Unauthorized(
-            "The user is not authorized to retrieve this content"
-        )
-
-    if notification.get("read") == True:
-        return BadRequest("The notification has been read")
-
-    notification_ref.update({"read": True})
+    error: Exception = _mark_read(db.transaction(), notification_ref, uid)
+    if error:
+        return error
 
     return Response("Notification marked as read", 200)
 
@@ -274,23 +541,335 @@ def delete_notification(notification_id: str):
     uid: str = decoded_token.get("uid")
 
     notification_ref = db.collection("Notification").document(notification_id)
-    if notification_ref.get().exists == False:
-        return NotFound("The notification was not found")
-    notification: dict = notification_ref.get().to_dict()
+    error: Exception = _delete(db.transaction(), notification_ref, uid)
+    if error:
+        return error
+
+    return Response("Notification deleted", 200)
+
 
+def _matches(snapshot, uid: str, selection: dict) -> bool:
+    # whether the snapshot is a notification of the user the filters pick
+    if not snapshot.exists:
+        return False
+    notification: dict = snapshot.to_dict()
     if notification.get("receiver") != uid:
-        return Unauthorized(
-            "The user is not authorized to retrieve this content"
+        return False
+    if selection.get("read") is not None and notification.get(
+        "read"
+    ) != selection.get("read"):
+        return False
+    if selection.get("older_than") and not (
+        isinstance(notification.get("timestamp"), datetime)
+        and notification.get("timestamp") < selection.get("older_than")
+    ):
+        return False
+    return True
+
+
+def _selected(uid: str, selection: dict) -> tuple:
+    # (snapshots, skipped ids) of the user's notifications picked by id,
+    # or by the read and older_than filters
+    if selection.get("notification_ids") is not None:
+        notification_refs: list = [
+            db.collection("Notification").document(notification_id)
+            for notification_id in dict.fromkeys(
+                selection.get("notification_ids")
+            )
+        ]
+        snapshots: list = list()
+        skipped: list = list()
+        for snapshot in db.get_all(notification_refs):
+            # the missing ones and the ones of other users alike
+            if (
+                not snapshot.exists
+                or snapshot.to_dict().get("receiver") != uid
+            ):
+                skipped.append(snapshot.id)
+            elif _matches(snapshot, uid, selection):
+                snapshots.append(snapshot)
+        return snapshots, skipped
+
+    args: MultiDict = MultiDict()
+    if selection.get("read") is not None:
+        args["read"] = int(selection.get("read"))
+    if selection.get("older_than"):
+        args["older_than"] = selection.get("older_than")
+    # at most MAX_BULK_NOTIFICATIONS a request, the newest first
+    snapshots = list(
+        islice(
+            SELECTED_NOTIFICATIONS.stream(args, receiver=uid),
+            MAX_BULK_NOTIFICATIONS,
         )
+    )
+
+    return snapshots, []
+
+
+def _apply(
+    uid: str, selection: dict, snapshots: list, write: t.Callable
+) -> int:
+    # the writes and the change of the unread count in batches, each write
+    # on the condition that the notification did not change since it was
+    # read, the changed ones are selected again. Returns the number of
+    # notifications written.
+    written: int = 0
+    for i in range(0, len(snapshots), BATCH_SIZE - 1):
+        chunk: list = snapshots[i : i + BATCH_SIZE - 1]
+        for attempt in range(NOTIFICATION_WRITE_ATTEMPTS):
+            if not chunk:
+                break
+            batch = db.batch()
+            for snapshot in chunk:
+                write(
+                    batch,
+                    snapshot.reference,
+                    db.write_option(last_update_time=snapshot.update_time),
+                )
+            unread: int = sum(
+                1 for snapshot in chunk if not snapshot.to_dict().get("read")
+            )
+            stage_unread(batch, uid, -unread)
+            try:
+                batch.commit()
+            except (
+                api_exceptions.FailedPrecondition,
+                api_exceptions.NotFound,
+            ):
+                if attempt == NOTIFICATION_WRITE_ATTEMPTS - 1:
+                    raise
+                chunk = [
+                    snapshot
+                    for snapshot in db.get_all(
+                        [snapshot.reference for snapshot in chunk]
+                    )
+                    if _matches(snapshot, uid, selection)
+                ]
+                continue
+            written += len(chunk)
+            break
+
+    return written
+
+
+def _selection(data: dict) -> dict:
+    # the checked selection of the request body, or an error
+    selection: dict = dict(data or {})
+    notification_ids = selection.get("notification_ids")
+    if notification_ids is not None:
+        if not isinstance(notification_ids, list) or not all(
+            isinstance(notification_id, str) and notification_id
+            for notification_id in notification_ids
+        ):
+            return BadRequest("notification_ids must be a list of ids")
+        if len(notification_ids) > MAX_BULK_NOTIFICATIONS:
+            return BadRequest(
+                "At most %d notifications can be changed at once"
+                % MAX_BULK_NOTIFICATIONS
+            )
+    if selection.get("read") is not None and not isinstance(
+        selection.get("read"), bool
+    ):
+        return BadRequest("read must be a boolean")
+    if selection.get("older_than"):
+        try:
+            selection["older_than"] = _utc(selection.get("older_than"))
+        except (TypeError, ValueError):
+            return BadRequest("older_than must be an ISO 8601 date")
+
+    return selection
+
+
+@notifications.put("/read_all")
+@check_token
+def read_all():
+    """
+    Mark the given notifications, or all the unread notifications, as read.
+    ---
+    tags:
+        - notifications
+    summary: Marks notifications as read
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    requestBody:
+        required: false
+        content:
+            application/json:
+                schema:
+                    $ref: '#/components/schemas/NotificationSelection'
+    responses:
+        200:
+            content:
+                application/json:
+                    schema:
+                        $ref: '#/components/schemas/BulkNotificationResult'
+        400:
+            description: Bad request
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    # check tokens and get uid from token
+    token: str = request.headers["Authorization"]
+    decoded_token: dict = auth.verify_id_token(token)
+    uid: str = decoded_token.get("uid")
 
-    notification_ref.delete()
+    selection = _selection(request.get_json(silent=True))
+    if isinstance(selection, Exception):
+        return selection
+
+    # only the unread ones change
+    selection["read"] = False
+    snapshots, skipped = _selected(uid, selection)
+    changed: int = _apply(
+        uid,
+        selection,
+        snapshots,
+        lambda batch, ref, option: batch.update(
+            ref, {"read": True}, option=option
+        ),
+    )
 
-    return Response("Notification deleted", 200)
+    return jsonify({"changed": changed, "skipped": skipped})
+
+
+@notifications.delete("/delete_many")
+@check_token
+def delete_many():
+    """
+    Delete the given notifications, or the ones matching the filters.
+    ---
+    tags:
+        - notifications
+    summary: Deletes notifications
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    requestBody:
+        required: true
+        content:
+            application/json:
+                schema:
+                    $ref: '#/components/schemas/NotificationSelection'
+    responses:
+        200:
+            content:
+                application/json:
+                    schema:
+                        $ref: '#/components/schemas/BulkNotificationResult'
+        400:
+            description: Bad request
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    # check tokens and get uid from token
+    token: str = request.headers["Authorization"]
+    decoded_token: dict = auth.verify_id_token(token)
+    uid: str = decoded_token.get("uid")
+
+    selection = _selection(request.get_json(silent=True))
+    if isinstance(selection, Exception):
+        return selection
+    # never the whole inbox by accident
+    if (
+        selection.get("notification_ids") is None
+        and selection.get("read") is None
+        and not selection.get("older_than")
+    ):
+        return BadRequest("Missing the notification ids or a filter")
+
+    snapshots, skipped = _selected(uid, selection)
+    changed: int = _apply(
+        uid,
+        selection,
+        snapshots,
+        lambda batch, ref, option: batch.delete(ref, option=option),
+    )
+
+    return jsonify({"changed": changed, "skipped": skipped})
+
+
+@notifications.get("/get_unread_count")
+@check_token
+def get_unread_count():
+    """
+    Count the unread notifications of the user.
+    ---
+    tags:
+        - notifications
+    summary: Gets the number of unread notifications
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    responses:
+        200:
+            content:
+                application/json:
+                    schema:
+                        type: object
+                        properties:
+                            unread:
+                                type: integer
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    # check tokens and get uid from token
+    token: str = request.headers["Authorization"]
+    decoded_token: dict = auth.verify_id_token(token)
+    uid: str = decoded_token.get("uid")
+
+    return jsonify({"unread": unread_counters.get_unread(uid)})
+
+
+@notifications.post("/reconcile_unread_counts")
+@check_token
+@admin_only
+def reconcile_unread_counts():
+    """
+    Recount the unread notifications and repair the counters that drifted.
+    ---
+    tags:
+        - notifications
+    summary: Repairs the unread notification counters
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    responses:
+        202:
+            description: Reconciliation queued
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    # the recount streams every unread notification, so it runs on the
+    # outbox workers
+    outbox.enqueue(unread_counters.reconcile)
+
+    return Response("Reconciliation queued", 202)
 
 
 @notifications.post("/send_notification")
 @check_token
-def send_notification():
+def send_notifications():
     """
     Send a notification to a mobile device
     ---
@@ -309,9 +888,20 @@ def send_notification():
             type: array
             items: string
           required: true
+        - in: body
+          name: data
+          schema:
+            type: object
+            additionalProperties:
+                type: string
+          description: The data message pushed
     responses:
         200:
-            description: Notifications sent
+            description: The outcome of each device token, null when delivered, the FCM error code otherwise
+            schema:
+                type: object
+                additionalProperties:
+                    type: string
         400:
             description: Bad request
         401:
@@ -319,17 +909,62 @@ def send_notification():
         500:
             description: Internal API Error
     """
-    uids: list = request.args.get("uids", type=list)
+    uids: list = request.args.getlist("uids")
 
     if not uids:
         raise BadRequest("No user ids provided")
 
-    users: list = db.collection("User").where("uid", "in", uids).stream()
-    tokens = list()
+    tokens: list = device_tokens.tokens_for(uids)
+    results: dict = push(tokens, request.get_json(silent=True) or {})
+
+    return jsonify(results), 200
 
-    for user in users:
-        tokens.append(user.to_dict().get("FCMToken"))
 
-    send_notification(tokens, data=request.data)
+@notifications.post("/send_announcement")
+@check_token
+@admin_only
+def send_announcement():
+    """
+    Push an announcement to every device of a unit or a roster
+    ---
+    tags:
+        - notifications
+    summary: Send an announcement to a unit or a roster.
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    requestBody:
+        content:
+            application/json:
+                schema:
+                    $ref: '#/components/schemas/Announcement'
+    responses:
+        202:
+            description: Announcement queued
+        400:
+            description: Bad request
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    data: dict = request.get_json(silent=True) or {}
+    if bool(data.get("unit_name")) == bool(data.get("roster_name")):
+        return BadRequest("Give either a unit_name or a roster_name")
+    if not data.get("title"):
+        return BadRequest("Missing the title")
+
+    if data.get("unit_name"):
+        topic: str = topics.unit_topic(data.get("unit_name"))
+    else:
+        topic = topics.roster_topic(data.get("roster_name"))
+    outbox.enqueue(
+        send_to_topic,
+        topic=topic,
+        data={"title": data.get("title"), "body": data.get("body") or ""},
+    )
 
-    return Response("Notifications sent", 200)
+    return Response("Announcement queued", 202)
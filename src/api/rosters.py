@@ -18,6 +18,7 @@ from firebase_admin import storage, auth, firestore
 from uuid import uuid4
 from flask import jsonify
 
+from src.common import outbox, topics
 from src.common.database import db
 from src.api import Blueprint
 from src.common.helpers import find_subordinates_by_dod
@@ -29,6 +30,7 @@ from src.common.notifications import add_medical_notifications
 
 rosters: Blueprint = Blueprint("rosters", __name__)
 
+
 @rosters.post("/create_roster")
 @check_token
 def create_roster() -> Response:
@@ -53,6 +55,12 @@ def create_roster() -> Response:
 
         # upload to the user table
         db.collection("Roster").document(roster_name).set(entry)
+        if topics.member_uids(users_list):
+            outbox.enqueue(
+                topics.join,
+                topics=[topics.roster_topic(roster_name)],
+                uids=topics.member_uids(users_list),
+            )
 
         return Response("Roster registered", 201)
      
@@ -117,7 +125,16 @@ def delete_roster() -> Response:
             return NotFound("Roster not found"), 404
 
         # Delete roster from Firestore
+        members: list = topics.member_uids(
+            roster_ref.get().to_dict().get("users")
+        )
         roster_ref.delete()
+        if members:
+            outbox.enqueue(
+                topics.leave,
+                topics=[topics.roster_topic(roster_name)],
+                uids=members,
+            )
 
         # Return success response
         return jsonify("Roster deleted successfully"), 200
@@ -146,6 +163,12 @@ def add_to_roster() -> Response:
         roster_users = roster_doc.get("users") or []
         roster_users.append(user_data)
         roster_ref.update({"users": roster_users})
+        if topics.member_uids([user_data]):
+            outbox.enqueue(
+                topics.join,
+                topics=[topics.roster_topic(roster_name)],
+                uids=topics.member_uids([user_data]),
+            )
 
         # Return success response
         return jsonify("User added to roster successfully"), 200
@@ -175,6 +198,12 @@ def remove_from_roster() -> Response:
         if user_data in roster_users:
             roster_users.remove(user_data)
             roster_ref.update({"users": roster_users})
+            if topics.member_uids([user_data]):
+                outbox.enqueue(
+                    topics.leave,
+                    topics=[topics.roster_topic(roster_name)],
+                    uids=topics.member_uids([user_data]),
+                )
             return jsonify("User removed from roster successfully"), 200
         else:
             return NotFound("User not found in roster"), 404
@@ -10,7 +10,9 @@ from uuid import uuid4
 from flask import Response, request, jsonify
 from src.api import Blueprint
 from src.common.decorators import check_token
+from src.common import outbox, topics
 from src.common.database import db
+from src.common.notifications import send_to_topic
 from firebase_admin import auth, firestore
 from werkzeug.exceptions import (
     NotFound,
@@ -136,6 +138,9 @@ def upload_rst_data() -> Response:
         BytesIO(csv_file), dtype=str, keep_default_na=False, skiprows=3
     )
 
+    # the dods of the members of each unit in the file
+    unit_invitees: dict = dict()
+
     for i in range(len(csv_data)):
         entry: dict = dict()
         entry["author"] = uid
@@ -153,18 +158,22 @@ def upload_rst_data() -> Response:
         entry["remarks"] = csv_data.iloc[i]["REMARKS"]
         entry["remarks_2"] = csv_data.iloc[i]["REMARKS 2"]
 
-        # adding invitees with same unit name
+        # adding invitees with same unit name, each unit is queried once
         unit = entry["unit"]
-        invitees_ref = db.collection("User")
-        query_for_invitees = invitees_ref.where("unit_name", "==", unit).get()
-        invitees_dods = []
-
-        for doc in query_for_invitees:
-            result_dict = doc.to_dict()
-            if user.get("dod") != result_dict["dod"]:
-                invitees_dods.append(result_dict["dod"])
-
-        entry["invitees_dod"] = invitees_dods
+        if unit not in unit_invitees:
+            invitees_ref = db.collection("User")
+            query_for_invitees = (
+                invitees_ref.where("unit_name", "==", unit)
+                .select(["dod"])
+                .get()
+            )
+            unit_invitees[unit] = [
+                doc.get("dod")
+                for doc in query_for_invitees
+                if user.get("dod") != doc.get("dod")
+            ]
+
+        entry["invitees_dod"] = list(unit_invitees[unit])
 
         start_date_split = csv_data.iloc[i]["START DATE"].split("-")
         start_time = csv_data.iloc[i]["START TIME"]
@@ -201,18 +210,21 @@ def upload_rst_data() -> Response:
             entry
         )
 
-        receiver_docs = (
-            db.collection("User")
-            .where("dod", "==", user.get("dod"))
-            .limit(1)
-            .stream()
+    # one announcement per unit, to the devices subscribed to its topic
+    batch = db.batch()
+    announcements: list = [
+        outbox.stage(
+            batch,
+            send_to_topic,
+            topic=topics.unit_topic(unit),
+            data={
+                "title": "battle assembly",
+                "body": "Battle Assembly dates were uploaded for " + unit,
+            },
         )
-        receiver_list: list = []
-
-        for doc in receiver_docs:
-            receiver_list.append(doc.to_dict())
-
-        receiver: dict = receiver_list[0]
-        fcm_tokens: list = [receiver.get("FCMToken")]
+        for unit in unit_invitees
+    ]
+    batch.commit()
+    outbox.dispatch(*announcements)
 
     return Response("Successfully uploaded Battle Assembly dates")
@@ -5,6 +5,8 @@
     Functions:
         register_user()
         update_user()
+        register_device()
+        unregister_device()
         delete_user()
         get_user()
 """
@@ -15,10 +17,18 @@ from werkzeug.exceptions import BadRequest, NotFound, UnsupportedMediaType
 from firebase_admin import storage, auth, firestore
 from uuid import uuid4
 from flask import jsonify
+from itertools import chain
 
+from src.common import device_tokens, outbox, topics
 from src.common.database import db
+from src.common.blob_cache import blob_cache
+from src.common.queries import ListQuery, paginated
 from src.api import Blueprint
-from src.common.helpers import find_subordinates_by_dod
+from src.common.helpers import (
+    find_subordinates_by_dod,
+    make_etag,
+    not_modified,
+)
 import base64
 from io import BytesIO
 import pandas as pd
@@ -27,6 +37,31 @@ from src.common.notifications import add_medical_notifications
 
 users: Blueprint = Blueprint("users", __name__)
 
+# the get_users queries by target
+USER_SUMMARY: list = [
+    "uid",
+    "dod",
+    "name",
+    "email",
+    "grade",
+    "rank",
+    "branch",
+    "unit",
+    "unit_name",
+    "level",
+    "superior",
+    "officer",
+    "commander",
+]
+ALL_USERS: ListQuery = ListQuery("User", summary=USER_SUMMARY)
+OFFICERS: ListQuery = ListQuery("User", summary=USER_SUMMARY).where("officer")
+COMMANDERS: ListQuery = ListQuery("User", summary=USER_SUMMARY).where(
+    "commander"
+)
+LOWER_LEVEL_USERS: ListQuery = ListQuery("User", summary=USER_SUMMARY).where(
+    "level", ">"
+)
+
 
 @users.post("/register_user")
 @check_token
@@ -84,7 +119,6 @@ def register_user() -> Response:
     entry["branch"] = user_data.get("branch")
     entry["superior"] = user_data.get("superior")
     entry["level"] = user_data.get("level")
-    entry["FCMToken"] = user_data.get("FCMToken")
     # if user upload the profile picture
     if "profile_picture" in user_data:
         bucket = storage.bucket()
@@ -112,8 +146,23 @@ def register_user() -> Response:
     else:
         entry["officer"] = False
 
-    # upload to the user table
-    db.collection("User").document(uid).set(entry)
+    # upload to the user table, with the device the user registers from
+    batch = db.batch()
+    batch.set(db.collection("User").document(uid), entry)
+    if user_data.get("FCMToken"):
+        device_tokens.register(uid, user_data.get("FCMToken"), batch=batch)
+    batch.commit()
+
+    # subscribe the device to the topics of the user, e.g. of the rosters
+    # already listing the user
+    if user_data.get("FCMToken"):
+        user_topics: list = topics.user_topics(entry)
+        if user_topics:
+            outbox.enqueue(
+                topics.join,
+                topics=user_topics,
+                tokens=[user_data.get("FCMToken")],
+            )
 
     return Response("User registered", 201)
 
@@ -228,9 +277,17 @@ def upload_csv_users() -> Response:
                 password=user_entry["password"],
             ).uid
 
+        # the unit of a user already registered may change
+        previous = db.collection("User").document(user_entry["uid"]).get()
+        previous_unit: str = (
+            previous.to_dict().get("unit_name") if previous.exists else None
+        )
         db.collection("User").document(user_entry["uid"]).set(
             user_entry, merge=True
         )
+        topics.change_unit(
+            user_entry["uid"], previous_unit, user_entry["unit_name"]
+        )
         db.collection("Medical").document(medical_entry["dod"]).set(
             medical_entry, merge=True
         )
@@ -282,17 +339,17 @@ def upload_csv_users() -> Response:
 
         receiver: dict = receiver_list[0]
 
-        fcm_tokens: list = [receiver.get("FCMToken")]
+        uids: list = [receiver.get("uid")]
 
         add_medical_notifications(
-            medical_entry.get("dent_date"),
-            fcm_tokens,
+            medical_entry.get("dent_date").to_pydatetime(),
+            uids,
             {"title": "dent alert", "body": "dental appointment alert"},
         )
 
         add_medical_notifications(
-            medical_entry.get("pha_date"),
-            fcm_tokens,
+            medical_entry.get("pha_date").to_pydatetime(),
+            uids,
             {"title": "pha alert", "body": "pha appointment alert"},
         )
 
@@ -361,6 +418,11 @@ def update_user() -> Response:
     if "unit" in data:
         user_ref.update({"unit": data.get("unit")})
 
+    if "unit_name" in data and data.get("unit_name") != user.get("unit_name"):
+        user_ref.update({"unit_name": data.get("unit_name")})
+        # move the devices of the user to the topic of the new unit
+        topics.change_unit(uid, user.get("unit_name"), data.get("unit_name"))
+
     if "superior" in data:
         user_ref.update({"superior": data.get("superior")})
 
@@ -398,6 +460,105 @@ def update_user() -> Response:
     return Response("Successfully update user data", 200)
 
 
+@users.put("/register_device")
+@check_token
+def register_device() -> Response:
+    """
+    Register the FCM token of a device of the user, or refresh it
+    ---
+    tags:
+        - users
+    summary: Registers a device for push notifications
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    requestBody:
+        content:
+            application/json:
+                schema:
+                    $ref: '#/components/schemas/DeviceToken'
+    responses:
+        200:
+            description: Device registered
+        400:
+            description: Bad request
+        401:
+            description: Unauthorized - the provided token is not valid
+        404:
+            description: NotFound
+        500:
+            description: Internal API Error
+    """
+    token: str = request.headers["Authorization"]
+    uid: str = auth.verify_id_token(token).get("uid")
+    fcm_token: str = (request.get_json(silent=True) or {}).get("FCMToken")
+    if not fcm_token:
+        return BadRequest("No FCM token provided")
+
+    user_ref = db.collection("User").document(uid)
+    user = user_ref.get()
+    if user.exists == False:
+        return NotFound("The user was not found")
+
+    device_tokens.register(uid, fcm_token)
+    user_topics: list = topics.user_topics({**user.to_dict(), "uid": uid})
+    if user_topics:
+        outbox.enqueue(topics.join, topics=user_topics, tokens=[fcm_token])
+
+    return Response("Device registered", 200)
+
+
+@users.delete("/unregister_device")
+@check_token
+def unregister_device() -> Response:
+    """
+    Stop pushing notifications to a device of the user, e.g. on sign out
+    ---
+    tags:
+        - users
+    summary: Unregisters a device from push notifications
+    parameters:
+        - in: header
+          name: Authorization
+          schema:
+            type: string
+          required: true
+    requestBody:
+        content:
+            application/json:
+                schema:
+                    $ref: '#/components/schemas/DeviceToken'
+    responses:
+        200:
+            description: Device unregistered
+        400:
+            description: Bad request
+        401:
+            description: Unauthorized - the provided token is not valid
+        500:
+            description: Internal API Error
+    """
+    token: str = request.headers["Authorization"]
+    uid: str = auth.verify_id_token(token).get("uid")
+    fcm_token: str = (request.get_json(silent=True) or {}).get("FCMToken")
+    if not fcm_token:
+        return BadRequest("No FCM token provided")
+
+    user = db.collection("User").document(uid).get()
+    device_tokens.unregister(uid, fcm_token)
+    if user.exists:
+        user_topics: list = topics.user_topics({**user.to_dict(), "uid": uid})
+        if user_topics:
+            outbox.enqueue(
+                topics.leave, topics=user_topics, tokens=[fcm_token]
+            )
+
+    return Response("Device unregistered", 200)
+
+
 @users.delete("/delete_user/<uid>")
 @check_token
 @admin_only
@@ -444,7 +605,12 @@ def delete_user(uid: str) -> Response:
             return NotFound("The profile_picture not found.")
         blob.delete()
 
-    # delete record from user table
+    # delete record from user table, with the devices of the user
+    tokens: list = device_tokens.tokens_for([uid])
+    user_topics: list = topics.user_topics({**user, "uid": uid})
+    if tokens and user_topics:
+        outbox.enqueue(topics.leave, topics=user_topics, tokens=tokens)
+    device_tokens.unregister_all(uid)
     user_ref.delete()
 
     return Response("User Deleted", 200)
@@ -465,12 +631,19 @@ def get_user() -> Response:
           schema:
             type: string
           required: true
+        - in: header
+          name: If-None-Match
+          schema:
+            type: string
+          required: false
     responses:
         200:
             content:
                 application/json:
                     schema:
                         '#/components/schemas/User'
+        304:
+            description: Not modified - the client copy is up to date
         400:
             description: Bad request
         401:
@@ -485,38 +658,50 @@ def get_user() -> Response:
     uid: str = decoded_token.get("uid")
 
     # check if the user exists
-    user_ref = db.collection("User").document(uid)
-    if user_ref.get().exists == False:
+    user_snapshot = db.collection("User").document(uid).get()
+    if user_snapshot.exists == False:
         return NotFound("The user was not found")
 
-    user: dict = user_ref.get().to_dict()
+    user: dict = user_snapshot.to_dict()
 
-    # get the signature and the profile picture
+    # get the signature and the profile picture metadata
     bucket = storage.bucket()
+    signature_blob = None
+    profile_picture_blob = None
 
     if "signature" in user:
-        signature_path: str = user.get("signature")
-        blob = bucket.blob(signature_path)
-
-        if not blob.exists():
+        signature_blob = bucket.get_blob(user.get("signature"))
+        if signature_blob is None:
             return NotFound("The signature not found.")
 
-        # download the signature image
-        signature = blob.download_as_bytes()
-        user["signature"] = signature.decode("utf-8")
-
     if "profile_picture" in user:
-        profile_picture_path: str = user.get("profile_picture")
-        blob = bucket.blob(profile_picture_path)
-
-        if not blob.exists():
+        profile_picture_blob = bucket.get_blob(user.get("profile_picture"))
+        if profile_picture_blob is None:
             return NotFound("The profile picture not found.")
 
-        # download the profile_picture image
-        profile_picture = blob.download_as_bytes()
+    # the response only changes when one of its sources changes
+    etag: str = make_etag(
+        user_snapshot.update_time,
+        signature_blob.generation if signature_blob else None,
+        profile_picture_blob.generation if profile_picture_blob else None,
+    )
+    cached: Response = not_modified(etag)
+    if cached:
+        return cached
+
+    # download the signature image
+    if signature_blob:
+        signature = blob_cache.read(signature_blob)
+        user["signature"] = signature.decode("utf-8")
+
+    # download the profile_picture image
+    if profile_picture_blob:
+        profile_picture = blob_cache.read(profile_picture_blob)
         user["profile_picture"] = profile_picture.decode("utf-8")
 
-    return jsonify(user), 200
+    response: Response = jsonify(user)
+    response.set_etag(etag)
+    return response, 200
 
 
 @users.get("/get_users")
@@ -544,6 +729,18 @@ def get_users() -> Response:
           schema:
             type: integer
           required: false
+        - in: query
+          name: cursor
+          schema:
+            type: string
+          description: The X-Next-Cursor header of the previous page
+          required: false
+        - in: query
+          name: fields
+          schema:
+            type: string
+          description: Comma separated fields to return, * for all fields
+          required: false
         - in: query
           name: dod
           schema:
@@ -571,12 +768,8 @@ def get_users() -> Response:
         500:
             description: Internal API Error
     """
-    # the default page limits is 10
-    page_limit: int = 10
-    if "page_limit" in request.args:
-        page_limit = request.args.get("page_limit", default=10, type=int)
-
     user_docs: list = []
+    pages: list = []
     target: str = request.args.get("target", type=str)
     dod: str = request.args.get("dod", type=str)
 
@@ -592,19 +785,9 @@ def get_users() -> Response:
         )
     elif "target" in request.args:
         if target == "officer":
-            user_docs = (
-                db.collection("User")
-                .where("officer", "==", True)
-                .limit(page_limit)
-                .stream()
-            )
+            pages = [OFFICERS.page(request.args, officer=True)]
         elif target == "commander":
-            user_docs = (
-                db.collection("User")
-                .where("commander", "==", True)
-                .limit(page_limit)
-                .stream()
-            )
+            pages = [COMMANDERS.page(request.args, commander=True)]
         elif target == "level":
             token: str = request.headers["Authorization"]
             decoded_token: dict = auth.verify_id_token(token)
@@ -614,20 +797,15 @@ def get_users() -> Response:
             if user_ref.get().exists == False:
                 return NotFound("The user was not found")
             level: str = user_ref.get().to_dict().get("level")
-            user_docs = (
-                db.collection("User")
-                .where("level", ">", level)
-                .limit(page_limit)
-                .stream()
-            )
+            pages = [LOWER_LEVEL_USERS.page(request.args, level=level)]
     else:
-        user_docs = db.collection("User").limit(page_limit).stream()
+        pages = [ALL_USERS.page(request.args)]
 
     users: list = []
-    for user in user_docs:
+    for user in chain(user_docs, *(page.docs for page in pages)):
         users.append(user.to_dict())
 
-    return jsonify(users), 200
+    return paginated(users, *pages)
 
 
 @users.get("get_subordinates")
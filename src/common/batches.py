@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.batches
+    ~~~~~~~~~~~~~~~~~~
+    Write batches for the changes too large for a single Firestore batch,
+    which takes at most BATCH_SIZE writes.
+
+    A ChunkedBatch takes the writes like a batch and commits them every
+    BATCH_SIZE writes, so only the writes of a chunk are atomic together.
+    reserve() keeps the next writes in the same chunk, e.g. a document and
+    the counter it changes, and commit() commits the last chunk.
+    Classes:
+        ChunkedBatch
+"""
+from src.common.database import db
+
+# Firestore rejects batches of more than 500 writes
+BATCH_SIZE: int = 500
+
+
+class ChunkedBatch:
+    def __init__(self, size: int = BATCH_SIZE):
+        self.size: int = size
+        # the writes committed so far
+        self.committed: int = 0
+        self._batch = db.batch()
+        self._pending: int = 0
+
+    def reserve(self, writes: int) -> None:
+        """
+        Commit the chunk first unless the next writes fit in it.
+        """
+        if self._pending and self._pending + writes > self.size:
+            self.commit()
+
+    def set(self, reference, document_data: dict, merge: bool = False):
+        self._batch.set(reference, document_data, merge=merge)
+        self._added()
+
+    def update(self, reference, field_updates: dict, **kwargs):
+        self._batch.update(reference, field_updates, **kwargs)
+        self._added()
+
+    def delete(self, reference, **kwargs):
+        self._batch.delete(reference, **kwargs)
+        self._added()
+
+    def commit(self) -> None:
+        """
+        Commit the writes not committed yet.
+        """
+        if not self._pending:
+            return
+        self._batch.commit()
+        self.committed += self._pending
+        self._batch = db.batch()
+        self._pending = 0
+
+    def _added(self) -> None:
+        self._pending += 1
+        if self._pending >= self.size:
+            self.commit()
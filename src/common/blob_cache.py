@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.blob_cache
+    ~~~~~~~~~~~~~~~~~~~~~
+    Bounded on-disk cache for Firebase Storage blobs, shared by all the
+    worker processes of a host.
+
+    Entries are keyed by the object path and its generation, so an overwritten
+    object is never served stale. Reads go through memory-mapped files and the
+    file modification time doubles as the LRU clock: a hit touches the entry
+    and eviction removes the least recently used entries until the cache fits
+    into its size budget. Entries are published with an atomic rename and
+    evictions are serialized with a file lock, so concurrent workers can
+    share one directory, and the temporary files of the workers that died
+    while writing one are swept when a cache is opened.
+
+    The hit and miss counters are kept by each process, a read never waits
+    for the other workers just to be counted, and written to a stats file of
+    the process at most every STATS_FLUSH_SECONDS. The stats sum the files
+    of the live workers and list them by pid.
+    Classes:
+        BlobCache
+"""
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CACHE_DIR: str = os.getenv(
+    "BLOB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mercury-blob-cache")
+)
+CACHE_MAX_BYTES: int = int(
+    os.getenv("BLOB_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+
+_LOCK_FILE: str = ".lock"
+_TMP_PREFIX: str = ".tmp-"
+# a temporary file this old was left by a worker that died writing it
+_TMP_MAX_AGE: int = 60 * 60
+_STATS_PREFIX: str = ".stats-"
+STATS_FLUSH_SECONDS: float = float(os.getenv("BLOB_CACHE_STATS_FLUSH", 1))
+
+
+class BlobCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self._stats_lock: Lock = Lock()
+        self._flushed_at: float = 0.0
+
+        self._sweep()
+
+    def read(self, blob, start: int = None, end: int = None) -> bytes:
+        """
+        Return the content of the blob, or the [start, end] byte range of it
+        when given (end inclusive, like Storage ranged reads). The blob must
+        have been loaded with its metadata, e.g. through bucket.get_blob().
+        A range that is not cached is read from Storage by itself and is not
+        cached, only the reads of whole blobs fill the cache.
+        """
+        content: bytes = self.get(blob, start, end)
+        if content is not None:
+            return content
+
+        if start is not None or end is not None:
+            return blob.download_as_bytes(start=start, end=end)
+
+        content = blob.download_as_bytes()
+        self._store(self._entry_path(blob.name, blob.generation), content)
+
+        return content
+
+    def get(self, blob, start: int = None, end: int = None) -> bytes:
+        """
+        Like read(), but return None instead of downloading the blob when it
+        is not cached.
+        """
+        path: str = self._entry_path(blob.name, blob.generation)
+        content: bytes = self._read_mapped(path, start, end)
+        self._count(hit=content is not None)
+
+        return content
+
+    def stats(self) -> dict:
+        """
+        Return the hit ratio of the live workers sharing the cache, in total
+        and by pid, and the current size of the cache. The counts of the
+        other workers are up to STATS_FLUSH_SECONDS old.
+        """
+        self._flush_stats()
+        workers: dict = self._worker_stats()
+        hits: int = sum(worker["hits"] for worker in workers.values())
+        misses: int = sum(worker["misses"] for worker in workers.values())
+        entries: list = self._entries()
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+            "workers": workers,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+    def _entry_path(self, name: str, generation) -> str:
+        key: str = hashlib.sha256(
+            f"{name}#{generation}".encode("utf-8")
+        ).hexdigest()
+        return os.path.join(self.directory, key)
+
+    def _read_mapped(self, path: str, start: int, end: int) -> bytes:
+        try:
+            entry = open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+        with entry:
+            # mmap cannot map an empty file
+            if os.fstat(entry.fileno()).st_size == 0:
+                content: bytes = b""
+            else:
+                with mmap.mmap(
+                    entry.fileno(), 0, access=mmap.ACCESS_READ
+                ) as mapped:
+                    content = mapped[start : None if end is None else end + 1]
+
+        # refresh the entry in the LRU order, it may have just been evicted
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            pass
+
+        return content
+
+    def _store(self, path: str, content: bytes) -> None:
+        if len(content) > self.max_bytes:
+            return
+
+        # write to a private file first so other workers never see a
+        # partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=_TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(content)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._locked():
+            entries: list = self._entries()
+            total: int = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return
+
+            # least recently used first
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def _entries(self) -> list:
+        entries: list = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return entries
+
+    def _sweep(self) -> None:
+        # the files still being written by live workers are younger
+        expired: float = time.time() - _TMP_MAX_AGE
+        with self._locked(), os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.startswith(_TMP_PREFIX):
+                    continue
+                try:
+                    if entry.stat().st_mtime < expired:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def _count(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            due: bool = (
+                time.monotonic() - self._flushed_at >= STATS_FLUSH_SECONDS
+            )
+        if due:
+            self._flush_stats()
+
+    def _flush_stats(self) -> None:
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+            self._flushed_at = time.monotonic()
+
+        # replaced atomically so a reader never sees a partial file
+        path: str = os.path.join(
+            self.directory, _STATS_PREFIX + str(os.getpid())
+        )
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=_TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "w") as tmp_file:
+                tmp_file.write(f"{hits} {misses}")
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _worker_stats(self) -> dict:
+        workers: dict = dict()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.startswith(_STATS_PREFIX):
+                    continue
+                pid: int = int(entry.name[len(_STATS_PREFIX) :])
+                if not _alive(pid):
+                    # the counts of an exited worker, its pid may be reused
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                try:
+                    with open(entry.path) as stats_file:
+                        hits, misses = map(int, stats_file.read().split())
+                except (FileNotFoundError, ValueError):
+                    continue
+                workers[str(pid)] = {"hits": hits, "misses": misses}
+
+        return workers
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+
+        with open(os.path.join(self.directory, _LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists but belongs to another user
+        return True
+    return True
+
+
+blob_cache: BlobCache = BlobCache(CACHE_DIR, CACHE_MAX_BYTES)
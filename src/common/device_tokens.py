@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.device_tokens
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+    The FCM registration tokens of the devices of each user.
+
+    Every device a user signs in from has a document in the user's devices
+    subcollection, keyed by a hash of its token and refreshed with the time
+    it was last seen each time the app registers it. A token names one app
+    install, so it only belongs to the user who registered it last. The
+    pushes look the tokens up through a small in-process cache of
+    uid -> tokens, loading the users it misses concurrently, and the tokens
+    FCM reports dead are pruned from the subcollections and the cache.
+
+    A change of the devices only clears the cache of the process making it,
+    the other processes keep their entries until they expire, so the
+    entries only live DEVICE_TOKEN_CACHE_SECONDS.
+    Classes:
+        TokenCache
+    Functions:
+        register()
+        unregister()
+        unregister_all()
+        tokens_for()
+        prune()
+"""
+from collections import OrderedDict
+from firebase_admin import firestore
+from threading import Lock
+import hashlib
+import os
+import time
+
+from src.common.batches import ChunkedBatch
+from src.common.database import db
+from src.common.io_pool import io_pool
+
+DEVICES: str = "devices"
+DEVICE_TOKEN_CACHE_SECONDS: int = int(
+    os.getenv("DEVICE_TOKEN_CACHE_SECONDS", 60)
+)
+DEVICE_TOKEN_CACHE_SIZE: int = int(os.getenv("DEVICE_TOKEN_CACHE_SIZE", 10000))
+
+# Firestore in queries take up to 30 values
+IN_LIMIT: int = 30
+
+
+class TokenCache:
+    def __init__(self, max_users: int, ttl: float):
+        self.max_users: int = max_users
+        self.ttl: float = ttl
+        self._lock: Lock = Lock()
+        # uid -> (expiry, tokens), least recently used first
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, uid: str) -> tuple:
+        """
+        The cached tokens of the user, None when they are not cached.
+        """
+        with self._lock:
+            entry: tuple = self._entries.get(uid)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(uid)
+            return entry[1]
+
+    def put(self, uid: str, tokens: tuple) -> None:
+        with self._lock:
+            self._entries[uid] = (time.monotonic() + self.ttl, tokens)
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def discard(self, uid: str) -> None:
+        with self._lock:
+            self._entries.pop(uid, None)
+
+
+_cache: TokenCache = TokenCache(
+    DEVICE_TOKEN_CACHE_SIZE, DEVICE_TOKEN_CACHE_SECONDS
+)
+
+
+def _device_ref(uid: str, token: str):
+    key: str = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    return (
+        db.collection("User").document(uid).collection(DEVICES).document(key)
+    )
+
+
+def register(uid: str, token: str, batch=None) -> None:
+    """
+    Add the token to the devices of the user, or refresh when it was last
+    seen, and remove it from the devices of the users who signed in on the
+    same device before. When a batch is given the writes are only added
+    to it.
+    """
+    entry: dict = {
+        "uid": uid,
+        "token": token,
+        "last_seen": firestore.SERVER_TIMESTAMP,
+    }
+    if batch is None:
+        _device_ref(uid, token).set(entry, merge=True)
+    else:
+        batch.set(_device_ref(uid, token), entry, merge=True)
+    _cache.discard(uid)
+
+    # the pushes of the previous users must not reach the new one
+    docs = db.collection_group(DEVICES).where("token", "==", token).stream()
+    for doc in docs:
+        owner: str = doc.get("uid")
+        if owner == uid:
+            continue
+        if batch is None:
+            doc.reference.delete()
+        else:
+            batch.delete(doc.reference)
+        # only this process forgets them right away, see the module docs
+        _cache.discard(owner)
+
+
+def unregister(uid: str, token: str) -> None:
+    """
+    Remove the token from the devices of the user, e.g. on sign out.
+    """
+    _device_ref(uid, token).delete()
+    _cache.discard(uid)
+
+
+def unregister_all(uid: str) -> None:
+    """
+    Remove every device of the user, e.g. when the user is deleted.
+    """
+    batch: ChunkedBatch = ChunkedBatch()
+    for doc in (
+        db.collection("User").document(uid).collection(DEVICES).stream()
+    ):
+        batch.delete(doc.reference)
+    batch.commit()
+    _cache.discard(uid)
+
+
+def _load(uid: str) -> tuple:
+    docs = db.collection("User").document(uid).collection(DEVICES).stream()
+    tokens: tuple = tuple(doc.to_dict().get("token") for doc in docs)
+    _cache.put(uid, tokens)
+    return tokens
+
+
+def tokens_for(uids: list) -> list:
+    """
+    The tokens of the devices of the users, without repeats.
+    """
+    uids = list(dict.fromkeys(uid for uid in uids if uid))
+    tokens: dict = dict()
+    missing: list = list()
+    for uid in uids:
+        cached: tuple = _cache.get(uid)
+        if cached is None:
+            missing.append(uid)
+        else:
+            tokens.update(dict.fromkeys(cached))
+
+    for loaded in io_pool.map(_load, missing):
+        tokens.update(dict.fromkeys(loaded))
+
+    return [token for token in tokens if token]
+
+
+def prune(tokens: list) -> int:
+    """
+    Remove the devices of the dead tokens from every user. Returns the
+    number of devices removed.
+    """
+    tokens = list(dict.fromkeys(tokens))
+    batch: ChunkedBatch = ChunkedBatch()
+    pruned: int = 0
+    for i in range(0, len(tokens), IN_LIMIT):
+        docs = (
+            db.collection_group(DEVICES)
+            .where("token", "in", tokens[i : i + IN_LIMIT])
+            .stream()
+        )
+        for doc in docs:
+            batch.delete(doc.reference)
+            _cache.discard(doc.get("uid"))
+            pruned += 1
+
+    batch.commit()
+
+    return pruned
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.file_counters
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+    Counters of the Files documents by filetype and status, kept per user
+    so the badges and dashboards read one document instead of querying the
+    collection.
+
+    Each role a user can have on a file (its author, its reviewer, its
+    recommender) has its own section of a counter document,
+    {role: {filetype: {status: n}}}. The author section lives in the
+    File-Counts document of the user's uid, the reviewer and recommender
+    sections in the Inboxes document of the user's dod. stage_counts()
+    adds the increments of a file moving from one state to another to the
+    batch writing that change, and reconcile(), an outbox task, streams the
+    collection to find any drift and repairs each drifted document in a
+    transaction.
+    Functions:
+        stage_counts()
+        get_counts()
+        reconcile()
+"""
+from firebase_admin import firestore
+
+from src.common import outbox
+from src.common.database import db
+
+FILE_COUNTS: str = "File-Counts"
+INBOXES: str = "Inboxes"
+
+# the counter collection of each role, which is also the file field naming
+# the user
+ROLES: dict = {
+    "author": FILE_COUNTS,
+    "reviewer": INBOXES,
+    "recommender": INBOXES,
+}
+
+
+def _counter(file: dict, role: str) -> tuple:
+    # (user, filetype, status) the file counts for in the role, if any
+    if not file or not file.get(role):
+        return None
+    return (
+        str(file.get(role)),
+        str(file.get("filetype")),
+        str(file.get("status")),
+    )
+
+
+def stage_counts(batch, before: dict, after: dict) -> None:
+    """
+    Add to the batch the counter updates of a file going from the before
+    to the after state. before is None for a new file and after is None
+    for a deleted one.
+    """
+    for role, collection in ROLES.items():
+        old: tuple = _counter(before, role)
+        new: tuple = _counter(after, role)
+        if old == new:
+            continue
+        for counter, step in ((old, -1), (new, 1)):
+            if counter is None:
+                continue
+            user, filetype, status = counter
+            batch.set(
+                db.collection(collection).document(user),
+                {role: {filetype: {status: firestore.Increment(step)}}},
+                merge=True,
+            )
+
+
+def get_counts(counters: dict, role: str) -> dict:
+    """
+    The counts of a role in a counter document, by status and by filetype
+    and status.
+    """
+    by_filetype: dict = dict()
+    by_status: dict = dict()
+    for filetype, statuses in (counters.get(role) or {}).items():
+        by_filetype[filetype] = {
+            status: count for status, count in statuses.items() if count
+        }
+        for status, count in statuses.items():
+            if count:
+                by_status[status] = by_status.get(status, 0) + count
+
+    return {"status": by_status, "filetype": by_filetype}
+
+
+@outbox.task
+def reconcile() -> int:
+    """
+    Recount every Files document and repair the counter documents that
+    drifted. Returns the number of documents repaired.
+    """
+    expected: dict = {collection: dict() for collection in ROLES.values()}
+    # the values naming each user in the files, to query them again
+    values: dict = {collection: dict() for collection in ROLES.values()}
+    for doc in db.collection("Files").stream():
+        file: dict = doc.to_dict()
+        for role, collection in ROLES.items():
+            counter: tuple = _counter(file, role)
+            if counter is None:
+                continue
+            user, filetype, status = counter
+            _add(expected[collection], user, role, filetype, status)
+            values[collection].setdefault(user, dict())[file.get(role)] = None
+
+    repaired: int = 0
+    for collection, users in expected.items():
+        roles: list = _roles(collection)
+        stored: dict = {
+            doc.id: doc.to_dict() for doc in db.collection(collection).stream()
+        }
+        for user in set(users) | set(stored):
+            counts: dict = {
+                role: users.get(user, {}).get(role, {}) for role in roles
+            }
+            if counts == _current(stored.get(user), roles):
+                continue
+            # the scan only finds the drifted documents, each is recounted
+            # in a transaction since files kept changing while it ran
+            user_values: list = list(
+                values[collection].get(user, {user: None})
+            )
+            if _repair(db.transaction(), collection, user, user_values):
+                repaired += 1
+
+    return repaired
+
+
+@firestore.transactional
+def _repair(transaction, collection: str, user: str, values: list) -> bool:
+    """
+    Recount the files of the user for the roles of the counter collection
+    and overwrite the counter document if it drifted. The document and the
+    files are read in the transaction, so the increments committed since
+    the scan are neither lost nor counted twice.
+    """
+    roles: list = _roles(collection)
+    counter_ref = db.collection(collection).document(user)
+    stored: dict = None
+    for snapshot in transaction.get(counter_ref):
+        if snapshot.exists:
+            stored = snapshot.to_dict()
+
+    counts: dict = dict()
+    for role in roles:
+        files = db.collection("Files").where(role, "in", values)
+        for doc in transaction.get(files):
+            counter: tuple = _counter(doc.to_dict(), role)
+            if counter is None or counter[0] != user:
+                continue
+            _, filetype, status = counter
+            _add(counts, user, role, filetype, status)
+    counts = {role: counts.get(user, {}).get(role, {}) for role in roles}
+
+    current: dict = _current(stored, roles)
+    if counts == current:
+        return False
+
+    # merging leaves the other fields of the document untouched, so the
+    # counters that should be gone are zeroed
+    for role in roles:
+        for filetype, statuses in current[role].items():
+            for status in statuses:
+                counts[role].setdefault(filetype, dict()).setdefault(status, 0)
+    transaction.set(counter_ref, counts, merge=True)
+    return True
+
+
+def _roles(collection: str) -> list:
+    return [role for role, other in ROLES.items() if other == collection]
+
+
+def _add(
+    counts: dict, user: str, role: str, filetype: str, status: str
+) -> None:
+    statuses: dict = (
+        counts.setdefault(user, dict())
+        .setdefault(role, dict())
+        .setdefault(filetype, dict())
+    )
+    statuses[status] = statuses.get(status, 0) + 1
+
+
+def _current(counters: dict, roles: list) -> dict:
+    return {role: _nonzero((counters or {}).get(role) or {}) for role in roles}
+
+
+def _nonzero(counts: dict) -> dict:
+    nonzero: dict = dict()
+    for filetype, statuses in counts.items():
+        statuses = {
+            status: count for status, count in statuses.items() if count
+        }
+        if statuses:
+            nonzero[filetype] = statuses
+
+    return nonzero
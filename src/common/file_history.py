@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.file_history
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    The append-only history of a file. Every transition of a Files document
+    adds an entry to its history subcollection in the same write as the
+    update of the document itself, which only keeps the latest state.
+    Deleting a file deletes its history with it.
+    Functions:
+        add_history()
+        delete_history()
+"""
+from firebase_admin import firestore
+from uuid import uuid4
+
+UPLOAD: str = "upload"
+UPDATE: str = "update"
+RECOMMEND: str = "recommend"
+REVIEW: str = "review"
+# an entry migrated from the legacy timestamp arrays whose action is unknown
+LEGACY: str = "legacy"
+
+
+def add_history(
+    batch,
+    file_ref,
+    action: str,
+    actor: str,
+    actor_name: str = None,
+    status: int = None,
+    comment: str = None,
+    timestamp=firestore.SERVER_TIMESTAMP,
+) -> None:
+    """
+    Add a history entry for the file to the batch (or transaction).
+    """
+    entry: dict = dict()
+    entry["id"] = str(uuid4())
+    entry["action"] = action
+    entry["actor"] = actor
+    entry["actor_name"] = actor_name
+    entry["status"] = status
+    entry["comment"] = comment
+    entry["timestamp"] = timestamp
+
+    batch.set(file_ref.collection("history").document(entry["id"]), entry)
+
+
+def delete_history(batch, file_ref) -> None:
+    """
+    Add the deletes of every history entry of the file to the batch, a
+    ChunkedBatch since a file may have more entries than a batch takes.
+    """
+    # the references are listed without reading the entries
+    for entry_ref in file_ref.collection("history").list_documents():
+        batch.delete(entry_ref)
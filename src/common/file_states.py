@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.file_states
+    ~~~~~~~~~~~~~~~~~~~~~~
+    The status state machine of the Files documents.
+
+    check_transition() tells whether an action may move a file from its
+    current status to the requested one, and apply_transition() writes the
+    new state together with its history entry in a single commit. The
+    commit is conditioned on the update time of the snapshot the caller
+    checked, so a concurrent change makes it fail instead of being
+    overwritten. stage_transition() adds the same writes to a batch the
+    caller commits with others. The file counters are updated in the same
+    commit.
+    Functions:
+        check_transition()
+        stage_transition()
+        apply_transition()
+        commit()
+"""
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition, NotFound
+from werkzeug.exceptions import BadRequest, Conflict, HTTPException
+
+from src.common import file_counters, file_history
+from src.common.database import db
+
+SUBMITTED: int = 1
+PENDING: int = 2
+RESUBMIT: int = 3
+APPROVED: int = 4
+REJECTED: int = 5
+
+# the statuses each action may start from
+ALLOWED_FROM: dict = {
+    file_history.UPDATE: {SUBMITTED, PENDING, RESUBMIT},
+    file_history.RECOMMEND: {SUBMITTED, RESUBMIT},
+    file_history.REVIEW: {SUBMITTED, PENDING, RESUBMIT},
+}
+
+# the statuses each action may lead to, None keeps the current one
+ALLOWED_TO: dict = {
+    file_history.UPDATE: {None},
+    file_history.RECOMMEND: {PENDING},
+    file_history.REVIEW: {RESUBMIT, APPROVED, REJECTED},
+}
+
+
+def check_transition(action: str, current: int, status: int = None):
+    """
+    Return a BadRequest when the action may not move a file from the
+    current status to the given one, None otherwise.
+    """
+    if current not in ALLOWED_FROM[action]:
+        return BadRequest(
+            "Files is not allow to %s in status %s" % (action, current)
+        )
+    if status not in ALLOWED_TO[action]:
+        return BadRequest("Unsupported status %s to %s" % (status, action))
+
+    return None
+
+
+def stage_transition(
+    batch,
+    file_snapshot,
+    action: str,
+    actor: str,
+    actor_name: str = None,
+    status: int = None,
+    comment: str = None,
+    changes: dict = None,
+):
+    """
+    Check the transition and add its writes to the batch. The other fields
+    to update go in changes. Returns a BadRequest when the transition is
+    not allowed, None otherwise.
+    """
+    file: dict = file_snapshot.to_dict()
+    error: HTTPException = check_transition(action, file.get("status"), status)
+    if error:
+        return error
+
+    update: dict = dict(changes or {})
+    update["updated_at"] = firestore.SERVER_TIMESTAMP
+    if status is not None:
+        update["status"] = status
+    if comment is not None:
+        update["comment"] = comment
+
+    batch.update(
+        file_snapshot.reference,
+        update,
+        option=db.write_option(last_update_time=file_snapshot.update_time),
+    )
+    file_counters.stage_counts(batch, file, {**file, **update})
+    file_history.add_history(
+        batch,
+        file_snapshot.reference,
+        action,
+        actor=actor,
+        actor_name=actor_name,
+        status=file.get("status") if status is None else status,
+        comment=comment,
+    )
+
+    return None
+
+
+def apply_transition(file_snapshot, action: str, actor: str, **kwargs):
+    """
+    Check the transition and write it with its history entry. Takes the
+    keyword arguments of stage_transition(). Returns an HTTPException when
+    the transition is not allowed or the file changed since the snapshot
+    was read, None otherwise.
+    """
+    batch = db.batch()
+    error: HTTPException = stage_transition(
+        batch, file_snapshot, action, actor, **kwargs
+    )
+    if error:
+        return error
+
+    return commit(batch)
+
+
+def commit(batch):
+    """
+    Commit a batch of staged transitions. Returns a Conflict when one of
+    the files changed since its snapshot was read, None otherwise.
+    """
+    try:
+        batch.commit()
+    except (FailedPrecondition, NotFound):
+        return Conflict("The file was changed, reload it and try again")
+
+    return None
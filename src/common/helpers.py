@@ -4,10 +4,15 @@
     ~~~~~~~~~~~~~~~~~~
     Functions:
         send_invite_email()
+        find_subordinates_by_dod()
+        make_etag()
+        not_modified()
 """
 from smtplib import SMTP
+from flask import Response, request
 from werkzeug.exceptions import NotFound
 from firebase_admin import storage
+import hashlib
 import json
 
 
@@ -61,3 +66,29 @@ def find_subordinates_by_dod_recur(org: list, dod: str) -> list:
             return find_subordinates_by_dod_recur(people.get("sub"), dod)
         else:
             continue
+
+
+def make_etag(*versions) -> str:
+    """
+    Build a strong ETag from the versions of every resource a response is
+    assembled from, e.g. Firestore update times and Storage blob generations.
+    """
+    digest = hashlib.sha1()
+    for version in versions:
+        digest.update(str(version).encode("utf-8"))
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
+def not_modified(etag: str) -> Response:
+    """
+    Return a 304 response when the client already holds the given ETag,
+    otherwise None.
+    """
+    if not request.if_none_match.contains(etag):
+        return None
+
+    response: Response = Response(status=304)
+    response.set_etag(etag)
+    return response
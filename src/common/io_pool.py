@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.io_pool
+    ~~~~~~~~~~~~~~~~~~
+    Thread pool shared by the handlers that fan out blocking Firestore and
+    Storage calls. The calls release the GIL while waiting on the network, so
+    independent round trips overlap instead of adding up.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+IO_POOL_WORKERS: int = int(os.getenv("IO_POOL_WORKERS", 32))
+
+io_pool: ThreadPoolExecutor = ThreadPoolExecutor(
+    max_workers=IO_POOL_WORKERS, thread_name_prefix="io"
+)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.leader
+    ~~~~~~~~~~~~~~~~~
+    Lease based leader election, so the work that must not run twice, like
+    firing the scheduled notifications, is done by a single process among
+    all the workers and instances.
+
+    A lease is a document of the Leases collection naming its holder, its
+    fencing token and when it expires. A process takes it in a transaction
+    when it is free or expired, which increments the token, and renews it
+    every third of LEADER_LEASE_SECONDS, so the lease of a dead leader is
+    taken over within LEADER_LEASE_SECONDS. The leader reads the lease in
+    the transaction of each of its writes and only writes if it still holds
+    it with the same token, so a process that lost the lease without
+    noticing, being paused or cut off, can no longer write.
+    Classes:
+        Lease
+"""
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+from uuid import uuid4
+import logging
+import os
+import time
+
+from src.common.database import db
+
+LEASES: str = "Leases"
+LEADER_LEASE_SECONDS: int = int(os.getenv("LEADER_LEASE_SECONDS", 10))
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _read(transaction, document_ref) -> dict:
+    for snapshot in transaction.get(document_ref):
+        if snapshot.exists:
+            return snapshot.to_dict() or {}
+    return {}
+
+
+@firestore.transactional
+def _acquire(transaction, lease_ref, holder: str, ttl: timedelta) -> int:
+    lease: dict = _read(transaction, lease_ref)
+    now: datetime = _now()
+    token: int = lease.get("token", 0)
+    if lease.get("holder") != holder:
+        if lease.get("expires_at") and lease["expires_at"] > now:
+            return None
+        token += 1
+
+    transaction.set(
+        lease_ref, {"holder": holder, "token": token, "expires_at": now + ttl}
+    )
+    return token
+
+
+class Lease:
+    def __init__(
+        self,
+        name: str,
+        ttl: timedelta = timedelta(seconds=LEADER_LEASE_SECONDS),
+    ):
+        self.name: str = name
+        self.ttl: timedelta = ttl
+        self.holder: str = str(uuid4())
+        # the fencing token of the lease while this process holds it
+        self.token: int = None
+        self._ref = db.collection(LEASES).document(name)
+        self._held_until: float = 0
+
+    @property
+    def held(self) -> bool:
+        """
+        Whether this process held the lease at its last renewal, which has
+        not expired since.
+        """
+        return self.token is not None and time.monotonic() < self._held_until
+
+    def acquire(self) -> bool:
+        """
+        Take the lease, or renew it when this process already holds it.
+        Returns whether this process holds it.
+        """
+        started: float = time.monotonic()
+        try:
+            token: int = _acquire(
+                db.transaction(), self._ref, self.holder, self.ttl
+            )
+        except Exception:
+            logger.exception("Acquiring the %s lease failed", self.name)
+            token = None
+
+        if token is None:
+            if self.token is not None:
+                logger.info("Lost the %s lease", self.name)
+            self.token = None
+            return False
+
+        if token != self.token:
+            logger.info("Leading %s with token %d", self.name, token)
+        self.token = token
+        # the lease was written after this started, so it lasts at least ttl
+        self._held_until = started + self.ttl.total_seconds()
+        return True
+
+    def check(self, transaction) -> bool:
+        """
+        Read the lease in the transaction, before its other reads, and tell
+        whether this process still holds it with its token. The writes of
+        the transaction then only commit if that is still true.
+        """
+        lease: dict = _read(transaction, self._ref)
+        return (
+            self.token is not None
+            and lease.get("holder") == self.holder
+            and lease.get("token") == self.token
+        )
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.migrations
+    ~~~~~~~~~~~~~~~~~~~~~
+    One-off data migrations, run from the cli.
+    Functions:
+        backfill_file_timestamps()
+        move_file_timestamps_to_history()
+        move_fcm_tokens_to_devices()
+"""
+from firebase_admin import firestore, storage
+
+from src.common import device_tokens, file_history
+from src.common.batches import ChunkedBatch
+from src.common.database import db
+
+
+def backfill_file_timestamps() -> int:
+    """
+    Set the scalar created_at and updated_at fields of the Files documents
+    written before they existed, from the first and last entries of their
+    timestamp arrays. Returns the number of documents updated.
+    """
+    batch: ChunkedBatch = ChunkedBatch()
+    updated: int = 0
+
+    for doc in db.collection("Files").stream():
+        file: dict = doc.to_dict()
+        if "created_at" in file:
+            continue
+
+        created_at, updated_at = _file_times(
+            doc.id, file.get("timestamp") or []
+        )
+        batch.update(
+            doc.reference, {"created_at": created_at, "updated_at": updated_at}
+        )
+        updated += 1
+
+    batch.commit()
+
+    return updated
+
+
+def _file_times(file_id: str, timestamps: list) -> tuple:
+    """
+    The created_at and updated_at of a file, from its timestamp array or
+    else from its blob. A file without either gets the time of the
+    migration, since the lists ordered by created_at leave out the
+    documents without it.
+    """
+    if timestamps:
+        return min(timestamps), max(timestamps)
+
+    blob = storage.bucket().get_blob("file/" + file_id)
+    if blob is not None and blob.time_created:
+        return blob.time_created, blob.updated or blob.time_created
+
+    return firestore.SERVER_TIMESTAMP, firestore.SERVER_TIMESTAMP
+
+
+# the labels the timestamp_string arrays used for each transition
+_HISTORY_ACTIONS: dict = {
+    "File Upload": file_history.UPLOAD,
+    "File Update": file_history.UPDATE,
+    "File Recommended": file_history.RECOMMEND,
+    "File Reviewed": file_history.REVIEW,
+}
+
+
+def move_file_timestamps_to_history() -> int:
+    """
+    Move the timestamp and timestamp_string arrays of the Files documents
+    into their history subcollections and drop them from the documents,
+    setting created_at and updated_at when they are missing. The entries of
+    arrays of different lengths get the legacy action. Returns the number
+    of documents migrated.
+    """
+    batch: ChunkedBatch = ChunkedBatch()
+    migrated: int = 0
+
+    for doc in db.collection("Files").stream():
+        file: dict = doc.to_dict()
+        if "timestamp" not in file:
+            continue
+        timestamps: list = file.get("timestamp") or []
+        labels: list = file.get("timestamp_string") or []
+
+        # keep the writes of a document in the same batch
+        batch.reserve(len(timestamps) + 1)
+
+        # the arrays drifted apart when ArrayUnion dropped repeated labels,
+        # which labels were dropped is unknown so none of them is paired
+        if len(labels) != len(timestamps):
+            labels = [None] * len(timestamps)
+        for timestamp, label in zip(timestamps, labels):
+            file_history.add_history(
+                batch,
+                doc.reference,
+                _HISTORY_ACTIONS.get(label, file_history.LEGACY),
+                actor=None,
+                timestamp=timestamp,
+            )
+
+        changes: dict = {
+            "timestamp": firestore.DELETE_FIELD,
+            "timestamp_string": firestore.DELETE_FIELD,
+        }
+        if "created_at" not in file:
+            created_at, updated_at = _file_times(doc.id, timestamps)
+            changes["created_at"] = created_at
+            changes["updated_at"] = updated_at
+        batch.update(doc.reference, changes)
+        migrated += 1
+
+    batch.commit()
+
+    return migrated
+
+
+def move_fcm_tokens_to_devices() -> int:
+    """
+    Register the FCMToken field of the User documents as a device of the
+    user and drop it from the documents. Returns the number of users
+    migrated.
+    """
+    batch: ChunkedBatch = ChunkedBatch()
+    migrated: int = 0
+
+    for doc in db.collection("User").stream():
+        user: dict = doc.to_dict()
+        if "FCMToken" not in user:
+            continue
+
+        batch.reserve(2)
+        if user.get("FCMToken"):
+            device_tokens.register(doc.id, user.get("FCMToken"), batch=batch)
+        batch.update(doc.reference, {"FCMToken": firestore.DELETE_FIELD})
+        migrated += 1
+
+    batch.commit()
+
+    return migrated
@@ -1,52 +1,255 @@
-from logging.config import dictConfig
-from threading import Timer
+# -*- coding: utf-8 -*
+"""
+    src.common.notifications
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+    Push notifications to the mobile devices, now or at a later time.
+
+    push() drops the empty and repeated tokens, sends the rest in multicasts
+    of up to FCM_MULTICAST_LIMIT tokens at once on the io pool, and retries
+    the tokens FCM reports UNAVAILABLE with jittered exponential backoff.
+    It returns the outcome of every token and prunes the tokens FCM reports
+    dead from the device registry.
+
+    A notification sent from an outbox task is recorded in the
+    Sent-Notifications collection under an idempotency key of the task's
+    entry and its receivers, the uids when the tokens are looked up, so the
+    retries of that task do not push it again. The records expire through
+    a TTL policy on their expires_at field. The scheduled notifications
+    name their receivers by uid, whose tokens are looked up when they are
+    sent.
+    Functions:
+        push()
+        send_notification()
+        send_to_topic()
+        send_to_users()
+        add_scheduled_notification()
+        add_medical_notifications()
+        cancel_scheduled_notification()
+"""
+from datetime import datetime, timedelta, timezone
 from dateutil import parser
-import datetime as dt
-from datetime import datetime
-from uuid import uuid4
-from firebase_admin import messaging
+from firebase_admin import exceptions, messaging
+from google.api_core.exceptions import AlreadyExists
+from itertools import repeat
+import logging
+import os
+import random
+import time
+import typing as t
+
+from src.common import device_tokens, outbox
+from src.common.database import db
+from src.common.io_pool import io_pool
+from src.common.scheduler import scheduler
+
+# days after an exam date its reminders are pushed
+MEDICAL_REMINDER_DAYS: list = [270, 180, 1]
+
+SENT: str = "Sent-Notifications"
+SENT_TTL: timedelta = timedelta(
+    days=int(os.getenv("SENT_NOTIFICATIONS_TTL_DAYS", 7))
+)
+
+# FCM rejects multicasts to more tokens
+FCM_MULTICAST_LIMIT: int = 500
+FCM_RETRIES: int = int(os.getenv("FCM_RETRIES", 3))
+FCM_BACKOFF_SECONDS: float = float(os.getenv("FCM_BACKOFF_SECONDS", 0.5))
+
+# the token outcome of FCM's UnregisteredError, whose code is NOT_FOUND
+UNREGISTERED: str = "UNREGISTERED"
+# the outcomes of the tokens removed from the device registry
+DEAD_TOKEN_ERRORS: set = {UNREGISTERED, exceptions.INVALID_ARGUMENT}
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def _error_code(error: Exception) -> str:
+    if isinstance(error, messaging.UnregisteredError):
+        return UNREGISTERED
+    return getattr(error, "code", None) or exceptions.UNKNOWN
+
+
+def _send_multicast(message):
+    # send_each_for_multicast replaces send_multicast from firebase-admin 6.2
+    send: t.Callable = getattr(messaging, "send_each_for_multicast", None)
+    return (send or messaging.send_multicast)(message)
+
+
+def _send_chunk(tokens: list, data: dict) -> dict:
+    results: dict = dict()
+    pending: list = tokens
+    for attempt in range(FCM_RETRIES + 1):
+        last: bool = attempt == FCM_RETRIES
+        message = messaging.MulticastMessage(data=data, tokens=pending)
+        try:
+            responses: list = _send_multicast(message).responses
+            errors: list = [
+                None if response.success else response.exception
+                for response in responses
+            ]
+        except exceptions.UnavailableError as error:
+            errors = [error] * len(pending)
+
+        retry: list = list()
+        for token, error in zip(pending, errors):
+            code: str = None if error is None else _error_code(error)
+            if code == exceptions.UNAVAILABLE and not last:
+                retry.append(token)
+            else:
+                results[token] = code
+        if not retry:
+            break
+
+        # full jitter, so the retries of the chunks do not line up
+        time.sleep(random.uniform(0, FCM_BACKOFF_SECONDS * 2**attempt))
+        pending = retry
+
+    return results
+
+
+def push(tokens: list, data: dict) -> dict:
+    """
+    Push the data message to the tokens. Returns the outcome of each token,
+    None when it was delivered, the FCM error code otherwise.
+    """
+    tokens = list(dict.fromkeys(token for token in tokens if token))
+    chunks: list = [
+        tokens[i : i + FCM_MULTICAST_LIMIT]
+        for i in range(0, len(tokens), FCM_MULTICAST_LIMIT)
+    ]
 
-timers = dict()
+    results: dict = dict()
+    for chunk_results in io_pool.map(_send_chunk, chunks, repeat(data)):
+        results.update(chunk_results)
 
+    failed: int = sum(1 for code in results.values() if code)
+    if failed:
+        logger.warning("%d of %d pushes failed", failed, len(results))
 
+    dead: list = [
+        token for token, code in results.items() if code in DEAD_TOKEN_ERRORS
+    ]
+    # a message every token rejects as invalid is itself at fault
+    if dead and not all(
+        code == exceptions.INVALID_ARGUMENT for code in results.values()
+    ):
+        device_tokens.prune(dead)
+
+    return results
+
+
+def _mark_sent(key: str) -> bool:
+    # record the push of the key, False when it was already pushed
+    if key is None:
+        return True
+    now: datetime = datetime.now(timezone.utc)
+    try:
+        db.collection(SENT).document(key).create(
+            {"sent_at": now, "expires_at": now + SENT_TTL}
+        )
+    except AlreadyExists:
+        return False
+    return True
+
+
+def _unmark_sent(key: str) -> None:
+    if key is not None:
+        db.collection(SENT).document(key).delete()
+
+
+def _push_once(key: str, tokens: list, data: dict):
+    if not _mark_sent(key):
+        # pushed by an earlier attempt of the same task
+        return None
+
+    try:
+        results: dict = push(tokens, data)
+        # nobody got it, so retrying the task cannot push it twice
+        if results and all(
+            code == exceptions.UNAVAILABLE for code in results.values()
+        ):
+            raise exceptions.UnavailableError("FCM is unavailable")
+    except Exception:
+        _unmark_sent(key)
+        raise
+
+    return results
+
+
+@outbox.task
 def send_notification(tokens: list, data: dict):
-    if len(tokens) == 1:
-        message = messaging.Message(data=data, token=tokens[0])
-        messaging.send(message)
-    else:
-        messages = messaging.MulticastMessage(data=data, tokens=tokens)
-        messaging.send_multicast(messages)
+    # the tokens are the task's own, the same in every attempt
+    return _push_once(outbox.idempotency_key(tokens, data), tokens, data)
+
+
+@outbox.task
+def send_to_topic(topic: str, data: dict):
+    """
+    Push the data message to every device subscribed to the topic.
+    """
+    key: str = outbox.idempotency_key(topic, data)
+    if not _mark_sent(key):
+        return None
+
+    try:
+        return messaging.send(messaging.Message(data=data, topic=topic))
+    except Exception:
+        _unmark_sent(key)
+        raise
 
 
-def add_scheduled_notification(time: datetime, tokens: list, data: dict) -> str:
-    id = str(uuid4())
-    time = parser.parse(time).replace(tzinfo=None) - datetime.now()
-    timers[id] = Timer(time, send_notification, args=(tokens, data))
+@outbox.task
+def send_to_users(uids: list, data: dict):
+    """
+    Push the data message to every registered device of the users.
+    """
+    tokens: list = device_tokens.tokens_for(uids)
+    if not tokens:
+        return dict()
+    # every attempt looks the tokens up again, a device registered or
+    # pruned in between must not make the push look like another one
+    receivers: list = sorted(set(uid for uid in uids if uid))
+    return _push_once(outbox.idempotency_key(receivers, data), tokens, data)
 
-    return id
+
+def add_scheduled_notification(time: str, uids: list, data: dict) -> str:
+    when: datetime = parser.parse(time)
+    return scheduler.schedule(when, send_to_users, uids=uids, data=data)
 
 
 def add_medical_notifications(
-    appointment_time: datetime, tokens: list, data: dict
+    appointment_time: datetime, uids: list, data: dict
 ) -> list:
+    """
+    Schedule the reminders of an exam. The dates of the medical CSVs name
+    no zone and are read as UTC. The reminders already due are skipped, a
+    historic record would otherwise push them all at once.
+    """
+    if appointment_time.tzinfo is None:
+        appointment_time = appointment_time.replace(tzinfo=timezone.utc)
+    now: datetime = datetime.now(timezone.utc)
+
     ids = list()
-    time_periods = [270, 180, 1]
-
-    for i in range(3):
-        id = str(uuid4())
-        ids.append(id)
-        time = (
-            appointment_time
-            - datetime.now()
-            + dt.timedelta(days=time_periods[i])
-        )
+    batch = db.batch()
 
-        timers[id] = Timer(time, send_notification, args=(tokens, data))
+    for days in MEDICAL_REMINDER_DAYS:
+        run_at: datetime = appointment_time + timedelta(days=days)
+        if run_at <= now:
+            continue
+        ids.append(
+            scheduler.schedule(
+                run_at,
+                send_to_users,
+                batch=batch,
+                uids=uids,
+                data=data,
+            )
+        )
 
+    if ids:
+        batch.commit()
     return ids
 
 
 def cancel_scheduled_notification(id: str):
-    if id in timers:
-        timers[id].cancel()
-        del timers[id]
+    scheduler.cancel(id)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.outbox
+    ~~~~~~~~~~~~~~~~~
+    Side effects (notifications, pushes) run after the write that causes
+    them has committed, on a small worker pool, so handlers return as soon
+    as their own write is done.
+
+    Every task is first written to the Outbox collection, in the same batch
+    as the primary write when there is one, and dispatched to the pool once
+    that batch commits. A task that succeeds deletes its Outbox document.
+    A failed one, or one lost with the process that ran it, becomes
+    available again after a backoff and is picked up by the sweeper every
+    process runs, until MAX_ATTEMPTS have failed. A permanent error, a 4xx
+    other than a timeout, a conflict or a rate limit (e.g. NotFound), fails
+    the task at once since every attempt would meet it again. Tasks run at
+    least once, so they should tolerate being repeated.
+
+    Task functions are registered with the task decorator and called with
+    the keyword arguments they were staged with, which must be storable in
+    Firestore. A task returning an exception fails like one raising it.
+    idempotency_key() derives keys from the id of the running entry, which
+    stays the same across its retries, for a task to skip the side effects
+    an earlier attempt already had.
+    Functions:
+        task()
+        task_name()
+        idempotency_key()
+        stage()
+        dispatch()
+        enqueue()
+        sweep()
+        start_sweeper()
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from firebase_admin import exceptions as firebase_exceptions
+from google.api_core import exceptions as api_exceptions
+from google.api_core.exceptions import FailedPrecondition, NotFound
+from threading import Thread, local
+from uuid import uuid4
+from werkzeug.exceptions import HTTPException
+import hashlib
+import json
+import logging
+import os
+import time
+import typing as t
+
+from src.common.database import db
+
+OUTBOX: str = "Outbox"
+OUTBOX_WORKERS: int = int(os.getenv("OUTBOX_WORKERS", 4))
+# how long a dispatched task is left to its worker before it is retried
+OUTBOX_LEASE: timedelta = timedelta(
+    seconds=int(os.getenv("OUTBOX_LEASE_SECONDS", 300))
+)
+OUTBOX_SWEEP_SECONDS: int = int(os.getenv("OUTBOX_SWEEP_SECONDS", 30))
+MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+# the client errors that may pass, a timeout, a conflict and a rate limit
+TRANSIENT_STATUSES: tuple = (408, 409, 429)
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+_pool: ThreadPoolExecutor = ThreadPoolExecutor(
+    max_workers=OUTBOX_WORKERS, thread_name_prefix="outbox"
+)
+_tasks: dict = dict()
+# the entry run by the current worker thread
+_running: local = local()
+
+
+def task(function: t.Callable) -> t.Callable:
+    """
+    Register the function as an outbox task.
+    """
+    _tasks[task_name(function)] = function
+    return function
+
+
+def task_name(function: t.Callable) -> str:
+    """
+    The name a task function is stored under.
+    """
+    if isinstance(function, str):
+        return function
+    return function.__module__ + "." + function.__qualname__
+
+
+def idempotency_key(*parts: t.Any) -> str:
+    """
+    A key for a side effect of the running task, the same in every attempt
+    of its entry and distinct for different parts, which must be JSON
+    serializable. None outside an outbox task.
+    """
+    entry_id: str = getattr(_running, "entry_id", None)
+    if entry_id is None:
+        return None
+    key = json.dumps([entry_id, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def stage(
+    batch, function: t.Callable, entry_id: str = None, **kwargs: t.Any
+) -> dict:
+    """
+    Add the task, a registered function or its name, to the batch (or
+    transaction). Once the batch is committed, the returned entry is
+    passed to dispatch(). A given entry_id makes staging the same task
+    twice write a single entry.
+    """
+    name: str = task_name(function)
+    if name not in _tasks:
+        raise ValueError("%s is not an outbox task" % name)
+
+    entry: dict = dict()
+    entry["id"] = entry_id or str(uuid4())
+    entry["task"] = name
+    entry["kwargs"] = kwargs
+    entry["attempts"] = 0
+    entry["available_at"] = _now() + OUTBOX_LEASE
+    entry["last_error"] = None
+    entry["failed"] = False
+
+    batch.set(db.collection(OUTBOX).document(entry["id"]), entry)
+    return entry
+
+
+def dispatch(*entries: dict) -> None:
+    """
+    Run the committed tasks on the worker pool.
+    """
+    for entry in entries:
+        _pool.submit(_run, entry)
+
+
+def enqueue(function: t.Callable, **kwargs: t.Any) -> None:
+    """
+    Write the task on its own and run it, for side effects that do not
+    follow a batch.
+    """
+    batch = db.batch()
+    entry: dict = stage(batch, function, **kwargs)
+    batch.commit()
+    dispatch(entry)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _permanent(error: Exception) -> bool:
+    """
+    Whether the error is one every attempt of the task would meet again.
+    """
+    # a precondition fails when a conditional write lost a race
+    if isinstance(error, FailedPrecondition):
+        return False
+
+    if isinstance(error, (HTTPException, api_exceptions.GoogleAPICallError)):
+        status: int = error.code
+    elif (
+        isinstance(error, firebase_exceptions.FirebaseError)
+        and error.http_response is not None
+    ):
+        status = error.http_response.status_code
+    else:
+        return False
+
+    return (
+        status is not None
+        and 400 <= status < 500
+        and status not in TRANSIENT_STATUSES
+    )
+
+
+def _run(entry: dict) -> None:
+    entry_ref = db.collection(OUTBOX).document(entry["id"])
+    _running.entry_id = entry["id"]
+    try:
+        result = _tasks[entry["task"]](**entry["kwargs"])
+        if isinstance(result, Exception):
+            raise result
+    except Exception as error:
+        attempts: int = entry["attempts"] + 1
+        failed: bool = attempts >= MAX_ATTEMPTS or _permanent(error)
+        logger.warning(
+            "Outbox task %s %s failed (attempt %d): %r",
+            entry["task"],
+            entry["id"],
+            attempts,
+            error,
+        )
+        # back off exponentially, failed tasks are kept out of the sweeps
+        backoff: timedelta = min(
+            timedelta(seconds=30 * 2**attempts), timedelta(hours=1)
+        )
+        entry_ref.update(
+            {
+                "attempts": attempts,
+                "available_at": None if failed else _now() + backoff,
+                "last_error": repr(error),
+                "failed": failed,
+            }
+        )
+        return
+    finally:
+        _running.entry_id = None
+
+    entry_ref.delete()
+
+
+def sweep(limit: int = 100) -> int:
+    """
+    Claim the tasks that are due again and run them. Returns the number of
+    tasks dispatched.
+    """
+    docs = (
+        db.collection(OUTBOX)
+        .where("available_at", "<=", _now())
+        .order_by("available_at")
+        .limit(limit)
+        .stream()
+    )
+
+    dispatched: int = 0
+    for doc in docs:
+        entry: dict = doc.to_dict()
+        entry["available_at"] = _now() + OUTBOX_LEASE
+        # another process may be claiming the same task
+        try:
+            doc.reference.update(
+                {"available_at": entry["available_at"]},
+                option=db.write_option(last_update_time=doc.update_time),
+            )
+        except (FailedPrecondition, NotFound):
+            continue
+        if entry.get("task") not in _tasks:
+            logger.error("Unknown outbox task %s", entry.get("task"))
+            continue
+        dispatch(entry)
+        dispatched += 1
+
+    return dispatched
+
+
+def start_sweeper() -> Thread:
+    """
+    Sweep the outbox every OUTBOX_SWEEP_SECONDS in a daemon thread.
+    """
+
+    def run() -> None:
+        while True:
+            time.sleep(OUTBOX_SWEEP_SECONDS)
+            try:
+                sweep()
+            except Exception:
+                logger.exception("Outbox sweep failed")
+
+    sweeper: Thread = Thread(target=run, name="outbox-sweeper", daemon=True)
+    sweeper.start()
+    return sweeper
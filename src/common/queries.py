@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.queries
+    ~~~~~~~~~~~~~~~~~~
+    Declarative Firestore queries for the list endpoints.
+
+    A ListQuery names its collection, the filters that are always applied,
+    the filters that are only applied when the matching request argument is
+    present, the ordering and the summary projection. page() runs it for a
+    request and paginated() renders the result, and check_indexes() verifies
+    at startup that every combination of filters the endpoints can issue is
+    served by firestore.indexes.json.
+
+    Only the summary fields are read unless the request names its own with
+    the fields argument (comma separated, or * for whole documents). The
+    projection is pushed down to Firestore, so unused fields are neither
+    read nor sent.
+
+    The collection may be a path template such as Files/{file_id}/history,
+    filled in from the keyword arguments of build().
+
+    Pages are chained with opaque, signed cursors: the response carries the
+    cursor of the next page in the X-Next-Cursor header and the client sends
+    it back as the cursor argument. A cursor holds the ordering value and the
+    id of the last document of the previous page, so the next page starts
+    after it instead of re-reading every earlier document, and still does
+    when that document has been deleted since. Unordered queries only have
+    the id to go on, so their cursor is rejected once the document is gone.
+    Classes:
+        ListQuery
+        Page
+    Functions:
+        init_cursors()
+        paginated()
+        check_indexes()
+"""
+from firebase_admin import firestore
+from datetime import datetime
+from flask import Response, jsonify
+from itertools import combinations
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest
+import json
+import os
+import typing as t
+
+from src.common.database import db
+
+MAX_PAGE_LIMIT: int = int(os.getenv("MAX_PAGE_LIMIT", 100))
+NEXT_CURSOR_HEADER: str = "X-Next-Cursor"
+
+# set by init_cursors() when the app starts
+_cursor_serializer: URLSafeSerializer = None
+
+# every ListQuery registers itself so the index check sees all of them
+_registry: list = []
+
+
+class Page:
+    def __init__(
+        self,
+        cursor_key: str,
+        docs: list,
+        page_limit: int,
+        order_by: str = None,
+    ):
+        self.docs: list = docs
+        # a full page may be followed by another one, None marks the end
+        cursor: t.Any = None
+        if docs and len(docs) == page_limit:
+            cursor = _cursor_after(docs[-1], order_by)
+        self.cursor: dict = {cursor_key: cursor}
+
+
+class ListQuery:
+    def __init__(
+        self,
+        collection: str,
+        order_by: str = None,
+        direction: str = firestore.Query.DESCENDING,
+        page_limit: int = 10,
+        summary: list = None,
+    ):
+        self.collection: str = collection
+        self.order_by: str = order_by
+        self.direction: str = direction
+        self.page_limit: int = page_limit
+        self.summary: list = summary
+        # (field, op, value name) applied on every query
+        self.filters: list = []
+        # (field, op, argument name, type, transform) applied on demand
+        self.optional_filters: list = []
+        _registry.append(self)
+
+    def where(self, field: str, op: str = "==", value: str = None):
+        """
+        Always filter on the field. The value is passed to build() as a
+        keyword argument named after the field unless another name is given.
+        """
+        self.filters.append((field, op, value or field))
+        return self
+
+    def optional(
+        self,
+        field: str,
+        type: t.Callable = str,
+        op: str = "==",
+        arg: str = None,
+        transform: t.Callable = None,
+    ):
+        """
+        Filter on the field when the request argument (the field name unless
+        another name is given) is present.
+        """
+        self.optional_filters.append(
+            (field, op, arg or field, type, transform)
+        )
+        return self
+
+    def build(self, args: dict, cursor: str = None, **values: t.Any):
+        """
+        Assemble the Firestore query for the request arguments. Fixed filter
+        values are passed as keyword arguments and cursor is the one of the
+        last document of the previous page.
+        """
+        collection: str = self.collection.format(**values)
+        query = db.collection(collection)
+
+        if self.order_by:
+            query = query.order_by(self.order_by, direction=self.direction)
+
+        for field, op, value in self.filters:
+            query = query.where(field, op, values[value])
+
+        for field, op, arg, type, transform in self.optional_filters:
+            if arg not in args:
+                continue
+            value = args.get(arg, type=type)
+            if transform:
+                value = transform(value)
+            query = query.where(field, op, value)
+
+        fields: list = self.fields(args)
+        if fields:
+            if self.order_by and self.order_by not in fields:
+                # the cursor of the next page needs the ordering value
+                fields = fields + [self.order_by]
+            query = query.select(fields)
+
+        if cursor and self.order_by:
+            if not isinstance(cursor, list) or len(cursor) != 2:
+                raise BadRequest("Invalid cursor")
+            value, last_id = cursor
+            # resume after the ordering value and id of the last document,
+            # the id breaking the ties as Firestore does implicitly
+            query = query.order_by("__name__", direction=self.direction)
+            query = query.start_after(
+                {self.order_by: _decode_value(value), "__name__": last_id}
+            )
+        elif cursor:
+            if not isinstance(cursor, str):
+                raise BadRequest("Invalid cursor")
+            last_doc = db.collection(collection).document(cursor).get()
+            if not last_doc.exists:
+                # without an ordering value there is nothing to resume from
+                raise BadRequest("Stale cursor, the list changed meanwhile")
+            query = query.start_after(last_doc)
+
+        return query.limit(self.limit(args))
+
+    def page(self, args: dict, cursor_key: str = None, **values: t.Any):
+        """
+        Run the query for the page the request's cursor argument points at.
+        Endpoints combining several queries give each a distinct cursor_key.
+        """
+        cursor_key = cursor_key or self.collection
+        cursors: dict = _decode_cursor(args.get("cursor", type=str))
+        if cursors and cursors.get(cursor_key) is None:
+            # this query was exhausted on a previous page
+            return Page(cursor_key, [], self.limit(args))
+
+        query = self.build(args, cursor=cursors.get(cursor_key), **values)
+        return Page(
+            cursor_key, list(query.stream()), self.limit(args), self.order_by
+        )
+
+    def stream(self, args: dict, **values: t.Any):
+        """
+        Yield every document matching the request arguments, reading them
+        in pages of MAX_PAGE_LIMIT whatever page size the request asks for.
+        """
+        args = MultiDict(args)
+        args["page_limit"] = MAX_PAGE_LIMIT
+        cursor: t.Any = None
+        while True:
+            query = self.build(args, cursor=cursor, **values)
+            docs: list = list(query.stream())
+            yield from docs
+            if len(docs) < MAX_PAGE_LIMIT:
+                return
+            cursor = _cursor_after(docs[-1], self.order_by)
+
+    def fields(self, args: dict) -> list:
+        """
+        The fields asked for by the request, the summary fields by default
+        and None for whole documents.
+        """
+        if "fields" not in args:
+            return self.summary
+
+        fields: str = args.get("fields", type=str)
+        if fields.strip() == "*":
+            return None
+
+        return [field.strip() for field in fields.split(",") if field.strip()]
+
+    def limit(self, args: dict) -> int:
+        """
+        The page size asked for by the request, capped to MAX_PAGE_LIMIT.
+        """
+        page_limit: int = args.get("page_limit", self.page_limit, type=int)
+        if not page_limit or page_limit < 1:
+            return MAX_PAGE_LIMIT
+        return min(page_limit, MAX_PAGE_LIMIT)
+
+    def shapes(self) -> list:
+        """
+        Every (equality fields, array-contains fields) combination build() can
+        produce for this query.
+        """
+        shapes: list = []
+        for count in range(len(self.optional_filters) + 1):
+            for chosen in combinations(self.optional_filters, count):
+                equalities: set = set()
+                contains: set = set()
+                for field, op, *_ in self.filters + list(chosen):
+                    if op == "array_contains":
+                        contains.add(field)
+                    elif op in ("==", "in"):
+                        equalities.add(field)
+                shapes.append((frozenset(equalities), frozenset(contains)))
+
+        return shapes
+
+
+def init_cursors(secret_key: str) -> None:
+    """
+    Sign the cursors with the secret key. A cursor signed with a missing or
+    guessable key could be forged, so the app refuses to start without one.
+    """
+    global _cursor_serializer
+    if not secret_key:
+        raise RuntimeError("CURSOR_SECRET_KEY is required to sign the cursors")
+    _cursor_serializer = URLSafeSerializer(secret_key, salt="list-cursor")
+
+
+def paginated(items: list, *pages: Page) -> Response:
+    """
+    Render the items of one or more pages, with the cursor of the next page
+    when any of the queries may have more documents.
+    """
+    cursors: dict = dict()
+    for page in pages:
+        cursors.update(page.cursor)
+
+    response: Response = jsonify(items)
+    if any(cursors.values()):
+        response.headers[NEXT_CURSOR_HEADER] = _cursor_serializer.dumps(
+            cursors
+        )
+
+    return response
+
+
+def _cursor_after(doc, order_by: str) -> t.Any:
+    if not order_by:
+        return doc.id
+    return [_encode_value(doc.to_dict().get(order_by)), doc.id]
+
+
+def _encode_value(value: t.Any) -> t.Any:
+    # the cursors are JSON, which has no timestamps
+    if isinstance(value, datetime):
+        return {"time": value.isoformat()}
+    return value
+
+
+def _decode_value(value: t.Any) -> t.Any:
+    if isinstance(value, dict):
+        try:
+            return datetime.fromisoformat(value["time"])
+        except (KeyError, TypeError, ValueError):
+            raise BadRequest("Invalid cursor")
+    return value
+
+
+def _decode_cursor(token: str) -> dict:
+    if not token:
+        return dict()
+    try:
+        cursors = _cursor_serializer.loads(token)
+    except BadSignature:
+        raise BadRequest("Invalid cursor")
+    if not isinstance(cursors, dict):
+        raise BadRequest("Invalid cursor")
+
+    return cursors
+
+
+def _needs_composite_index(equalities: set, contains: set, order_by: str):
+    # equality-only queries are served by merging single-field indexes
+    if not order_by:
+        return False
+    return bool((equalities | contains) - {order_by})
+
+
+def _is_covered(
+    equalities: set, contains: set, order_by: str, direction: str, indexes
+) -> bool:
+    """
+    A query is covered when the equality prefixes of the composite indexes
+    ending with its ordering add up to its filters. A single exact index is
+    the common case, several partial ones are merged by Firestore.
+    """
+    wanted: set = {(field, "eq") for field in equalities - {order_by}}
+    wanted |= {(field, "contains") for field in contains}
+
+    covered: set = set()
+    for fields in indexes:
+        if fields[-1] != (order_by, direction):
+            continue
+        prefix: set = set(fields[:-1])
+        if prefix and prefix <= wanted:
+            covered |= prefix
+
+    return covered == wanted
+
+
+def _load_indexes(path: str) -> dict:
+    with open(path, "r") as indexes_file:
+        spec: dict = json.load(indexes_file)
+
+    indexes: dict = dict()
+    for index in spec.get("indexes", []):
+        fields: list = []
+        for field in index.get("fields", []):
+            if field.get("arrayConfig") == "CONTAINS":
+                fields.append((field["fieldPath"], "contains"))
+            else:
+                fields.append((field["fieldPath"], field.get("order")))
+        # every field but the last one is an equality prefix
+        fields = [
+            (name, "contains" if mode == "contains" else "eq")
+            for name, mode in fields[:-1]
+        ] + fields[-1:]
+        indexes.setdefault(index["collectionGroup"], []).append(tuple(fields))
+
+    return indexes
+
+
+def check_indexes(path: str) -> None:
+    """
+    Raise a RuntimeError listing every list query shape that would need a
+    composite index missing from the given firestore.indexes.json.
+    """
+    indexes: dict = _load_indexes(path)
+    missing: list = []
+
+    for query in _registry:
+        # indexes are declared per collection group, the last path segment
+        collection: str = query.collection.split("/")[-1]
+        for equalities, contains in query.shapes():
+            if not _needs_composite_index(
+                equalities, contains, query.order_by
+            ):
+                continue
+            if not _is_covered(
+                equalities,
+                contains,
+                query.order_by,
+                query.direction,
+                indexes.get(collection, []),
+            ):
+                fields: list = sorted(equalities) + [
+                    "%s contains" % field for field in sorted(contains)
+                ]
+                missing.append(
+                    "%s: %s order by %s %s"
+                    % (
+                        collection,
+                        ", ".join(fields),
+                        query.order_by,
+                        query.direction,
+                    )
+                )
+
+    if missing:
+        raise RuntimeError(
+            "Missing composite indexes in %s:\n    %s"
+            % (path, "\n    ".join(sorted(set(missing))))
+        )
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.scheduler
+    ~~~~~~~~~~~~~~~~~~~~
+    Runs outbox tasks at a given time, for the notifications pushed ahead
+    of events and medical exams.
+
+    The jobs are stored in the Scheduled-Notifications collection, so they
+    survive restarts and are shared by every process. Every process runs a
+    scheduler thread, but only the one holding the scheduler lease fires
+    the jobs, the others wait to take it over. The leader pages the jobs
+    due within SCHEDULER_LOOKAHEAD in time-ordered batches into a timing
+    wheel, so only that window is held in memory, picks up the jobs the
+    other processes scheduled since at each lease renewal, and advances
+    the wheel every SCHEDULER_TICK_SECONDS while it holds jobs. A due job
+    is claimed in a transaction that checks the lease's fencing token,
+    deletes the job and queues its task in the outbox, under the id of the
+    job, whose worker pool then runs it. Cancelling a job deletes it by id
+    and drops it from the wheel.
+    Classes:
+        Scheduler
+"""
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+from threading import Condition, Thread
+from uuid import uuid4
+import logging
+import os
+import typing as t
+
+from src.common import outbox
+from src.common.database import db
+from src.common.io_pool import io_pool
+from src.common.leader import Lease
+from src.common.timing_wheel import TimingWheel
+
+SCHEDULED: str = "Scheduled-Notifications"
+SCHEDULER_LOOKAHEAD: timedelta = timedelta(
+    seconds=int(os.getenv("SCHEDULER_LOOKAHEAD_SECONDS", 300))
+)
+SCHEDULER_BATCH: int = int(os.getenv("SCHEDULER_BATCH", 200))
+SCHEDULER_TICK_SECONDS: float = float(os.getenv("SCHEDULER_TICK_SECONDS", 1))
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@firestore.transactional
+def _claim(transaction, lease: Lease, job_ref) -> dict:
+    # the lease is read first, so a deposed leader's claim does not commit
+    if not lease.check(transaction):
+        return None
+    for job in transaction.get(job_ref):
+        if not job.exists:
+            # cancelled, or already run
+            return None
+        entry: dict = job.to_dict()
+        transaction.delete(job_ref)
+        return outbox.stage(
+            transaction, entry["task"], entry_id=job_ref.id, **entry["kwargs"]
+        )
+
+    return None
+
+
+class Scheduler:
+    def __init__(self):
+        self._condition: Condition = Condition()
+        self._lease: Lease = Lease("scheduler")
+        self._renew_at: datetime = None
+        self._thread: Thread = None
+        self._reset()
+
+    def schedule(
+        self,
+        run_at: datetime,
+        function: t.Callable,
+        batch=None,
+        job_id: str = None,
+        **kwargs
+    ) -> str:
+        """
+        Run the outbox task with the keyword arguments at the given time.
+        When a batch is given the job is only added to it and the caller
+        commits. A job scheduled again under the same job_id is merged into
+        the pending one, so its arguments can be transforms like ArrayUnion.
+        Returns the id of the job.
+        """
+        entry: dict = dict()
+        entry["id"] = job_id or str(uuid4())
+        entry["run_at"] = run_at.astimezone(timezone.utc)
+        entry["task"] = outbox.task_name(function)
+        entry["kwargs"] = kwargs
+        entry["created_at"] = _now()
+
+        job_ref = db.collection(SCHEDULED).document(entry["id"])
+        if batch is None:
+            job_ref.set(entry, merge=job_id is not None)
+        else:
+            batch.set(job_ref, entry, merge=job_id is not None)
+
+        with self._condition:
+            if self._loaded_until and entry["run_at"] <= self._loaded_until:
+                self._push(entry["run_at"], entry["id"])
+                self._condition.notify()
+
+        return entry["id"]
+
+    def cancel(self, job_id: str) -> None:
+        """
+        Cancel the job with the given id.
+        """
+        with self._condition:
+            self._wheel.cancel(job_id)
+        db.collection(SCHEDULED).document(job_id).delete()
+
+    def start(self) -> Thread:
+        """
+        Run the jobs of every process from a daemon thread.
+        """
+        self._thread = Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _reset(self) -> None:
+        with self._condition:
+            self._wheel: TimingWheel = TimingWheel(
+                _now().timestamp(), tick=SCHEDULER_TICK_SECONDS
+            )
+            # jobs up to this time are in the wheel, later ones are still
+            # stored
+            self._loaded_until: datetime = None
+            self._next_load: datetime = None
+            # jobs created since this time may be missing from the wheel
+            self._polled_at: datetime = None
+
+    def _push(self, run_at: datetime, job_id: str) -> None:
+        if job_id not in self._wheel:
+            self._wheel.add(job_id, run_at.timestamp())
+
+    def _load(self) -> None:
+        now: datetime = _now()
+        horizon: datetime = now + SCHEDULER_LOOKAHEAD
+        docs: list = list(
+            db.collection(SCHEDULED)
+            .where("run_at", "<=", horizon)
+            .order_by("run_at")
+            .limit(SCHEDULER_BATCH)
+            .select(["run_at"])
+            .stream()
+        )
+
+        with self._condition:
+            for doc in docs:
+                self._push(doc.get("run_at"), doc.id)
+            if len(docs) < SCHEDULER_BATCH:
+                self._loaded_until = horizon
+                self._next_load = now + SCHEDULER_LOOKAHEAD / 2
+            else:
+                # load the next batch once this one has run
+                self._loaded_until = docs[-1].get("run_at")
+                self._next_load = self._loaded_until
+            self._polled_at = now
+
+    def _poll(self) -> None:
+        now: datetime = _now()
+        # overlap the previous poll by a lease, for the jobs committed late
+        # or by a process whose clock is behind
+        docs = (
+            db.collection(SCHEDULED)
+            .where("created_at", ">=", self._polled_at - self._lease.ttl)
+            .select(["run_at"])
+            .stream()
+        )
+
+        with self._condition:
+            for doc in docs:
+                if doc.get("run_at") <= self._loaded_until:
+                    self._push(doc.get("run_at"), doc.id)
+            self._polled_at = now
+
+    def _run(self) -> None:
+        while True:
+            if self._renew_at is None or _now() >= self._renew_at:
+                leading: bool = self._lease.acquire()
+                self._renew_at = _now() + self._lease.ttl / 3
+                try:
+                    if not leading:
+                        self._reset()
+                    elif self._polled_at is not None:
+                        self._poll()
+                except Exception:
+                    logger.exception("Polling the scheduled jobs failed")
+
+            if self._lease.held:
+                try:
+                    if self._next_load is None or _now() >= self._next_load:
+                        self._load()
+                except Exception:
+                    logger.exception("Loading the scheduled jobs failed")
+                    self._next_load = _now() + SCHEDULER_LOOKAHEAD / 2
+
+            with self._condition:
+                now: datetime = _now()
+                wake: datetime = self._renew_at
+                if self._lease.held:
+                    for job_id in self._wheel.advance(now.timestamp()):
+                        io_pool.submit(self._fire, job_id)
+                    wake = min(wake, self._next_load)
+                    if len(self._wheel):
+                        wake = min(
+                            wake,
+                            now + timedelta(seconds=SCHEDULER_TICK_SECONDS),
+                        )
+                self._condition.wait(
+                    timeout=max((wake - now).total_seconds(), 0)
+                )
+
+    def _fire(self, job_id: str) -> None:
+        try:
+            task: dict = _claim(
+                db.transaction(),
+                self._lease,
+                db.collection(SCHEDULED).document(job_id),
+            )
+        except Exception:
+            # left stored, the next load picks it up again
+            logger.exception("Claiming the scheduled job %s failed", job_id)
+            return
+        if task:
+            outbox.dispatch(task)
+
+
+scheduler: Scheduler = Scheduler()
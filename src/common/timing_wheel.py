@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.timing_wheel
+    ~~~~~~~~~~~~~~~~~~~~~~~
+    A hierarchical timing wheel holding the scheduler's pending jobs.
+
+    Level 0 has one slot per tick, and every slot of level k spans a whole
+    turn of level k - 1. A job goes in the lowest level whose turn reaches
+    its deadline, so adding is O(1). When a level completes a turn, the
+    next slot of the level above is spread over the levels below. Each tick
+    only looks at one slot per level, which holds the ids due then.
+
+    A slot is a set of ids and the only other entry of a job is its
+    deadline tick. Cancelling drops the deadline, which is O(1), and the
+    id is skipped when its slot comes up. Ticks without due jobs cost one
+    empty slot check, whatever the number of jobs in the wheel.
+    Classes:
+        TimingWheel
+"""
+import math
+
+
+class TimingWheel:
+    def __init__(
+        self, start: float, tick: float = 1.0, size: int = 256, levels: int = 4
+    ):
+        self.tick: float = tick
+        self.size: int = size
+        self.levels: int = levels
+        # the last tick processed
+        self.current: int = math.floor(start / tick)
+        # the ticks one slot of each level spans
+        self._spans: list = [size**level for level in range(levels)]
+        self._slots: list = [
+            [set() for _ in range(size)] for _ in range(levels)
+        ]
+        # job id -> deadline tick
+        self._deadlines: dict = dict()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, job_id: str) -> bool:
+        return job_id in self._deadlines
+
+    @property
+    def horizon(self) -> float:
+        """
+        The latest time a job can be added for.
+        """
+        return (self.current + self.size**self.levels - 1) * self.tick
+
+    def add(self, job_id: str, when: float) -> None:
+        """
+        Add the job for the given time, in seconds since the epoch. A job
+        already in the wheel is moved.
+        """
+        # late jobs are due on the next tick
+        deadline: int = max(math.ceil(when / self.tick), self.current + 1)
+        if deadline - self.current >= self.size**self.levels:
+            raise ValueError("%s is past the wheel horizon" % when)
+        self._deadlines[job_id] = deadline
+        self._place(job_id, deadline)
+
+    def cancel(self, job_id: str) -> None:
+        self._deadlines.pop(job_id, None)
+
+    def advance(self, now: float) -> list:
+        """
+        Process the ticks up to the given time and return the ids of the
+        jobs that came due, in deadline order.
+        """
+        due: list = []
+        target: int = math.floor(now / self.tick)
+        while self.current < target:
+            self.current += 1
+            # spread the slots of the levels completing a turn downwards
+            for level in range(self.levels - 1, 0, -1):
+                if self.current % self._spans[level] == 0:
+                    slot: int = (
+                        self.current // self._spans[level]
+                    ) % self.size
+                    self._cascade(level, slot)
+            due.extend(self._expire(self.current % self.size))
+
+        return due
+
+    def _place(self, job_id: str, deadline: int) -> None:
+        delta: int = deadline - self.current
+        level: int = 0
+        while delta >= self._spans[level] * self.size:
+            level += 1
+        slot: int = (deadline // self._spans[level]) % self.size
+        self._slots[level][slot].add(job_id)
+
+    def _cascade(self, level: int, slot: int) -> None:
+        jobs: set = self._slots[level][slot]
+        self._slots[level][slot] = set()
+        for job_id in jobs:
+            deadline: int = self._deadlines.get(job_id)
+            if deadline is not None:
+                self._place(job_id, deadline)
+
+    def _expire(self, slot: int) -> list:
+        jobs: set = self._slots[0][slot]
+        if not jobs:
+            return []
+        self._slots[0][slot] = set()
+
+        due: list = []
+        for job_id in jobs:
+            # cancelled and moved jobs no longer have this deadline
+            if self._deadlines.get(job_id) == self.current:
+                del self._deadlines[job_id]
+                due.append(job_id)
+
+        return due
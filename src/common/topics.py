@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.topics
+    ~~~~~~~~~~~~~~~~~
+    FCM topics of the units and rosters, so an announcement to a whole
+    unit is a single send to its topic instead of a multicast to every
+    device of its members.
+
+    The devices of a user are subscribed to the topic of the user's unit
+    (unit_name) and of the rosters listing the user: a new device when it
+    is registered, every device of the user when the user joins, and they
+    are unsubscribed the same way, and change_unit() moves them when the
+    unit of the user changes. FCM takes up to TOPIC_BATCH tokens per
+    call, the calls of a change run concurrently on the io pool. join()
+    and leave() are outbox tasks, subscribing twice is harmless so they
+    are simply retried.
+    Functions:
+        unit_topic()
+        roster_topic()
+        member_uids()
+        user_topics()
+        change_unit()
+        subscribe()
+        unsubscribe()
+        join()
+        leave()
+"""
+from firebase_admin import messaging
+from itertools import repeat
+from urllib.parse import quote
+import logging
+import typing as t
+
+from src.common import device_tokens, outbox
+from src.common.database import db
+from src.common.io_pool import io_pool
+
+# FCM rejects topic management calls with more tokens
+TOPIC_BATCH: int = 1000
+
+# the topic management errors worth retrying the whole change for
+TRANSIENT_ERRORS: set = {"internal-error", "unknown-error"}
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def _topic(kind: str, name: str) -> str:
+    # topic names only take [a-zA-Z0-9-_.~%]
+    return "%s.%s" % (kind, quote(str(name), safe=""))
+
+
+def unit_topic(unit_name: str) -> str:
+    return _topic("unit", unit_name)
+
+
+def roster_topic(roster_name: str) -> str:
+    return _topic("roster", roster_name)
+
+
+def member_uids(members: list) -> list:
+    """
+    The uids of the roster members, which are uids or user data with a uid.
+    """
+    uids: list = []
+    for member in members or []:
+        uid = member.get("uid") if isinstance(member, dict) else member
+        if uid:
+            uids.append(uid)
+    return uids
+
+
+def user_topics(user: dict) -> list:
+    """
+    The topics the devices of the user are subscribed to.
+    """
+    topics: list = list()
+    if user.get("unit_name"):
+        topics.append(unit_topic(user.get("unit_name")))
+    # array_contains cannot match the members stored as user data by their
+    # uid, and there are few rosters
+    for doc in db.collection("Roster").stream():
+        if user.get("uid") in member_uids(doc.to_dict().get("users")):
+            topics.append(roster_topic(doc.id))
+
+    return topics
+
+
+def change_unit(uid: str, old_unit: str, new_unit: str) -> None:
+    """
+    Move the devices of the user from the topic of the old unit to the one
+    of the new unit.
+    """
+    if old_unit == new_unit:
+        return
+    if old_unit:
+        outbox.enqueue(leave, topics=[unit_topic(old_unit)], uids=[uid])
+    if new_unit:
+        outbox.enqueue(join, topics=[unit_topic(new_unit)], uids=[uid])
+
+
+def _manage(function: t.Callable, topic: str, tokens: list) -> list:
+    tokens = list(dict.fromkeys(token for token in tokens if token))
+    chunks: list = [
+        tokens[i : i + TOPIC_BATCH] for i in range(0, len(tokens), TOPIC_BATCH)
+    ]
+
+    errors: list = list()
+    for response in io_pool.map(function, chunks, repeat(topic)):
+        errors.extend(error.reason for error in response.errors)
+    if errors:
+        logger.warning(
+            "%d of %d tokens failed for %s: %s",
+            len(errors),
+            len(tokens),
+            topic,
+            ", ".join(sorted(set(errors))),
+        )
+
+    return errors
+
+
+def subscribe(topic: str, tokens: list) -> list:
+    """
+    Subscribe the tokens to the topic. Returns the reasons of the tokens
+    that failed.
+    """
+    return _manage(messaging.subscribe_to_topic, topic, tokens)
+
+
+def unsubscribe(topic: str, tokens: list) -> list:
+    """
+    Unsubscribe the tokens from the topic. Returns the reasons of the
+    tokens that failed.
+    """
+    return _manage(messaging.unsubscribe_from_topic, topic, tokens)
+
+
+def _change(function: t.Callable, uids: list, topics: list, tokens: list):
+    tokens = tokens or device_tokens.tokens_for(uids)
+    if not tokens:
+        return None
+
+    errors: list = list()
+    for topic in topics:
+        errors.extend(function(topic, tokens))
+    if TRANSIENT_ERRORS & set(errors):
+        return RuntimeError("Topic management failed: %s" % ", ".join(errors))
+
+    return None
+
+
+@outbox.task
+def join(topics: list, uids: list = None, tokens: list = None):
+    """
+    Subscribe every device of the users, or only the given tokens, to the
+    topics.
+    """
+    return _change(subscribe, uids or [], topics, tokens)
+
+
+@outbox.task
+def leave(topics: list, uids: list = None, tokens: list = None):
+    """
+    Unsubscribe every device of the users, or only the given tokens, from
+    the topics.
+    """
+    return _change(unsubscribe, uids or [], topics, tokens)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*
+"""
+    src.common.unread_counters
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+    The number of unread notifications of each user, kept in the
+    Unread-Counts document of the user's uid, so a badge refresh reads one
+    document instead of querying the notifications.
+
+    The writes of a notification stage the increment of its receiver's
+    counter in the same batch or transaction: +1 when an unread
+    notification is added or a read one becomes unread again, -1 when an
+    unread one is read or deleted. reconcile(), an outbox task, recounts
+    the notifications to find any drift and repairs each drifted counter in
+    a transaction.
+    Functions:
+        stage_unread()
+        get_unread()
+        reconcile()
+"""
+from firebase_admin import firestore
+
+from src.common import outbox
+from src.common.database import db
+
+UNREAD_COUNTS: str = "Unread-Counts"
+
+
+def stage_unread(batch, uid: str, step: int) -> None:
+    """
+    Add the change of the unread count of the user to the batch, or to the
+    transaction.
+    """
+    if not uid or not step:
+        return
+    batch.set(
+        db.collection(UNREAD_COUNTS).document(uid),
+        {"unread": firestore.Increment(step)},
+        merge=True,
+    )
+
+
+def get_unread(uid: str) -> int:
+    """
+    The number of unread notifications of the user.
+    """
+    counts_ref = db.collection(UNREAD_COUNTS).document(uid).get()
+    if not counts_ref.exists:
+        return 0
+    # a drifted counter never shows a negative badge
+    return max(counts_ref.to_dict().get("unread") or 0, 0)
+
+
+@outbox.task
+def reconcile() -> int:
+    """
+    Recount the unread notifications and repair the counters that drifted.
+    Returns the number of counters repaired.
+    """
+    expected: dict = dict()
+    unread = db.collection("Notification").where("read", "==", False).stream()
+    for doc in unread:
+        receiver: str = doc.to_dict().get("receiver")
+        if receiver:
+            expected[receiver] = expected.get(receiver, 0) + 1
+
+    stored: dict = {
+        doc.id: doc.to_dict().get("unread") or 0
+        for doc in db.collection(UNREAD_COUNTS).stream()
+    }
+
+    repaired: int = 0
+    for uid in set(expected) | set(stored):
+        if expected.get(uid, 0) == stored.get(uid, 0):
+            continue
+        # the scan only finds the drifted counters, each is recounted in a
+        # transaction since notifications kept changing while it ran
+        if _repair(db.transaction(), uid):
+            repaired += 1
+
+    return repaired
+
+
+@firestore.transactional
+def _repair(transaction, uid: str) -> bool:
+    """
+    Recount the unread notifications of the user and overwrite the counter
+    if it drifted. The counter and the notifications are read in the
+    transaction, so the increments committed since the scan are neither
+    lost nor counted twice.
+    """
+    counter_ref = db.collection(UNREAD_COUNTS).document(uid)
+    stored: int = 0
+    for snapshot in transaction.get(counter_ref):
+        if snapshot.exists:
+            stored = snapshot.to_dict().get("unread") or 0
+
+    unread = (
+        db.collection("Notification")
+        .where("receiver", "==", uid)
+        .where("read", "==", False)
+    )
+    expected: int = sum(1 for _ in transaction.get(unread))
+    if expected == stored:
+        return False
+
+    transaction.set(counter_ref, {"unread": expected}, merge=True)
+    return True
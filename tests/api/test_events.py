@@ -9,7 +9,10 @@ from firebase_admin import auth
 import firebase_admin
 import pytest
 from unittest import mock
-from tests.utils import count_docs
+from tests.utils import AppliedBatch, count_docs
+from src.api.events import notify_invitees
+from src.common import outbox
+from src.common.database import db
 from mockfirestore import MockFirestore
 
 
@@ -47,10 +50,74 @@ class TestEventsBlueprint(BaseTestCase):
             self.assertEqual(res.status_code, 201)
             self.assertEqual(count_docs("Scheduled-Events"), 1)
 
+    def test_create_event_rejects_unknown_invitees(self):
+        db.collection("User").document("author").set(
+            {"uid": "author", "name": "Author", "dod": "1"}
+        )
+        db.collection("User").document("invitee").set(
+            {"uid": "invitee", "dod": "2"}
+        )
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token"
+        ) as magic_mock, mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ):
+            magic_mock.return_value = {"uid": "author"}
+            res = self.client.post(
+                "/events/create_event",
+                headers={"Authorization": "token"},
+                json={
+                    "title": "Test Event",
+                    "starttime": "2020-01-01T00:00:00",
+                    "endtime": "2020-01-01T00:00:00",
+                    "type": "Test Type",
+                    "period": False,
+                    "invitees_dod": ["2", "3"],
+                    "organizer": "Test Organizer",
+                },
+            )
+
+        self.assertEqual(res.status_code, 404)
+        self.assertIn("The invitee was not found", res.data.decode())
+        self.assertEqual(count_docs("Scheduled-Events"), 0)
+
     """delete_event"""
 
     def test_delete_event(self):
-        pass
+        db.collection("User").document("author").set(
+            {"uid": "author", "name": "Author"}
+        )
+        db.collection("Scheduled-Events").document("e1").set(
+            {
+                "event_id": "e1",
+                "author": "author",
+                "type": "drill",
+                "invitees_dod": ["1"],
+                "confirmed_dod": [],
+            }
+        )
+        db.collection("Notification").document("invite").set(
+            {"id": "e1", "receiver": "u2", "read": False}
+        )
+
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token",
+            return_value={"uid": "author"},
+        ), mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(
+            outbox, "dispatch"
+        ) as dispatch:
+            res = self.client.delete(
+                "/events/delete_event/e1", headers={"Authorization": "token"}
+            )
+
+        self.assertEqual(res.status_code, 200)
+        # the cancellation notice, not one of the deleted invites
+        (entry,) = dispatch.call_args.args
+        self.assertEqual(entry["task"], outbox.task_name(notify_invitees))
+        self.assertEqual(entry["kwargs"]["event_id"], "e1")
+        self.assertEqual(count_docs("Scheduled-Events"), 0)
 
     """update_event"""
 
@@ -3,7 +3,46 @@
     tests.api.test_files
     ~~~~~~~~~~~~~~~~~~~~
 """
+from datetime import datetime, timezone
+from google.api_core import exceptions as api_exceptions
+from io import BytesIO
+from mockfirestore.document import DocumentSnapshot
+from unittest import mock
+from zipfile import ZipFile
+import base64
+import threading
+
+from src.api import files
+from src.common.database import db
 from tests.base import BaseTestCase
+from tests.utils import AppliedBatch
+
+commits: list = []
+deleted: list = []
+
+
+class CountingBatch:
+    """Counts the writes of each commit without applying them"""
+
+    def __init__(self):
+        self.writes = 0
+
+    def set(self, ref, data: dict, merge: bool = False):
+        self.writes += 1
+
+    def update(self, ref, data: dict, option=None):
+        self.writes += 1
+
+    def commit(self):
+        commits.append(self.writes)
+
+
+class DeletingBatch(AppliedBatch):
+    """Records the paths of the documents it deletes"""
+
+    def delete(self, ref, option=None):
+        deleted.append("/".join(ref._path))
+        super().delete(ref, option)
 
 
 class TestFilesBlueprint(BaseTestCase):
@@ -14,12 +53,455 @@ class TestFilesBlueprint(BaseTestCase):
     def test_upload_file(self):
         pass
 
+    def test_upload_file_rejects_unknown_reviewer(self):
+        db.collection("User").document("author").set(
+            {"uid": "author", "name": "Author", "dod": "1"}
+        )
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token"
+        ) as verify, mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(
+            files, "storage"
+        ) as storage:
+            verify.return_value = {"uid": "author"}
+            res = self.client.post(
+                "/files/upload_file",
+                headers={"Authorization": "token"},
+                json={
+                    "file": "JVBERi0=",
+                    "filename": "leave.pdf",
+                    "filetype": "dental_form",
+                    "reviewer": "2",
+                },
+            )
+
+        self.assertEqual(res.status_code, 404)
+        self.assertIn("The reviewer was not found", res.data.decode())
+        self.assertEqual(len(list(db.collection("Files").stream())), 0)
+        storage.bucket.return_value.blob.assert_not_called()
+
     """get_file"""
 
     def test_get_file(self):
-        pass
+        db.collection("User").document("author").set(
+            {"dod": "1", "signature": "signature/s1"}
+        )
+        db.collection("Files").document("f1").set(
+            {"id": "f1", "author": "author", "reviewer": "2"}
+        )
+        # the pdf and the signature metadata are only both fetched when
+        # their requests overlap
+        fetched = threading.Barrier(2, timeout=5)
+        blobs: dict = {
+            "file/f1": mock.Mock(generation=1),
+            "signature/s1": mock.Mock(generation=1),
+        }
+        contents: dict = {
+            id(blobs["file/f1"]): b"pdf",
+            id(blobs["signature/s1"]): b"signature",
+        }
+
+        def get_blob(path: str):
+            fetched.wait()
+            return blobs[path]
+
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token",
+            return_value={"uid": "author"},
+        ), mock.patch.object(files, "storage") as storage, mock.patch.object(
+            files, "blob_cache"
+        ) as blob_cache:
+            storage.bucket.return_value.get_blob.side_effect = get_blob
+            blob_cache.read.side_effect = lambda blob: contents[id(blob)]
+            res = self.client.get(
+                "/files/get_file/f1", headers={"Authorization": "token"}
+            )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json["file"], "pdf")
+        self.assertEqual(res.json["signature"], "signature")
+        self.assertEqual(res.json["author"], "author")
+
+    def test_get_file_propagates_fetch_errors(self):
+        db.collection("User").document("author").set(
+            {"dod": "1", "role": "ara"}
+        )
+        db.collection("Files").document("f1").set(
+            {"id": "f1", "author": "author", "reviewer": "2"}
+        )
+
+        def get_file(get_blob):
+            with mock.patch(
+                "firebase_admin.auth.verify_id_token",
+                return_value={"uid": "author"},
+            ), mock.patch.object(files, "storage") as storage:
+                storage.bucket.return_value.get_blob.side_effect = get_blob
+                return self.client.get(
+                    "/files/get_file/f1", headers={"Authorization": "token"}
+                )
+
+        # a missing pdf is a 404, a failed fetch fails the request
+        res = get_file(lambda path: None)
+        self.assertEqual(res.status_code, 404)
+        self.assertIn("was not found", res.data.decode())
+
+        def unavailable(path: str):
+            raise api_exceptions.ServiceUnavailable("Try again")
+
+        with self.assertLogs("src", "ERROR") as logs:
+            res = get_file(unavailable)
+        self.assertEqual(res.status_code, 500)
+        self.assertIn("ServiceUnavailable", logs.output[0])
+
+    def test_get_file_etag_follows_its_sources(self):
+        db.collection("User").document("author").set(
+            {"dod": "1", "signature": "signature/s1"}
+        )
+        db.collection("Files").document("f1").set(
+            {"id": "f1", "author": "author", "reviewer": "2"}
+        )
+        blobs: dict = {
+            "file/f1": mock.Mock(generation=1),
+            "signature/s1": mock.Mock(generation=1),
+        }
+
+        def get_file(if_none_match: str = None, updated: int = 1):
+            headers: dict = {"Authorization": "token"}
+            if if_none_match:
+                headers["If-None-Match"] = if_none_match
+            with mock.patch(
+                "firebase_admin.auth.verify_id_token",
+                return_value={"uid": "author"},
+            ), mock.patch.object(
+                DocumentSnapshot,
+                "update_time",
+                new_callable=mock.PropertyMock,
+                return_value=datetime(2024, 5, updated, tzinfo=timezone.utc),
+            ), mock.patch.object(
+                files, "storage"
+            ) as storage, mock.patch.object(
+                files, "blob_cache"
+            ) as blob_cache:
+                storage.bucket.return_value.get_blob.side_effect = blobs.get
+                blob_cache.read.return_value = b"content"
+                res = self.client.get("/files/get_file/f1", headers=headers)
+            return res, blob_cache
+
+        res, _ = get_file()
+        self.assertEqual(res.status_code, 200)
+        etag: str = res.headers["ETag"]
+        # the same sources give the same strong ETag
+        self.assertEqual(get_file()[0].headers["ETag"], etag)
+        self.assertFalse(etag.startswith("W/"))
+
+        res, blob_cache = get_file(etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+        self.assertEqual(res.headers["ETag"], etag)
+        blob_cache.read.assert_not_called()
+
+        # a new version of the document or of a blob is a new ETag
+        res, _ = get_file(etag, updated=2)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+        blobs["signature/s1"].generation = 2
+        res, _ = get_file(etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+
+    """download_file"""
+
+    def test_download_honors_if_range_dates(self):
+        db.collection("User").document("author").set({"dod": "1"})
+        db.collection("Files").document("f1").set(
+            {"id": "f1", "author": "author", "reviewer": "2"}
+        )
+        blob = mock.Mock(
+            generation=1,
+            updated=datetime(2024, 5, 1, 12, 30, 15, 250000, timezone.utc),
+            size=8,
+            content_type="application/pdf",
+        )
+        blob.name = "file/f1"
+
+        def read(blob, start: int = None, end: int = None) -> bytes:
+            return b"01234567"[start : None if end is None else end + 1]
+
+        def download(if_range: str):
+            with mock.patch(
+                "firebase_admin.auth.verify_id_token",
+                return_value={"uid": "author"},
+            ), mock.patch.object(
+                files, "storage"
+            ) as storage, mock.patch.object(
+                files, "blob_cache"
+            ) as blob_cache:
+                storage.bucket.return_value.get_blob.return_value = blob
+                blob_cache.read.side_effect = read
+                return self.client.get(
+                    "/files/download_file/f1",
+                    headers={
+                        "Authorization": "token",
+                        "Range": "bytes=0-3",
+                        "If-Range": if_range,
+                    },
+                )
+
+        # the date the file was last modified, to the second
+        res = download("Wed, 01 May 2024 12:30:15 GMT")
+        self.assertEqual(res.status_code, 206)
+        self.assertEqual(res.data, b"0123")
+        self.assertEqual(
+            res.headers["Last-Modified"], "Wed, 01 May 2024 12:30:15 GMT"
+        )
+
+        # any other date names another version, even a later one
+        for if_range in (
+            "Wed, 01 May 2024 12:30:14 GMT",
+            "Wed, 01 May 2024 12:30:16 GMT",
+        ):
+            res = download(if_range)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.data, b"01234567")
+
+    """export_approved"""
+
+    def test_export_lists_the_missing_pdfs(self):
+        db.collection("User").document("ara").set({"role": "ara"})
+        for file_id, filename in (("f1", "leave"), ("f2", "gone.pdf")):
+            db.collection("Files").document(file_id).set(
+                {"filetype": "1380_form", "filename": filename, "status": 4}
+            )
+
+        def blob(path: str):
+            stored = mock.Mock()
+            if path == "file/f1":
+                stored.download_as_bytes.return_value = base64.b64encode(
+                    b"%PDF-1"
+                )
+            else:
+                stored.download_as_bytes.side_effect = api_exceptions.NotFound(
+                    "No such object"
+                )
+            return stored
+
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token",
+            return_value={"uid": "ara"},
+        ), mock.patch.object(
+            files.APPROVED_FILES,
+            "stream",
+            return_value=db.collection("Files").stream(),
+        ), mock.patch.object(
+            files, "storage"
+        ) as storage:
+            storage.bucket.return_value.blob.side_effect = blob
+            res = self.client.get(
+                "/files/export_approved", headers={"Authorization": "token"}
+            )
+
+        self.assertEqual(res.status_code, 200)
+        archive = ZipFile(BytesIO(res.data))
+        self.assertEqual(
+            archive.namelist(), ["1380_form/leave.pdf", files.EXPORT_ERRORS]
+        )
+        self.assertEqual(archive.read("1380_form/leave.pdf"), b"%PDF-1")
+        errors = archive.read(files.EXPORT_ERRORS).decode().splitlines()
+        self.assertEqual(errors[0], "file_id\tname\terror")
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[1].startswith("f2\t1380_form/gone.pdf\t404"))
+
+    def test_download_etag_follows_the_blob_generation(self):
+        db.collection("User").document("author").set({"dod": "1"})
+        db.collection("Files").document("f1").set(
+            {"id": "f1", "author": "author", "reviewer": "2"}
+        )
+        blob = mock.Mock(
+            generation=1,
+            updated=datetime(2024, 5, 1, tzinfo=timezone.utc),
+            size=4,
+            content_type="application/pdf",
+        )
+        blob.name = "file/f1"
+
+        def download(if_none_match: str = None):
+            headers: dict = {"Authorization": "token"}
+            if if_none_match:
+                headers["If-None-Match"] = if_none_match
+            with mock.patch(
+                "firebase_admin.auth.verify_id_token",
+                return_value={"uid": "author"},
+            ), mock.patch.object(
+                files, "storage"
+            ) as storage, mock.patch.object(
+                files, "blob_cache"
+            ) as blob_cache:
+                storage.bucket.return_value.get_blob.return_value = blob
+                blob_cache.read.return_value = b"0123"
+                res = self.client.get(
+                    "/files/download_file/f1", headers=headers
+                )
+            return res, blob_cache
+
+        res, _ = download()
+        self.assertEqual(res.status_code, 200)
+        etag: str = res.headers["ETag"]
+        self.assertEqual(download()[0].headers["ETag"], etag)
+
+        res, blob_cache = download(etag)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+        blob_cache.read.assert_not_called()
+
+        # an overwritten pdf is a new ETag
+        blob.generation = 2
+        res, _ = download(etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
 
     """delete_file"""
 
     def test_delete_file(self):
-        pass
+        deleted.clear()
+        db.collection("Files").document("f1").set(
+            {"id": "f1", "author": "author", "status": 1}
+        )
+        file_ref = db.collection("Files").document("f1")
+        for i in range(3):
+            file_ref.collection("history").document(str(i)).set({"id": str(i)})
+
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token",
+            return_value={"uid": "author"},
+        ), mock.patch.object(
+            db, "batch", DeletingBatch, create=True
+        ), mock.patch.object(
+            files, "storage"
+        ):
+            res = self.client.delete(
+                "/files/delete_file/f1", headers={"Authorization": "token"}
+            )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(db.collection("Files").document("f1").get().exists)
+        # the history goes with the file, which the mock does on its own
+        self.assertEqual(
+            sorted(deleted),
+            [
+                "Files/f1",
+                "Files/f1/history/0",
+                "Files/f1/history/1",
+                "Files/f1/history/2",
+            ],
+        )
+
+    """review_files_bulk"""
+
+    def test_bulk_reviews_fit_in_batches(self):
+        db.collection("User").document("reviewer").set(
+            {"uid": "reviewer", "dod": "1", "name": "Reviewer"}
+        )
+        reviews = []
+        for i in range(files.MAX_BULK_REVIEWS):
+            db.collection("Files").document(str(i)).set(
+                {
+                    "id": str(i),
+                    "author": "author",
+                    "reviewer": "1",
+                    "recommender": "2",
+                    "filetype": "1380",
+                    "status": 2,
+                }
+            )
+            reviews.append({"file_id": str(i), "decision": 4})
+
+        commits.clear()
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token",
+            return_value={"uid": "reviewer"},
+        ), mock.patch.object(
+            db, "batch", CountingBatch, create=True
+        ), mock.patch.object(
+            db, "write_option", create=True
+        ), mock.patch.object(
+            files, "storage"
+        ), mock.patch.object(
+            files.outbox, "dispatch"
+        ) as dispatch:
+            res = self.client.put(
+                "/files/review_files_bulk",
+                headers={"Authorization": "token"},
+                json={"reviews": reviews},
+            )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            sum(commits), files.MAX_BULK_REVIEWS * files.REVIEW_WRITES
+        )
+        self.assertLessEqual(max(commits), 500)
+        # the notifications were staged with the reviews
+        entries = dispatch.call_args.args
+        self.assertEqual(len(entries), files.MAX_BULK_REVIEWS)
+        self.assertEqual(
+            {entry["task"] for entry in entries},
+            {files.outbox.task_name(files.create_notifications)},
+        )
+
+    def test_bulk_reviews_skip_the_files_whose_pdf_failed(self):
+        db.collection("User").document("reviewer").set(
+            {"uid": "reviewer", "dod": "1", "name": "Reviewer"}
+        )
+        for file_id in ("saved", "failed"):
+            db.collection("Files").document(file_id).set(
+                {
+                    "id": file_id,
+                    "author": "author",
+                    "reviewer": "1",
+                    "status": 2,
+                }
+            )
+
+        def blob(path: str):
+            stored = mock.Mock()
+            if path == "file/failed":
+                stored.upload_from_string.side_effect = (
+                    api_exceptions.ServiceUnavailable("Try again")
+                )
+            return stored
+
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token",
+            return_value={"uid": "reviewer"},
+        ), mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(
+            db, "write_option", create=True
+        ), mock.patch.object(
+            files, "storage"
+        ) as storage, mock.patch.object(
+            files.outbox, "dispatch"
+        ):
+            storage.bucket.return_value.blob.side_effect = blob
+            res = self.client.put(
+                "/files/review_files_bulk",
+                headers={"Authorization": "token"},
+                json={
+                    "reviews": [
+                        {"file_id": file_id, "decision": 4, "file": "JVBE"}
+                        for file_id in ("saved", "failed")
+                    ]
+                },
+            )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [(result["file_id"], result["status"]) for result in res.json],
+            [("saved", 200), ("failed", 500)],
+        )
+        # the file whose pdf was not saved is left unreviewed
+        status = {
+            doc.id: doc.to_dict()["status"]
+            for doc in db.collection("Files").stream()
+        }
+        self.assertEqual(status, {"saved": 4, "failed": 2})
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*
+"""
+    tests.api.test_notifications
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from datetime import datetime, timezone
+from unittest import mock
+
+from src.api import notifications
+from src.common.database import db
+from tests.base import BaseTestCase
+from tests.utils import AppliedBatch
+
+
+class TestNotificationsBlueprint(BaseTestCase):
+    """Tests for notifications endpoints"""
+
+    def test_receivers_are_notified_in_bulk(self):
+        for uid, dod in [("by-uid", "1"), ("by-dod", "2")]:
+            db.collection("User").document(uid).set({"uid": uid, "dod": dod})
+
+        with mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(
+            notifications, "NOTIFICATION_WINDOW_SECONDS", 0
+        ), mock.patch.object(
+            notifications, "send_to_users"
+        ) as send:
+            uids = notifications.create_notifications(
+                "file approved",
+                "1380",
+                "sender",
+                "file-id",
+                receivers=[
+                    {"uid": "by-uid"},
+                    {"dod": "2"},
+                    {"dod": "2"},
+                    {"dod": "missing"},
+                ],
+            )
+
+        self.assertEqual(sorted(uids), ["by-dod", "by-uid"])
+        receivers = [
+            doc.to_dict()["receiver"]
+            for doc in db.collection("Notification").stream()
+        ]
+        self.assertEqual(sorted(receivers), ["by-dod", "by-uid"])
+        send.assert_called_once_with(uids, mock.ANY)
+
+    def test_notifications_in_a_window_share_a_document(self):
+        db.collection("User").document("uid").set({"uid": "uid"})
+        with mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(
+            notifications, "_window", return_value=42
+        ), mock.patch.object(
+            notifications, "scheduler"
+        ) as scheduler:
+            notifications.create_notifications(
+                "file uploaded",
+                "1380",
+                "sender",
+                "file-id",
+                receivers=[{"uid": "uid"}],
+            )
+
+        subject = ("file uploaded", "1380", "file-id")
+        self.assertEqual(
+            [doc.id for doc in db.collection("Notification").stream()],
+            [notifications.coalescing_key(42, *subject, "uid")],
+        )
+        # the digest job is the same for every notification in the window
+        self.assertEqual(
+            scheduler.schedule.call_args.kwargs["job_id"],
+            notifications.coalescing_key(42, *subject),
+        )
+        self.assertNotEqual(
+            notifications.coalescing_key(42, *subject),
+            notifications.coalescing_key(43, *subject),
+        )
+
+    def test_the_unread_count_follows_the_notifications(self):
+        db.collection("User").document("uid").set({"uid": "uid"})
+        counter = db.collection("Unread-Counts").document("uid")
+        counter.set({"unread": 0})
+        with mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(notifications, "NOTIFICATION_WINDOW_SECONDS", 0):
+            for id in ["first", "second"]:
+                notifications.create_notifications(
+                    "event updated", "drill", "sender", id, [{"uid": "uid"}]
+                )
+        self.assertEqual(counter.get().to_dict()["unread"], 2)
+
+        first, second = [
+            db.collection("Notification").document(doc.id)
+            for doc in db.collection("Notification").stream()
+        ]
+        self.assertIsNone(
+            notifications._mark_read(db.transaction(), first, "uid")
+        )
+        self.assertIsNotNone(
+            notifications._mark_read(db.transaction(), first, "uid")
+        )
+        self.assertIsNotNone(
+            notifications._delete(db.transaction(), second, "other")
+        )
+        self.assertEqual(counter.get().to_dict()["unread"], 1)
+
+        # only unread notifications count down when deleted
+        notifications._delete(db.transaction(), first, "uid")
+        notifications._delete(db.transaction(), second, "uid")
+        self.assertEqual(counter.get().to_dict()["unread"], 0)
+
+    def test_notifications_are_read_and_deleted_in_bulk(self):
+        notifications_ref = db.collection("Notification")
+        for id, receiver, read, day in [
+            ("unread", "uid", False, 2),
+            ("read", "uid", True, 1),
+            ("other", "someone else", False, 1),
+        ]:
+            notifications_ref.document(id).set(
+                {
+                    "notification_id": id,
+                    "receiver": receiver,
+                    "read": read,
+                    "timestamp": datetime(2020, 1, day, tzinfo=timezone.utc),
+                }
+            )
+        counter = db.collection("Unread-Counts").document("uid")
+        counter.set({"unread": 1})
+
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token",
+            return_value={"uid": "uid"},
+        ), mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(
+            db, "write_option", create=True
+        ):
+            res = self.client.put(
+                "/notifications/read_all",
+                headers={"Authorization": "token"},
+                json={"notification_ids": ["unread", "other", "missing"]},
+            )
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.json["changed"], 1)
+            self.assertEqual(sorted(res.json["skipped"]), ["missing", "other"])
+            self.assertTrue(
+                notifications_ref.document("unread").get().get("read")
+            )
+            self.assertEqual(counter.get().to_dict()["unread"], 0)
+
+            res = self.client.delete(
+                "/notifications/delete_many",
+                headers={"Authorization": "token"},
+                json={},
+            )
+            self.assertEqual(res.status_code, 400)
+
+            res = self.client.delete(
+                "/notifications/delete_many",
+                headers={"Authorization": "token"},
+                json={"older_than": "2020-01-01T12:00:00"},
+            )
+            self.assertEqual(res.json["changed"], 1)
+            self.assertFalse(notifications_ref.document("read").get().exists)
+
+            res = self.client.delete(
+                "/notifications/delete_many",
+                headers={"Authorization": "token"},
+                json={"read": True},
+            )
+            self.assertEqual(res.json["changed"], 1)
+        remaining = [
+            id
+            for id in ["unread", "read", "other"]
+            if db.collection("Notification").document(id).get().exists
+        ]
+        self.assertEqual(remaining, ["other"])
+
+    def test_coalesced_notifications_count_once_while_unread(self):
+        db.collection("User").document("uid").set({"uid": "uid"})
+        counter = db.collection("Unread-Counts").document("uid")
+        counter.set({"unread": 0})
+
+        def notify():
+            notifications.create_notifications(
+                "event updated", "drill", "sender", "e1", [{"uid": "uid"}]
+            )
+
+        with mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(
+            db, "write_option", create=True
+        ), mock.patch.object(
+            notifications, "_window", return_value=42
+        ):
+            notify()
+            notify()
+            self.assertEqual(counter.get().to_dict()["unread"], 1)
+
+            (doc,) = db.collection("Notification").stream()
+            notifications._mark_read(
+                db.transaction(),
+                db.collection("Notification").document(doc.id),
+                "uid",
+            )
+            # a read notification is unread again
+            notify()
+
+        notification = db.collection("Notification").document(doc.id).get()
+        self.assertEqual(notification.to_dict()["count"], 3)
+        self.assertFalse(notification.to_dict()["read"])
+        self.assertEqual(counter.get().to_dict()["unread"], 1)
+
+    def test_notifications_changed_meanwhile_are_written_again(self):
+        db.collection("User").document("uid").set({"uid": "uid"})
+        counter = db.collection("Unread-Counts").document("uid")
+        counter.set({"unread": 0})
+        commits = []
+
+        class ConflictingBatch(AppliedBatch):
+            def commit(self):
+                commits.append(self)
+                # another writer got there between the read and the write
+                if len(commits) == 1:
+                    raise notifications.api_exceptions.FailedPrecondition(
+                        "changed"
+                    )
+                super().commit()
+
+        with mock.patch.object(
+            db, "batch", ConflictingBatch, create=True
+        ), mock.patch.object(notifications, "NOTIFICATION_WINDOW_SECONDS", 0):
+            notifications.create_notifications(
+                "event updated", "drill", "sender", "e1", [{"uid": "uid"}]
+            )
+
+        self.assertEqual(len(commits), 2)
+        self.assertEqual(counter.get().to_dict()["unread"], 1)
+
+    def test_notifications_read_meanwhile_are_not_counted_again(self):
+        notifications_ref = db.collection("Notification")
+        for id in ["a", "b"]:
+            notifications_ref.document(id).set(
+                {"notification_id": id, "receiver": "uid", "read": False}
+            )
+        counter = db.collection("Unread-Counts").document("uid")
+        counter.set({"unread": 2})
+        commits = []
+
+        class ConflictingBatch(AppliedBatch):
+            def commit(self):
+                commits.append(self)
+                # "a" is read by another request before this commits
+                if len(commits) == 1:
+                    notifications_ref.document("a").update({"read": True})
+                    counter.update({"unread": 1})
+                    raise notifications.api_exceptions.FailedPrecondition(
+                        "changed"
+                    )
+                super().commit()
+
+        with mock.patch(
+            "firebase_admin.auth.verify_id_token",
+            return_value={"uid": "uid"},
+        ), mock.patch.object(
+            db, "batch", ConflictingBatch, create=True
+        ), mock.patch.object(
+            db, "write_option", create=True
+        ):
+            res = self.client.put(
+                "/notifications/read_all",
+                headers={"Authorization": "token"},
+                json={"notification_ids": ["a", "b"]},
+            )
+
+        self.assertEqual(res.json["changed"], 1)
+        self.assertEqual(counter.get().to_dict()["unread"], 0)
@@ -3,10 +3,60 @@
     tests.api.test_users
     ~~~~~~~~~~~~~~~~~~~~
 """
+from datetime import datetime, timezone
+from mockfirestore.document import DocumentSnapshot
+from unittest import mock
+
+from src.api import users
+from src.common.database import db
 from tests.base import BaseTestCase
 
 
 class TestUsersBlueprint(BaseTestCase):
     """Tests for users endpoints"""
 
-    pass
+    """get_user"""
+
+    def test_get_user_etag_follows_its_sources(self):
+        db.collection("User").document("user").set(
+            {"name": "User", "profile_picture": "profile_picture/p1"}
+        )
+        picture = mock.Mock(generation=1)
+
+        def get_user(if_none_match: str = None):
+            headers: dict = {"Authorization": "token"}
+            if if_none_match:
+                headers["If-None-Match"] = if_none_match
+            with mock.patch(
+                "firebase_admin.auth.verify_id_token",
+                return_value={"uid": "user"},
+            ), mock.patch.object(
+                DocumentSnapshot,
+                "update_time",
+                new_callable=mock.PropertyMock,
+                return_value=datetime(2024, 5, 1, tzinfo=timezone.utc),
+            ), mock.patch.object(
+                users, "storage"
+            ) as storage, mock.patch.object(
+                users, "blob_cache"
+            ) as blob_cache:
+                storage.bucket.return_value.get_blob.return_value = picture
+                blob_cache.read.return_value = b"picture"
+                res = self.client.get("/users/get_user", headers=headers)
+            return res, blob_cache
+
+        res, _ = get_user()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json["profile_picture"], "picture")
+        etag: str = res.headers["ETag"]
+        self.assertEqual(get_user()[0].headers["ETag"], etag)
+
+        res, blob_cache = get_user(etag)
+        self.assertEqual(res.status_code, 304)
+        blob_cache.read.assert_not_called()
+
+        # a new profile picture is a new ETag
+        picture.generation = 2
+        res, _ = get_user(etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
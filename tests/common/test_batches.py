@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_batches
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from unittest import TestCase, mock
+
+from src.common.batches import ChunkedBatch
+from src.common.database import db
+
+commits: list = []
+
+
+class RecordingBatch:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, ref, data: dict, merge: bool = False):
+        self.writes.append(ref)
+
+    def delete(self, ref):
+        self.writes.append(ref)
+
+    def commit(self):
+        commits.append(self.writes)
+
+
+class TestChunkedBatch(TestCase):
+    """Tests for the chunked write batches"""
+
+    def setUp(self):
+        commits.clear()
+        patcher = mock.patch.object(db, "batch", RecordingBatch, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_writes_are_committed_in_chunks(self):
+        batch = ChunkedBatch(size=3)
+        for i in range(7):
+            batch.delete(i)
+        batch.commit()
+        batch.commit()
+
+        self.assertEqual(commits, [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(batch.committed, 7)
+
+    def test_reserved_writes_share_a_chunk(self):
+        batch = ChunkedBatch(size=3)
+        batch.set("a", {})
+        batch.set("b", {})
+        batch.reserve(2)
+        batch.set("c", {})
+        batch.delete("d")
+        batch.commit()
+
+        self.assertEqual(commits, [["a", "b"], ["c", "d"]])
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_blob_cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+import os
+import subprocess
+import tempfile
+import time
+from unittest import TestCase
+
+from src.common.blob_cache import BlobCache
+
+
+class FakeBlob:
+    def __init__(self, name: str, generation: int, content: bytes):
+        self.name = name
+        self.generation = generation
+        self.content = content
+        self.downloads = 0
+
+    def download_as_bytes(self, start: int = None, end: int = None) -> bytes:
+        self.downloads += 1
+        return self.content[start : None if end is None else end + 1]
+
+
+class TestBlobCache(TestCase):
+    """Tests for the on-disk blob cache"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = BlobCache(self.directory, max_bytes=10)
+
+    def test_repeat_reads_are_served_from_disk(self):
+        blob = FakeBlob("file/a", 1, b"abcd")
+
+        self.assertEqual(self.cache.read(blob), b"abcd")
+        self.assertEqual(self.cache.read(blob), b"abcd")
+        self.assertEqual(self.cache.read(blob, start=1, end=2), b"bc")
+
+        self.assertEqual(blob.downloads, 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_uncached_range_is_read_by_itself(self):
+        blob = FakeBlob("file/a", 1, b"abcd")
+
+        self.assertEqual(self.cache.read(blob, start=1, end=2), b"bc")
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+        self.assertEqual(self.cache.read(blob), b"abcd")
+        self.assertEqual(self.cache.read(blob, start=1, end=2), b"bc")
+        self.assertEqual(blob.downloads, 2)
+
+    def test_stats_sum_the_live_workers(self):
+        self.cache.read(FakeBlob("file/a", 1, b"abcd"))
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        for pid, counts in ((os.getppid(), "3 1"), (exited.pid, "5 5")):
+            path = os.path.join(self.directory, ".stats-%d" % pid)
+            with open(path, "w") as stats_file:
+                stats_file.write(counts)
+
+        stats = self.cache.stats()
+
+        self.assertEqual(
+            stats["workers"],
+            {
+                str(os.getpid()): {"hits": 0, "misses": 1},
+                str(os.getppid()): {"hits": 3, "misses": 1},
+            },
+        )
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 2))
+        self.assertEqual(stats["hit_ratio"], 0.6)
+        self.assertEqual(stats["entries"], 1)
+        # the counts of the exited worker are dropped
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(self.directory, ".stats-%d" % exited.pid)
+            )
+        )
+
+    def test_new_generation_is_a_miss(self):
+        self.cache.read(FakeBlob("file/a", 1, b"old"))
+        blob = FakeBlob("file/a", 2, b"new")
+
+        self.assertEqual(self.cache.read(blob), b"new")
+        self.assertEqual(blob.downloads, 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        first = FakeBlob("file/a", 1, b"aaaa")
+        second = FakeBlob("file/b", 1, b"bbbb")
+        self.cache.read(first)
+        self.cache.read(second)
+
+        # make the first entry the most recently used one
+        past = time.time() - 60
+        os.utime(self.cache._entry_path("file/b", 1), (past, past))
+        self.cache.read(first)
+
+        self.cache.read(FakeBlob("file/c", 1, b"cccc"))
+
+        self.assertLessEqual(self.cache.stats()["bytes"], 10)
+        self.cache.read(first)
+        self.assertEqual(first.downloads, 1)
+        self.cache.read(second)
+        self.assertEqual(second.downloads, 2)
+
+    def test_temporary_files_of_dead_workers_are_swept(self):
+        stale = os.path.join(self.directory, ".tmp-stale")
+        writing = os.path.join(self.directory, ".tmp-writing")
+        for path in (stale, writing):
+            open(path, "wb").close()
+        past = time.time() - 2 * 60 * 60
+        os.utime(stale, (past, past))
+
+        BlobCache(self.directory, max_bytes=10)
+
+        self.assertFalse(os.path.exists(stale))
+        # a live worker may still be writing the recent one
+        self.assertTrue(os.path.exists(writing))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_device_tokens
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from unittest import TestCase, mock
+
+from src.common import device_tokens
+from src.common.database import db
+from src.common.device_tokens import DEVICES, TokenCache
+from tests.utils import CollectionGroup
+
+
+class TestDeviceTokens(TestCase):
+    """Tests for the FCM token registry"""
+
+    def setUp(self):
+        db.reset()
+        patcher = mock.patch.object(
+            db,
+            "collection_group",
+            lambda name: CollectionGroup("User", name),
+            create=True,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(db.reset)
+
+    def test_every_device_of_the_users_is_pushed_once(self):
+        device_tokens.register("phone-owner", "phone")
+        device_tokens.register("phone-owner", "tablet")
+        device_tokens.register("shared-owner", "tablet")
+        # registering again only refreshes the device
+        device_tokens.register("phone-owner", "phone")
+
+        tokens = device_tokens.tokens_for(
+            ["phone-owner", "shared-owner", None]
+        )
+
+        self.assertEqual(sorted(tokens), ["phone", "tablet"])
+
+    def test_a_device_belongs_to_the_user_signed_in_last(self):
+        device_tokens.register("first", "shared phone")
+        self.assertEqual(device_tokens.tokens_for(["first"]), ["shared phone"])
+
+        device_tokens.register("second", "shared phone")
+
+        self.assertEqual(device_tokens.tokens_for(["first"]), [])
+        self.assertEqual(
+            device_tokens.tokens_for(["second"]), ["shared phone"]
+        )
+        self.assertEqual(len(list(db.collection_group(DEVICES).stream())), 1)
+
+    def test_unregistered_devices_leave_the_cache(self):
+        device_tokens.register("leaving", "old phone")
+        self.assertEqual(device_tokens.tokens_for(["leaving"]), ["old phone"])
+
+        device_tokens.unregister("leaving", "old phone")
+
+        self.assertEqual(device_tokens.tokens_for(["leaving"]), [])
+
+    def test_cache_evicts_the_least_recently_used_user(self):
+        cache = TokenCache(max_users=2, ttl=60)
+        cache.put("a", ("1",))
+        cache.put("b", ("2",))
+        cache.get("a")
+        cache.put("c", ("3",))
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), ("1",))
+
+    def test_cache_entries_expire(self):
+        cache = TokenCache(max_users=2, ttl=-1)
+        cache.put("a", ("1",))
+
+        self.assertIsNone(cache.get("a"))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_file_counters
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from unittest import TestCase, mock
+
+from src.common import file_counters
+from src.common.database import db
+from src.common.file_counters import (
+    FILE_COUNTS,
+    INBOXES,
+    get_counts,
+    stage_counts,
+)
+
+
+class RecordingBatch:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, ref, data: dict, merge: bool = False):
+        self.writes.append((ref.id, data))
+
+
+def steps(batch: RecordingBatch) -> dict:
+    # {(document, role, filetype, status): increment}
+    found: dict = dict()
+    for user, data in batch.writes:
+        for role, filetypes in data.items():
+            for filetype, statuses in filetypes.items():
+                for status, increment in statuses.items():
+                    found[(user, role, filetype, status)] = increment.value
+    return found
+
+
+class TestFileCounters(TestCase):
+    """Tests for the file counters"""
+
+    def test_upload_counts_for_every_role(self):
+        batch = RecordingBatch()
+        file = {
+            "author": "u1",
+            "filetype": "rst_request",
+            "status": 1,
+            "reviewer": "100",
+            "recommender": "200",
+        }
+
+        stage_counts(batch, None, file)
+
+        self.assertEqual(
+            steps(batch),
+            {
+                ("u1", "author", "rst_request", "1"): 1,
+                ("100", "reviewer", "rst_request", "1"): 1,
+                ("200", "recommender", "rst_request", "1"): 1,
+            },
+        )
+
+    def test_transition_moves_the_file_between_statuses(self):
+        batch = RecordingBatch()
+        before = {"filetype": "1380_form", "status": 1, "reviewer": "100"}
+
+        stage_counts(batch, before, {**before, "status": 4})
+
+        self.assertEqual(
+            steps(batch),
+            {
+                ("100", "reviewer", "1380_form", "1"): -1,
+                ("100", "reviewer", "1380_form", "4"): 1,
+            },
+        )
+
+    def test_unchanged_counters_are_not_written(self):
+        batch = RecordingBatch()
+        file = {"filetype": "1380_form", "status": 1, "reviewer": "100"}
+
+        stage_counts(batch, file, {**file, "filename": "renamed"})
+
+        self.assertEqual(batch.writes, [])
+
+    def test_counts_by_status_skip_empty_counters(self):
+        counters = {
+            "reviewer": {
+                "rst_request": {"1": 2, "4": 0},
+                "1380_form": {"1": 1},
+            }
+        }
+
+        self.assertEqual(
+            get_counts(counters, "reviewer"),
+            {
+                "status": {"1": 3},
+                "filetype": {"rst_request": {"1": 2}, "1380_form": {"1": 1}},
+            },
+        )
+        self.assertEqual(
+            get_counts(counters, "recommender"),
+            {"status": {}, "filetype": {}},
+        )
+
+    def test_drifted_counters_are_recounted_in_a_transaction(self):
+        db.reset()
+        self.addCleanup(db.reset)
+        file = {"author": "u1", "filetype": "rst_request", "status": 1}
+        db.collection("Files").document("f1").set({**file, "reviewer": "100"})
+        db.collection(FILE_COUNTS).document("u1").set(
+            {"author": {"rst_request": {"1": 5}}}
+        )
+        db.collection(INBOXES).document("gone").set(
+            {"reviewer": {"rst_request": {"1": 1}}}
+        )
+        transaction = db.transaction
+
+        def upload_meanwhile():
+            # a file uploaded after the scan is counted by the repair
+            db.collection("Files").document("f2").set(file)
+            return transaction()
+
+        with mock.patch.object(db, "transaction", upload_meanwhile):
+            self.assertEqual(file_counters.reconcile(), 3)
+
+        counts = {
+            doc.id: doc.to_dict()
+            for collection in (FILE_COUNTS, INBOXES)
+            for doc in db.collection(collection).stream()
+        }
+        self.assertEqual(counts["u1"], {"author": {"rst_request": {"1": 2}}})
+        self.assertEqual(counts["100"]["reviewer"], {"rst_request": {"1": 1}})
+        self.assertEqual(counts["gone"]["reviewer"], {"rst_request": {"1": 0}})
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_file_states
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from unittest import TestCase
+from werkzeug.exceptions import BadRequest
+
+from src.common import file_history
+from src.common.file_states import (
+    APPROVED,
+    PENDING,
+    REJECTED,
+    RESUBMIT,
+    SUBMITTED,
+    check_transition,
+)
+
+
+class TestFileStates(TestCase):
+    """Tests for the file status transitions"""
+
+    def test_review_decides_open_files(self):
+        for current in (SUBMITTED, PENDING, RESUBMIT):
+            for decision in (RESUBMIT, APPROVED, REJECTED):
+                self.assertIsNone(
+                    check_transition(file_history.REVIEW, current, decision)
+                )
+
+    def test_decided_files_are_final(self):
+        for action, status in (
+            (file_history.UPDATE, None),
+            (file_history.RECOMMEND, PENDING),
+            (file_history.REVIEW, APPROVED),
+        ):
+            for current in (APPROVED, REJECTED):
+                self.assertIsInstance(
+                    check_transition(action, current, status), BadRequest
+                )
+
+    def test_actions_only_lead_to_their_statuses(self):
+        self.assertIsInstance(
+            check_transition(file_history.REVIEW, SUBMITTED, PENDING),
+            BadRequest,
+        )
+        self.assertIsInstance(
+            check_transition(file_history.RECOMMEND, SUBMITTED, APPROVED),
+            BadRequest,
+        )
+        self.assertIsInstance(
+            check_transition(file_history.UPDATE, SUBMITTED, APPROVED),
+            BadRequest,
+        )
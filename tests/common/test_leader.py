@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_leader
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from datetime import timedelta
+from unittest import TestCase
+
+from src.common.database import db
+from src.common.leader import LEASES, Lease, _now
+
+
+class TestLease(TestCase):
+    """Tests for the leader election lease"""
+
+    def setUp(self):
+        db.collection(LEASES).document("test").delete()
+        self.leader = Lease("test")
+        self.follower = Lease("test")
+
+    def test_a_single_process_holds_the_lease(self):
+        self.assertTrue(self.leader.acquire())
+        self.assertFalse(self.follower.acquire())
+
+        # renewing keeps the token
+        token = self.leader.token
+        self.assertTrue(self.leader.acquire())
+        self.assertEqual(self.leader.token, token)
+        self.assertTrue(self.leader.held)
+        self.assertFalse(self.follower.held)
+
+    def test_an_expired_lease_is_taken_over_with_a_new_token(self):
+        self.leader.acquire()
+        db.collection(LEASES).document("test").update(
+            {"expires_at": _now() - timedelta(seconds=1)}
+        )
+
+        self.assertTrue(self.follower.acquire())
+        self.assertEqual(self.follower.token, self.leader.token + 1)
+
+        # the deposed leader is fenced off
+        self.assertFalse(self.leader.check(db.transaction()))
+        self.assertTrue(self.follower.check(db.transaction()))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_migrations
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from datetime import datetime, timezone
+from firebase_admin import firestore
+from unittest import TestCase, mock
+
+from src.common import file_history, migrations
+from src.common.database import db
+from tests.utils import AppliedBatch
+
+
+class TestMigrations(TestCase):
+    """Tests for the data migrations"""
+
+    def setUp(self):
+        db.reset()
+
+    def tearDown(self):
+        db.reset()
+
+    def test_backfill_covers_files_without_timestamps(self):
+        uploaded = datetime(2022, 3, 1, tzinfo=timezone.utc)
+        changed = datetime(2022, 3, 2, tzinfo=timezone.utc)
+        db.collection("Files").document("stamped").set(
+            {"timestamp": [changed, uploaded]}
+        )
+        db.collection("Files").document("uploaded").set({"timestamp": []})
+        db.collection("Files").document("lost").set({"filename": "lost.pdf"})
+        db.collection("Files").document("done").set({"created_at": changed})
+
+        def get_blob(name: str):
+            if name != "file/uploaded":
+                return None
+            return mock.Mock(time_created=uploaded, updated=changed)
+
+        with mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(migrations, "storage") as storage:
+            storage.bucket.return_value.get_blob.side_effect = get_blob
+            updated = migrations.backfill_file_timestamps()
+
+        self.assertEqual(updated, 3)
+        files = {
+            doc.id: doc.to_dict() for doc in db.collection("Files").stream()
+        }
+        for file_id in ("stamped", "uploaded"):
+            self.assertEqual(files[file_id]["created_at"], uploaded)
+            self.assertEqual(files[file_id]["updated_at"], changed)
+        # a file with neither gets the time of the migration
+        self.assertIs(files["lost"]["created_at"], firestore.SERVER_TIMESTAMP)
+        self.assertEqual(files["done"], {"created_at": changed})
+
+    def test_history_of_drifted_arrays_is_legacy(self):
+        times: list = [
+            datetime(2022, 3, day, tzinfo=timezone.utc) for day in (1, 2, 3)
+        ]
+        db.collection("Files").document("paired").set(
+            {
+                "timestamp": times[:2],
+                "timestamp_string": ["File Upload", "File Reviewed"],
+            }
+        )
+        # the second "File Update" label was dropped by ArrayUnion
+        db.collection("Files").document("drifted").set(
+            {
+                "timestamp": times,
+                "timestamp_string": ["File Upload", "File Update"],
+            }
+        )
+
+        with mock.patch.object(db, "batch", AppliedBatch, create=True):
+            migrated = migrations.move_file_timestamps_to_history()
+
+        self.assertEqual(migrated, 2)
+
+        def history(file_id: str) -> list:
+            entries = (
+                db.collection("Files")
+                .document(file_id)
+                .collection("history")
+                .stream()
+            )
+            return sorted(
+                (entry.get("timestamp"), entry.get("action"))
+                for entry in entries
+            )
+
+        self.assertEqual(
+            history("paired"),
+            [(times[0], file_history.UPLOAD), (times[1], file_history.REVIEW)],
+        )
+        self.assertEqual(
+            history("drifted"), [(time, file_history.LEGACY) for time in times]
+        )
+        drifted: dict = db.collection("Files").document("drifted").get()
+        self.assertNotIn("timestamp", drifted.to_dict())
+        self.assertEqual(drifted.get("created_at"), times[0])
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_notifications
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from datetime import datetime, timedelta, timezone
+from firebase_admin import exceptions, messaging
+from threading import Lock
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from src.common import notifications, outbox
+from src.common.database import db
+from tests.utils import AppliedBatch
+
+
+class FakeFCM:
+    """Stands in for FCM, failing the tokens it was told to"""
+
+    def __init__(self, unavailable: int = 0, errors: dict = None):
+        # how many times each token is unavailable before it is delivered
+        self.unavailable: int = unavailable
+        self.errors: dict = errors or dict()
+        self.calls: list = []
+        self.attempts: dict = dict()
+        self.lock: Lock = Lock()
+
+    def send_each_for_multicast(self, message):
+        responses: list = []
+        with self.lock:
+            self.calls.append(list(message.tokens))
+            for token in message.tokens:
+                self.attempts[token] = self.attempts.get(token, 0) + 1
+                error = self.errors.get(token)
+                if error is None and self.attempts[token] <= self.unavailable:
+                    error = exceptions.UnavailableError("Try again")
+                responses.append(
+                    SimpleNamespace(success=error is None, exception=error)
+                )
+        return SimpleNamespace(responses=responses)
+
+
+class TestPush(TestCase):
+    """Tests for the FCM dispatcher"""
+
+    def push(self, fcm: FakeFCM, tokens: list) -> dict:
+        with mock.patch.object(
+            messaging,
+            "send_each_for_multicast",
+            fcm.send_each_for_multicast,
+            create=True,
+        ), mock.patch.object(
+            notifications, "FCM_BACKOFF_SECONDS", 0
+        ), mock.patch.object(
+            notifications.device_tokens, "prune"
+        ) as prune:
+            results = notifications.push(tokens, {"title": "test"})
+        self.pruned = prune.call_args[0][0] if prune.called else None
+        return results
+
+    def test_tokens_are_filtered_deduplicated_and_chunked(self):
+        fcm = FakeFCM()
+        tokens = ["token %d" % i for i in range(1200)]
+
+        results = self.push(fcm, tokens + [None, "", "token 1"])
+
+        self.assertEqual(results, {token: None for token in tokens})
+        self.assertEqual(
+            sorted(len(call) for call in fcm.calls), [200, 500, 500]
+        )
+
+    def test_unavailable_tokens_are_retried(self):
+        fcm = FakeFCM(
+            unavailable=1,
+            errors={"gone": messaging.UnregisteredError("Unregistered")},
+        )
+
+        results = self.push(fcm, ["a", "b", "gone"])
+
+        self.assertEqual(
+            results, {"a": None, "b": None, "gone": notifications.UNREGISTERED}
+        )
+        # the unregistered token is not retried, but pruned
+        self.assertEqual(fcm.attempts, {"a": 2, "b": 2, "gone": 1})
+        self.assertEqual(self.pruned, ["gone"])
+
+    def test_an_invalid_message_prunes_no_token(self):
+        invalid = exceptions.InvalidArgumentError("Invalid data")
+        fcm = FakeFCM(errors={"a": invalid, "b": invalid})
+
+        results = self.push(fcm, ["a", "b"])
+
+        self.assertEqual(set(results.values()), {exceptions.INVALID_ARGUMENT})
+        self.assertIsNone(self.pruned)
+
+    def test_retries_are_bounded(self):
+        fcm = FakeFCM(unavailable=notifications.FCM_RETRIES + 1)
+
+        results = self.push(fcm, ["a"])
+
+        self.assertEqual(results, {"a": exceptions.UNAVAILABLE})
+        self.assertEqual(fcm.attempts["a"], notifications.FCM_RETRIES + 1)
+
+
+class TestSendToUsers(TestCase):
+    """Tests for the pushes to the devices of users"""
+
+    def test_retries_with_other_tokens_push_once(self):
+        sent: set = set()
+
+        def mark_sent(key: str) -> bool:
+            if key in sent:
+                return False
+            sent.add(key)
+            return True
+
+        outbox._running.entry_id = "entry"
+        self.addCleanup(setattr, outbox._running, "entry_id", None)
+        with mock.patch.object(
+            notifications, "_mark_sent", mark_sent
+        ), mock.patch.object(
+            notifications.device_tokens,
+            "tokens_for",
+            side_effect=[["phone"], ["phone", "new tablet"]],
+        ), mock.patch.object(
+            notifications, "push", return_value={"phone": None}
+        ) as push:
+            # a device registered between two attempts of the same entry
+            notifications.send_to_users(["a", "b"], {"title": "test"})
+            notifications.send_to_users(["b", "a"], {"title": "test"})
+
+        push.assert_called_once_with(["phone"], {"title": "test"})
+
+
+class TestMedicalNotifications(TestCase):
+    """Tests for the exam reminders"""
+
+    def test_reminders_already_due_are_skipped(self):
+        # a historic record, its 1 and 180 day reminders are past
+        exam = datetime.utcnow() - timedelta(days=200)
+
+        with mock.patch.object(
+            db, "batch", AppliedBatch, create=True
+        ), mock.patch.object(
+            notifications.scheduler, "schedule", return_value="job"
+        ) as schedule:
+            ids = notifications.add_medical_notifications(
+                exam, ["a"], {"title": "pha alert"}
+            )
+
+        self.assertEqual(ids, ["job"])
+        run_at = schedule.call_args.args[0]
+        self.assertEqual(run_at.tzinfo, timezone.utc)
+        self.assertEqual(run_at.replace(tzinfo=None), exam + timedelta(270))
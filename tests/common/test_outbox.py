@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_outbox
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from google.api_core import exceptions as api_exceptions
+from unittest import TestCase
+from werkzeug.exceptions import NotFound, ServiceUnavailable
+
+from src.common import outbox
+from src.common.database import db
+
+calls: list = []
+keys: list = []
+
+
+@outbox.task
+def succeeding_task(value: int) -> None:
+    calls.append(value)
+
+
+@outbox.task
+def keyed_task() -> Exception:
+    keys.append(outbox.idempotency_key("push"))
+    return ServiceUnavailable("FCM is unavailable")
+
+
+@outbox.task
+def failing_task() -> None:
+    return ServiceUnavailable("FCM is unavailable")
+
+
+@outbox.task
+def rejected_task() -> None:
+    return NotFound("The user was not found")
+
+
+@outbox.task
+def conflicting_task() -> None:
+    raise api_exceptions.Conflict("Too much contention")
+
+
+class RecordingBatch:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, ref, data: dict):
+        self.writes.append((ref, data))
+
+
+class TestOutbox(TestCase):
+    """Tests for the side effect outbox"""
+
+    def stage(self, function, **kwargs) -> dict:
+        batch = RecordingBatch()
+        entry = outbox.stage(batch, function, **kwargs)
+        for ref, data in batch.writes:
+            ref.set(data)
+        return entry
+
+    def test_successful_task_is_removed(self):
+        entry = self.stage(succeeding_task, value=1)
+
+        outbox._run(entry)
+
+        self.assertIn(1, calls)
+        outbox_doc = db.collection(outbox.OUTBOX).document(entry["id"]).get()
+        self.assertFalse(outbox_doc.exists)
+
+    def test_returned_error_is_retried_later(self):
+        entry = self.stage(failing_task)
+
+        outbox._run(entry)
+
+        retry = (
+            db.collection(outbox.OUTBOX).document(entry["id"]).get().to_dict()
+        )
+        self.assertEqual(retry["attempts"], 1)
+        self.assertFalse(retry["failed"])
+        self.assertGreater(retry["available_at"], outbox._now())
+
+    def test_task_fails_after_max_attempts(self):
+        entry = self.stage(failing_task)
+        entry["attempts"] = outbox.MAX_ATTEMPTS - 1
+
+        outbox._run(entry)
+
+        retry = (
+            db.collection(outbox.OUTBOX).document(entry["id"]).get().to_dict()
+        )
+        self.assertTrue(retry["failed"])
+        self.assertIsNone(retry["available_at"])
+
+    def test_permanent_error_fails_at_once(self):
+        for function, failed in (
+            (rejected_task, True),
+            (conflicting_task, False),
+        ):
+            entry = self.stage(function)
+
+            outbox._run(entry)
+
+            retry = (
+                db.collection(outbox.OUTBOX)
+                .document(entry["id"])
+                .get()
+                .to_dict()
+            )
+            self.assertEqual(retry["attempts"], 1)
+            self.assertEqual(retry["failed"], failed)
+
+    def test_unregistered_function_is_rejected(self):
+        with self.assertRaises(ValueError):
+            outbox.stage(RecordingBatch(), print)
+
+    def test_idempotency_keys_survive_retries(self):
+        entry = self.stage(keyed_task)
+
+        outbox._run(entry)
+        outbox._run(entry)
+
+        self.assertEqual(len(keys), 2)
+        self.assertEqual(keys[0], keys[1])
+        self.assertIsNone(outbox.idempotency_key("push"))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_queries
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from datetime import datetime, timezone
+import json
+import tempfile
+from unittest import TestCase, mock
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest
+
+from src.common import queries
+from src.common.queries import (
+    MAX_PAGE_LIMIT,
+    ListQuery,
+    Page,
+    check_indexes,
+)
+
+
+def write_indexes(indexes: list) -> str:
+    spec: dict = {"indexes": [], "fieldOverrides": []}
+    for collection, fields in indexes:
+        spec["indexes"].append(
+            {
+                "collectionGroup": collection,
+                "queryScope": "COLLECTION",
+                "fields": [
+                    {"fieldPath": name, "arrayConfig": "CONTAINS"}
+                    if order == "CONTAINS"
+                    else {"fieldPath": name, "order": order}
+                    for name, order in fields
+                ],
+            }
+        )
+    indexes_file = tempfile.NamedTemporaryFile(
+        "w", suffix=".json", delete=False
+    )
+    json.dump(spec, indexes_file)
+    indexes_file.close()
+    return indexes_file.name
+
+
+class TestListQuery(TestCase):
+    """Tests for the list query index check"""
+
+    def setUp(self):
+        self.registry = list(queries._registry)
+        queries._registry.clear()
+
+    def tearDown(self):
+        queries._registry[:] = self.registry
+
+    def test_shapes_cover_every_optional_filter_combination(self):
+        query = (
+            ListQuery("Files", order_by="timestamp")
+            .where("author")
+            .optional("status", type=int)
+            .optional("filetype")
+        )
+
+        self.assertEqual(
+            set(query.shapes()),
+            {
+                (frozenset({"author"}), frozenset()),
+                (frozenset({"author", "status"}), frozenset()),
+                (frozenset({"author", "filetype"}), frozenset()),
+                (frozenset({"author", "status", "filetype"}), frozenset()),
+            },
+        )
+
+    def test_missing_index_fails(self):
+        ListQuery("Files", order_by="timestamp").optional("status", type=int)
+        path = write_indexes([])
+
+        with self.assertRaises(RuntimeError) as context:
+            check_indexes(path)
+        self.assertIn(
+            "Files: status order by timestamp", str(context.exception)
+        )
+
+    def test_merged_indexes_cover_the_query(self):
+        (
+            ListQuery("Files", order_by="timestamp")
+            .where("author")
+            .optional("status", type=int)
+            .optional("filetype")
+        )
+        path = write_indexes(
+            [
+                (
+                    "Files",
+                    [("author", "ASCENDING"), ("timestamp", "DESCENDING")],
+                ),
+                (
+                    "Files",
+                    [("status", "ASCENDING"), ("timestamp", "DESCENDING")],
+                ),
+                (
+                    "Files",
+                    [("filetype", "ASCENDING"), ("timestamp", "DESCENDING")],
+                ),
+            ]
+        )
+
+        check_indexes(path)
+
+    def test_array_contains_needs_a_contains_index(self):
+        (
+            ListQuery("Scheduled-Events", order_by="timestamp").where(
+                "invitees_dod", "array_contains", value="dod"
+            )
+        )
+        ascending = write_indexes(
+            [
+                (
+                    "Scheduled-Events",
+                    [
+                        ("invitees_dod", "ASCENDING"),
+                        ("timestamp", "DESCENDING"),
+                    ],
+                )
+            ]
+        )
+        contains = write_indexes(
+            [
+                (
+                    "Scheduled-Events",
+                    [
+                        ("invitees_dod", "CONTAINS"),
+                        ("timestamp", "DESCENDING"),
+                    ],
+                )
+            ]
+        )
+
+        with self.assertRaises(RuntimeError):
+            check_indexes(ascending)
+        check_indexes(contains)
+
+    def test_page_limit_is_capped(self):
+        query = ListQuery("Files", order_by="timestamp")
+
+        self.assertEqual(query.limit(MultiDict()), 10)
+        self.assertEqual(query.limit(MultiDict({"page_limit": "5"})), 5)
+        self.assertEqual(
+            query.limit(MultiDict({"page_limit": "100000"})), MAX_PAGE_LIMIT
+        )
+
+    def test_fields_default_to_the_summary(self):
+        query = ListQuery("Files", summary=["id", "status"])
+
+        self.assertEqual(query.fields(MultiDict()), ["id", "status"])
+        self.assertEqual(
+            query.fields(MultiDict({"fields": "id, filename,"})),
+            ["id", "filename"],
+        )
+        self.assertIsNone(query.fields(MultiDict({"fields": "*"})))
+
+    def test_tampered_cursor_is_rejected(self):
+        query = ListQuery("Files", order_by="timestamp")
+
+        with self.assertRaises(BadRequest):
+            query.page(MultiDict({"cursor": "eyJGaWxlcyI6ImYxNSJ9.forged"}))
+
+    def test_cursors_need_a_secret_key(self):
+        with self.assertRaises(RuntimeError):
+            queries.init_cursors(None)
+
+    def test_cursor_resumes_after_a_deleted_document(self):
+        query = ListQuery("Files", order_by="created_at")
+        created_at = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+        last_doc = mock.Mock(id="f15")
+        last_doc.to_dict.return_value = {"created_at": created_at}
+        page = Page("Files", [last_doc], 1, "created_at")
+
+        firestore_query = mock.MagicMock()
+        for method in ("order_by", "where", "select", "start_after", "limit"):
+            getattr(firestore_query, method).return_value = firestore_query
+        with mock.patch.object(queries, "db") as db:
+            db.collection.return_value = firestore_query
+            query.build(MultiDict(), cursor=page.cursor["Files"])
+
+        # the next page starts from the cursor alone, not from the document
+        firestore_query.document.assert_not_called()
+        firestore_query.start_after.assert_called_once_with(
+            {"created_at": created_at, "__name__": "f15"}
+        )
+
+    def test_stale_unordered_cursor_is_rejected(self):
+        query = ListQuery("User")
+        cursor = queries._cursor_serializer.dumps({"User": "deleted"})
+
+        with self.assertRaises(BadRequest):
+            query.page(MultiDict({"cursor": cursor}))
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_scheduler
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+from src.common import outbox
+from src.common.database import db
+from src.common.scheduler import SCHEDULED, Scheduler, _claim
+
+
+@outbox.task
+def remind(message: str) -> None:
+    pass
+
+
+class TestScheduler(TestCase):
+    """Tests for the scheduled notification jobs"""
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.now = datetime.now(timezone.utc)
+
+    def test_jobs_are_stored_until_cancelled(self):
+        job_id = self.scheduler.schedule(
+            self.now + timedelta(days=1), remind, message="hello"
+        )
+
+        job = db.collection(SCHEDULED).document(job_id).get().to_dict()
+        self.assertEqual(job["task"], outbox.task_name(remind))
+        self.assertEqual(job["kwargs"], {"message": "hello"})
+
+        self.scheduler.cancel(job_id)
+        self.assertFalse(
+            db.collection(SCHEDULED).document(job_id).get().exists
+        )
+
+    def test_loaded_jobs_come_up_in_time_order(self):
+        self.scheduler._loaded_until = self.now + timedelta(hours=1)
+        later = self.scheduler.schedule(
+            self.now + timedelta(minutes=30), remind, message="later"
+        )
+        cancelled = self.scheduler.schedule(
+            self.now + timedelta(minutes=20), remind, message="cancelled"
+        )
+        first = self.scheduler.schedule(
+            self.now + timedelta(minutes=10), remind, message="first"
+        )
+        # jobs past the loaded window stay in Firestore until the next load
+        self.scheduler.schedule(
+            self.now + timedelta(days=1), remind, message="tomorrow"
+        )
+        self.scheduler.cancel(cancelled)
+
+        self.assertEqual(len(self.scheduler._wheel), 2)
+        order: list = self.scheduler._wheel.advance(
+            (self.now + timedelta(hours=1)).timestamp()
+        )
+        self.assertEqual(order, [first, later])
+
+    def test_only_the_lease_holder_claims_a_job_once(self):
+        job_id = self.scheduler.schedule(self.now, remind, message="now")
+        follower = Scheduler()
+        self.assertTrue(self.scheduler._lease.acquire())
+        self.assertFalse(follower._lease.acquire())
+
+        def claim(lease):
+            job_ref = db.collection(SCHEDULED).document(job_id)
+            return _claim(db.transaction(), lease, job_ref)
+
+        self.assertIsNone(claim(follower._lease))
+        self.assertTrue(db.collection(SCHEDULED).document(job_id).get().exists)
+
+        task = claim(self.scheduler._lease)
+        # the task is queued under the id of the job
+        self.assertEqual(task["id"], job_id)
+        self.assertEqual(task["kwargs"], {"message": "now"})
+        self.assertIsNone(claim(self.scheduler._lease))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_timing_wheel
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from unittest import TestCase
+
+from src.common.timing_wheel import TimingWheel
+
+
+class TestTimingWheel(TestCase):
+    """Tests for the scheduler's timing wheel"""
+
+    def setUp(self):
+        self.wheel = TimingWheel(1000, tick=1, size=8, levels=3)
+
+    def test_jobs_come_due_on_their_tick_across_levels(self):
+        # one job per level, the last one past a full turn of the second
+        self.wheel.add("soon", 1003)
+        self.wheel.add("level 1", 1020)
+        self.wheel.add("level 2", 1100)
+        self.wheel.add("late", 900)
+
+        self.assertEqual(self.wheel.advance(1001), ["late"])
+        self.assertEqual(self.wheel.advance(1019), ["soon"])
+        self.assertEqual(self.wheel.advance(1020), ["level 1"])
+        self.assertEqual(self.wheel.advance(1099), [])
+        self.assertEqual(self.wheel.advance(1100), ["level 2"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_cancelled_and_moved_jobs(self):
+        self.wheel.add("cancelled", 1010)
+        self.wheel.add("moved", 1010)
+        self.wheel.cancel("cancelled")
+        self.wheel.add("moved", 1040)
+
+        self.assertEqual(self.wheel.advance(1039), [])
+        self.assertEqual(self.wheel.advance(1040), ["moved"])
+
+    def test_jobs_past_the_horizon_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.wheel.add("too late", 1000 + 8**3)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_topics
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from firebase_admin import messaging
+from threading import Lock
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from src.common import topics
+from src.common.database import db
+
+
+class FakeTopics:
+    """Stands in for FCM topic management"""
+
+    def __init__(self, reason: str = None):
+        self.reason: str = reason
+        self.calls: list = []
+        self.lock: Lock = Lock()
+
+    def subscribe_to_topic(self, tokens: list, topic: str):
+        with self.lock:
+            self.calls.append((topic, len(tokens)))
+        errors: list = []
+        if self.reason:
+            errors = [SimpleNamespace(index=0, reason=self.reason)]
+        return SimpleNamespace(errors=errors)
+
+
+class TestTopics(TestCase):
+    """Tests for the unit and roster topics"""
+
+    def test_topic_names_only_use_allowed_characters(self):
+        self.assertEqual(topics.unit_topic("HHC 1/5"), "unit.HHC%201%2F5")
+        self.assertEqual(topics.roster_topic("Range_Day"), "roster.Range_Day")
+
+    def test_subscriptions_are_chunked(self):
+        fcm = FakeTopics()
+        tokens = ["token %d" % i for i in range(2500)]
+
+        with mock.patch.object(
+            messaging, "subscribe_to_topic", fcm.subscribe_to_topic
+        ):
+            errors = topics.subscribe("unit.A", tokens + [None, "token 1"])
+
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            sorted(fcm.calls),
+            [("unit.A", 500), ("unit.A", 1000), ("unit.A", 1000)],
+        )
+
+    def test_transient_errors_fail_the_task(self):
+        with mock.patch.object(
+            messaging,
+            "subscribe_to_topic",
+            FakeTopics("internal-error").subscribe_to_topic,
+        ):
+            failed = topics.join(topics=["unit.A"], tokens=["token"])
+        with mock.patch.object(
+            messaging,
+            "subscribe_to_topic",
+            FakeTopics("invalid-argument").subscribe_to_topic,
+        ):
+            invalid = topics.join(topics=["unit.A"], tokens=["token"])
+
+        self.assertIsInstance(failed, Exception)
+        self.assertIsNone(invalid)
+
+    def test_rosters_listing_the_user_as_data_are_found(self):
+        db.reset()
+        self.addCleanup(db.reset)
+        db.collection("Roster").document("Range_Day").set(
+            {"users": [{"uid": "a", "name": "A"}]}
+        )
+        db.collection("Roster").document("PT").set({"users": ["a", "b"]})
+        db.collection("Roster").document("Other").set({"users": ["b"]})
+
+        self.assertEqual(
+            sorted(topics.user_topics({"uid": "a", "unit_name": "HHC"})),
+            ["roster.PT", "roster.Range_Day", "unit.HHC"],
+        )
+
+    def test_a_changed_unit_moves_the_devices(self):
+        with mock.patch.object(topics.outbox, "enqueue") as enqueue:
+            topics.change_unit("a", "HHC", "HHC")
+            topics.change_unit("a", "HHC", "B Co")
+
+        self.assertEqual(
+            enqueue.call_args_list,
+            [
+                mock.call(topics.leave, topics=["unit.HHC"], uids=["a"]),
+                mock.call(topics.join, topics=["unit.B%20Co"], uids=["a"]),
+            ],
+        )
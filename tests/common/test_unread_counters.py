@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*
+"""
+    tests.common.test_unread_counters
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from unittest import TestCase, mock
+
+from src.common import unread_counters
+from src.common.database import db
+from src.common.unread_counters import UNREAD_COUNTS
+
+
+class TestUnreadCounters(TestCase):
+    """Tests for the unread notification counters"""
+
+    def setUp(self):
+        db.reset()
+
+    def tearDown(self):
+        db.reset()
+
+    def test_drifted_counters_are_repaired(self):
+        notifications = db.collection("Notification")
+        notifications.document("1").set({"receiver": "a", "read": False})
+        notifications.document("2").set({"receiver": "a", "read": False})
+        notifications.document("3").set({"receiver": "a", "read": True})
+        db.collection(UNREAD_COUNTS).document("a").set({"unread": 5})
+        db.collection(UNREAD_COUNTS).document("gone").set({"unread": 1})
+
+        self.assertEqual(unread_counters.reconcile(), 2)
+
+        self.assertEqual(unread_counters.get_unread("a"), 2)
+        self.assertEqual(unread_counters.get_unread("gone"), 0)
+        self.assertEqual(unread_counters.reconcile(), 0)
+
+    def test_notifications_added_meanwhile_are_counted(self):
+        notifications = db.collection("Notification")
+        notifications.document("1").set({"receiver": "a", "read": False})
+        db.collection(UNREAD_COUNTS).document("a").set({"unread": 5})
+        transaction = db.transaction
+
+        def notify_meanwhile():
+            # a notification written after the scan is counted by the repair
+            notifications.document("2").set({"receiver": "a", "read": False})
+            return transaction()
+
+        with mock.patch.object(db, "transaction", notify_meanwhile):
+            self.assertEqual(unread_counters.reconcile(), 1)
+
+        self.assertEqual(unread_counters.get_unread("a"), 2)
+
+    def test_a_missing_or_negative_counter_reads_zero(self):
+        db.collection(UNREAD_COUNTS).document("a").set({"unread": -1})
+
+        self.assertEqual(unread_counters.get_unread("a"), 0)
+        self.assertEqual(unread_counters.get_unread("missing"), 0)
@@ -1,3 +1,5 @@
+from functools import partial
+
 from src.common.database import db
 
 
@@ -12,3 +14,57 @@ def count_docs(collection: str) -> int:
         counter += 1
 
     return counter
+
+
+class AppliedBatch:
+    """
+    A write batch for the mock database, which has none, applying the
+    writes on commit. The mock has no update times, so the preconditions
+    are ignored.
+    """
+
+    def __init__(self):
+        self.writes = []
+
+    def create(self, ref, data: dict):
+        self.writes.append(partial(ref.set, data))
+
+    def set(self, ref, data: dict, merge: bool = False):
+        self.writes.append(partial(ref.set, data, merge=merge))
+
+    def update(self, ref, data: dict, option=None):
+        self.writes.append(partial(ref.update, data))
+
+    def delete(self, ref, option=None):
+        self.writes.append(ref.delete)
+
+    def commit(self):
+        for write in self.writes:
+            write()
+
+
+class CollectionGroup:
+    """
+    A collection group query for the mock database, which has none, over
+    the subcollections of the documents of one collection.
+    """
+
+    def __init__(self, parent: str, name: str):
+        self.parent = parent
+        self.name = name
+        self.filters = []
+
+    def where(self, field: str, op: str, value):
+        self.filters.append((field, op, value))
+        return self
+
+    def stream(self):
+        for parent in db.collection(self.parent).stream():
+            for doc in parent.reference.collection(self.name).stream():
+                if all(
+                    doc.to_dict().get(field) in value
+                    if op == "in"
+                    else doc.to_dict().get(field) == value
+                    for field, op, value in self.filters
+                ):
+                    yield doc